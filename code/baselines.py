@@ -0,0 +1,225 @@
+'''
+Linhas de base históricas de focos por território e por dia do ano.
+
+Para saber se um território está queimando mais do que o normal para
+a época, os focos do arquivo histórico de vários anos são contados
+por território e dia, em uma única passada vetorizada. Para cada dia
+do ano, guardamos a amostra com o valor de cada ano (a soma dos focos
+na janela de 1 ou 7 dias que termina naquele dia), além da média e da
+variância dessa amostra.
+
+Os arrays são salvos em formato .npy com o dia do ano como primeiro
+eixo e lidos com mapeamento de memória. Assim, pontuar um dia lê
+apenas a fatia daquele dia, e o custo diário é proporcional ao número
+de territórios, e não ao tamanho do histórico.
+'''
+
+import numpy as np
+import os
+import pandas as pd
+import warnings
+
+
+###########################
+### Rename os functions ###
+### for readability     ###
+###########################
+
+abspath = os.path.abspath
+dirname = os.path.dirname
+
+
+###############
+### Globals ###
+###############
+
+PROJECT_ROOT = dirname(abspath(dirname(__file__)))
+
+BASELINE_DIR = f"{PROJECT_ROOT}/output/baselines"
+
+# Janelas de tempo comparadas com o histórico, em dias, com o mesmo
+# rótulo das colunas de focos das tabelas de territórios
+WINDOWS = {"24h": 1, "7d": 7}
+
+DAYS_IN_YEAR = 366
+
+
+###############
+### Helpers ###
+###############
+
+def baseline_path(layer, label, name):
+    '''
+    Retorna o caminho de um dos arrays da linha de base.
+
+    Parâmetros:
+
+    > layer: o tipo de território. Exemplo: 'cod_ti'
+
+    > label: a janela de tempo. Exemplo: '7d'
+
+    > name: 'amostras', 'media' ou 'variancia'
+    '''
+
+    return f"{BASELINE_DIR}/{layer}/{label}_{name}.npy"
+
+
+def day_of_year(date):
+    '''
+    Retorna o índice do dia do ano, começando em 0. Em anos que
+    não são bissextos, os dias a partir de março são deslocados
+    em uma posição, para que cada índice seja sempre a mesma data
+    do calendário.
+    '''
+
+    date = pd.to_datetime(date)
+
+    index = date.dayofyear - 1
+
+    if not date.is_leap_year and date.month > 2:
+        index += 1
+
+    return index
+
+
+def save_array(array, fname):
+    '''
+    Salva um array .npy em um arquivo novo, sem alterar
+    o arquivo compartilhado com gerações anteriores do output.
+    '''
+
+    tmp_fname = f"{fname}.tmp-{os.getpid()}.npy"
+    np.save(tmp_fname, array)
+    os.replace(tmp_fname, fname)
+
+
+##########################
+### Funções principais ###
+##########################
+
+def build_baselines(df, layer):
+    '''
+    Calcula e salva as linhas de base de um tipo de território
+    a partir de um dataframe com focos de vários anos.
+
+    Parâmetros:
+
+    > df: dataframe com as colunas 'data' e do código do território
+
+    > layer: o tipo de território. Exemplo: 'cod_ti'
+    '''
+
+    print(f">> Building historical baselines for {layer}")
+
+    df = df[[layer, "data"]].dropna(subset=[layer])
+
+    dates = pd.to_datetime(df.data).dt.normalize()
+    codes, uniques = pd.factorize(df[layer].astype(str))
+
+    # A linha do tempo começa em 1º de janeiro para alinhar os anos, mas o
+    # arquivo pode começar depois: os dias anteriores a ele não são dias sem fogo
+    first_day = pd.Timestamp(year=dates.min().year, month=1, day=1)
+    archive_start = (dates.min() - first_day).days
+    last_day = dates.max()
+
+    # Linha do tempo contínua de focos por dia e território
+    offsets = (dates - first_day).dt.days.to_numpy()
+    n_days = (last_day - first_day).days + 1
+
+    timeline = np.zeros((n_days, len(uniques)), dtype=np.float64)
+    np.add.at(timeline, (offsets, codes), 1)
+
+    # Somas móveis por meio de somas acumuladas
+    cumulative = np.vstack([np.zeros((1, len(uniques))), np.cumsum(timeline, axis=0)])
+
+    all_days = pd.date_range(first_day, last_day, freq="D")
+    years = all_days.year - first_day.year
+    doys = np.array([day_of_year(day) for day in all_days])
+
+    os.makedirs(f"{BASELINE_DIR}/{layer}", exist_ok=True)
+
+    for label, window in WINDOWS.items():
+
+        ends = np.arange(1, n_days + 1)
+        rolled = cumulative[ends] - cumulative[np.maximum(ends - window, 0)]
+
+        # Dias cuja janela começa antes do arquivo ficam de fora
+        rolled[:archive_start + window - 1] = np.nan
+
+        # Eixos: dia do ano, território, ano. Dias que não existem ficam como NaN.
+        samples = np.full((DAYS_IN_YEAR, len(uniques), years.max() + 1), np.nan, dtype=np.float32)
+        samples[doys, :, years] = rolled
+
+        # 29 de fevereiro dos anos não bissextos recebe o valor de 28 de fevereiro
+        leap_index = day_of_year("2020-02-29")
+        missing = np.isnan(samples[leap_index])
+        samples[leap_index][missing] = samples[leap_index - 1][missing]
+
+        # Territórios sem nenhum ano com dados geram avisos de fatias vazias
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            mean = np.nanmean(samples, axis=2)
+            variance = np.nanvar(samples, axis=2, ddof=1)
+
+        save_array(samples, baseline_path(layer, label, "amostras"))
+        save_array(mean.astype(np.float32), baseline_path(layer, label, "media"))
+        save_array(variance.astype(np.float32), baseline_path(layer, label, "variancia"))
+
+    save_array(np.asarray(uniques, dtype=str), f"{BASELINE_DIR}/{layer}/codigos.npy")
+
+
+def has_baselines(layer):
+    '''
+    Verifica se as linhas de base de um tipo de território já existem.
+    '''
+
+    return os.path.isfile(f"{BASELINE_DIR}/{layer}/codigos.npy")
+
+
+def score(layer, counts, date, label):
+    '''
+    Compara os focos de cada território com o histórico do mesmo
+    dia do ano. Retorna um dataframe, indexado pelo código, com o
+    z-score e o percentil (a fração dos anos com menos focos, de 0 a 100).
+    Territórios sem histórico ou com variância zero ficam com NaN.
+
+    Parâmetros:
+
+    > layer: o tipo de território. Exemplo: 'cod_ti'
+
+    > counts: série com os focos de cada território, indexada pelo código
+
+    > date: a data do último dia da janela
+
+    > label: a janela de tempo. Exemplo: '7d'
+    '''
+
+    codes = np.load(f"{BASELINE_DIR}/{layer}/codigos.npy")
+
+    # Os arquivos grandes são mapeados em memória: apenas a fatia do dia é lida do disco
+    index = day_of_year(date)
+    samples = np.load(baseline_path(layer, label, "amostras"), mmap_mode="r")[index]
+    mean = np.load(baseline_path(layer, label, "media"), mmap_mode="r")[index]
+    variance = np.load(baseline_path(layer, label, "variancia"), mmap_mode="r")[index]
+
+    positions = pd.Index(codes).get_indexer(counts.index.astype(str))
+    known = positions >= 0
+
+    values = counts.to_numpy(dtype=float)[known]
+    rows = positions[known]
+
+    zscores = np.full(counts.shape[0], np.nan)
+    percentiles = np.full(counts.shape[0], np.nan)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        std = np.sqrt(variance[rows])
+        z = (values - mean[rows]) / std
+        zscores[known] = np.where(std > 0, z, np.nan)
+
+        history = samples[rows]
+        n_years = (~np.isnan(history)).sum(axis=1)
+        below = (history < values[:, None]).sum(axis=1)
+        percentiles[known] = np.where(n_years > 0, below / n_years * 100, np.nan)
+
+    return pd.DataFrame({"zscore": zscores.round(2), "percentil": percentiles.round(1)}, index=counts.index)
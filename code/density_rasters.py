@@ -0,0 +1,282 @@
+'''
+Rasters de densidade de focos para as camadas de zoom baixo do mapa.
+
+Os focos são contados (e, opcionalmente, somados pelo FRP) em
+uma grade de áreas iguais com numpy.histogram2d. A grade usa a
+mesma projeção e o mesmo alinhamento das células de 5km de
+grid_pyramid.py. Há um raster por dia de detecção, salvo como
+um array comprimido. Os rasters de janelas (7 dias, temporada
+inteira) são somas dos rasters diários e podem ser exportados
+como GeoTIFF, que o Mapbox aceita como tileset raster, e como
+PNG para conferência.
+'''
+
+import grid_pyramid
+import matplotlib.pyplot as plt
+import numpy as np
+import os
+from osgeo import gdal, osr
+import pandas as pd
+import shutil
+
+
+###########################
+### Rename os functions ###
+### for readability     ###
+###########################
+
+abspath = os.path.abspath
+dirname = os.path.dirname
+
+
+###############
+### Globals ###
+###############
+
+PROJECT_ROOT = dirname(abspath(dirname(__file__)))
+
+RASTER_DIR = f"{PROJECT_ROOT}/output/rasters"
+
+# Tamanho do lado de cada pixel, em metros
+CELL_SIZE = grid_pyramid.BASE_SIZE
+
+# Caixa que contém a Amazônia Legal, em graus (oeste, sul, leste, norte)
+BOUNDS = (-74.0, -18.1, -43.9, 5.3)
+
+
+###############
+### Helpers ###
+###############
+
+def raster_edges(cell_size=CELL_SIZE):
+    '''
+    Retorna os limites dos pixels do raster na projeção de
+    áreas iguais, alinhados às células de grid_pyramid.
+    '''
+
+    west, south, east, north = BOUNDS
+
+    # Projeta o contorno da caixa com vários pontos, já que as bordas se curvam
+    lons = np.concatenate([np.linspace(west, east, 100), np.full(100, east), np.linspace(east, west, 100), np.full(100, west)])
+    lats = np.concatenate([np.full(100, south), np.linspace(south, north, 100), np.full(100, north), np.linspace(north, south, 100)])
+
+    x, y = grid_pyramid.TO_EQUAL_AREA.transform(lons, lats)
+
+    x_edges = np.arange(np.floor(x.min() / cell_size), np.ceil(x.max() / cell_size) + 1) * cell_size
+    y_edges = np.arange(np.floor(y.min() / cell_size), np.ceil(y.max() / cell_size) + 1) * cell_size
+
+    return x_edges, y_edges
+
+
+def day_path(day):
+    '''
+    Retorna o caminho do raster de um dia, no formato 'AAAA-MM-DD'.
+    '''
+
+    return f"{RASTER_DIR}/dias/{day}.npz"
+
+
+##########################
+### Funções principais ###
+##########################
+
+def density(longitudes, latitudes, weights=None, cell_size=CELL_SIZE):
+    '''
+    Conta os focos em cada pixel do raster. Retorna um array
+    no formato (linhas, colunas), com o norte na primeira linha.
+
+    Parâmetros:
+
+    > longitudes, latitudes: arrays com as coordenadas dos focos
+
+    > weights: pesos opcionais, como o FRP de cada foco
+
+    > cell_size: tamanho do lado de cada pixel, em metros
+    '''
+
+    x_edges, y_edges = raster_edges(cell_size)
+
+    x, y = grid_pyramid.TO_EQUAL_AREA.transform(np.asarray(longitudes, dtype=float), np.asarray(latitudes, dtype=float))
+
+    counts, _, _ = np.histogram2d(x, y, bins=[x_edges, y_edges], weights=weights)
+
+    # O histogram2d indexa por [x, y]. Imagens são indexadas por [linha, coluna], de cima para baixo.
+    return np.flipud(counts.T).astype(np.float32)
+
+
+def add_daily_rasters(df):
+    '''
+    Soma os focos de um dataframe aos rasters diários
+    dos dias em que eles foram detectados. Cada raster
+    guarda a contagem de focos e a soma do FRP.
+
+    Parâmetros:
+
+    > df: um dataframe com os focos novos
+    '''
+
+    print(">> Updating density rasters")
+
+    os.makedirs(f"{RASTER_DIR}/dias", exist_ok=True)
+
+    days = pd.to_datetime(df.data).dt.strftime("%Y-%m-%d")
+
+    for day, subset in df.groupby(days):
+
+        focos = density(subset.longitude, subset.latitude)
+        frp = density(subset.longitude, subset.latitude, weights=subset.frp.fillna(0).to_numpy())
+
+        fname = day_path(day)
+
+        if os.path.isfile(fname):
+            with np.load(fname) as previous:
+                focos += previous["focos"]
+                frp += previous["frp"]
+
+        # Escreve em um arquivo novo, para não alterar gerações anteriores do output
+        tmp_fname = f"{fname[:-len('.npz')]}.tmp-{os.getpid()}.npz"
+        np.savez_compressed(tmp_fname, focos=focos, frp=frp)
+        os.replace(tmp_fname, fname)
+
+
+def compact_daily_rasters(first_day):
+    '''
+    Remove os rasters de dias anteriores à janela de retenção.
+
+    Parâmetros:
+
+    > first_day: o primeiro dia que deve ser mantido, no formato 'AAAA-MM-DD'
+    '''
+
+    directory = f"{RASTER_DIR}/dias"
+
+    if not os.path.isdir(directory):
+        return
+
+    for fname in os.listdir(directory):
+        if fname.endswith(".npz") and fname[:-len(".npz")] < first_day:
+            os.remove(f"{directory}/{fname}")
+
+
+def rebuild_daily_rasters(df):
+    '''
+    Recria do zero os rasters diários a partir
+    do banco de dados completo.
+
+    Parâmetros:
+
+    > df: um dataframe com todos os focos
+    '''
+
+    if os.path.isdir(f"{RASTER_DIR}/dias"):
+        shutil.rmtree(f"{RASTER_DIR}/dias")
+
+    add_daily_rasters(df)
+
+
+def window_raster(first_day, last_day, layer="focos"):
+    '''
+    Soma os rasters diários entre duas datas (inclusive).
+
+    Parâmetros:
+
+    > first_day, last_day: os limites da janela, no formato 'AAAA-MM-DD'
+
+    > layer: 'focos', para a contagem, ou 'frp', para a soma do FRP
+    '''
+
+    x_edges, y_edges = raster_edges()
+    total = np.zeros((len(y_edges) - 1, len(x_edges) - 1), dtype=np.float32)
+
+    directory = f"{RASTER_DIR}/dias"
+
+    for fname in sorted(os.listdir(directory)) if os.path.isdir(directory) else [ ]:
+
+        day = fname[:-len(".npz")]
+
+        if fname.endswith(".npz") and first_day <= day <= last_day:
+            with np.load(f"{directory}/{fname}") as data:
+                total += data[layer]
+
+    return total
+
+
+def save_geotiff(raster, fname, cell_size=CELL_SIZE):
+    '''
+    Salva um raster como GeoTIFF na projeção de áreas iguais.
+
+    Parâmetros:
+
+    > raster: o array retornado por density ou window_raster
+
+    > fname: o caminho do arquivo de destino
+    '''
+
+    x_edges, y_edges = raster_edges(cell_size)
+
+    driver = gdal.GetDriverByName("GTiff")
+    dataset = driver.Create(fname, raster.shape[1], raster.shape[0], 1, gdal.GDT_Float32, options=["COMPRESS=DEFLATE"])
+
+    # Canto superior esquerdo e tamanho dos pixels
+    dataset.SetGeoTransform((x_edges[0], cell_size, 0, y_edges[-1], 0, -cell_size))
+
+    srs = osr.SpatialReference()
+    srs.ImportFromProj4(grid_pyramid.EQUAL_AREA)
+    dataset.SetProjection(srs.ExportToWkt())
+
+    band = dataset.GetRasterBand(1)
+    band.WriteArray(raster)
+    band.SetNoDataValue(0)
+
+    dataset.FlushCache()
+    dataset = None
+
+
+def save_png(raster, fname):
+    '''
+    Salva um raster como imagem PNG, em escala logarítmica,
+    com pixels sem focos transparentes.
+    '''
+
+    image = np.ma.masked_equal(np.log1p(raster), 0)
+
+    plt.imsave(fname, image, cmap="inferno")
+
+
+def export_windows(last_day, windows=None):
+    '''
+    Exporta os rasters de densidade das janelas de tempo que terminam
+    em 'last_day' como GeoTIFF e PNG.
+
+    Parâmetros:
+
+    > last_day: o último dia das janelas, no formato 'AAAA-MM-DD'
+
+    > windows: dicionário no formato {nome: quantidade de dias}. Uma janela com
+    None dias cobre todos os rasters diários salvos. Se for None, exporta
+    as janelas de 24h, 7 dias e do banco completo.
+    '''
+
+    if windows is None:
+        windows = {"24h": 1, "7d": 7, "bd_completo": None}
+
+    print(">> Exporting density rasters")
+
+    for name, n_days in windows.items():
+
+        if n_days is None:
+            first_day = "0000-00-00"
+        else:
+            first_day = (pd.to_datetime(last_day) - pd.Timedelta(days=n_days - 1)).strftime("%Y-%m-%d")
+
+        raster = window_raster(first_day, last_day)
+
+        for extension, writer in (("tif", save_geotiff), ("png", save_png)):
+
+            fname = f"{RASTER_DIR}/densidade_{name}.{extension}"
+
+            # Escreve em um arquivo novo, para não alterar gerações anteriores do output
+            if os.path.isfile(fname):
+                os.remove(fname)
+
+            writer(raster, fname)
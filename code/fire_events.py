@@ -0,0 +1,282 @@
+'''
+Agrupa os focos de fogo em eventos (incêndios) no espaço e no tempo.
+
+Uma frente de fogo grande aparece como centenas de detecções do
+VIIRS. Aqui, dois focos pertencem ao mesmo evento quando estão
+em células vizinhas de uma grade de ~1km (em uma projeção de áreas
+iguais) no mesmo dia ou em dias seguidos. As células funcionam como
+um hash espacial: os vizinhos de cada célula são encontrados por
+junções de tabelas, sem comparar todos os pares de pontos, e os
+componentes conexos são calculados com uma union-find vetorizada.
+O custo é aproximadamente linear no número de focos.
+
+O agrupamento é incremental: os focos novos são agrupados junto com
+os focos dos dias mais recentes já atribuídos a eventos (a "fronteira"),
+herdando os identificadores dos eventos que tocam. Quando um foco novo
+une dois eventos antigos, eles passam a ter o mesmo identificador.
+'''
+
+import grid_pyramid
+import numpy as np
+import pandas as pd
+
+
+###############
+### Globals ###
+###############
+
+# Lado das células do hash espacial, em metros. Cerca de três pixels do VIIRS.
+EVENT_CELL = 1_000
+
+# Lado dos pixels do VIIRS, em metros, usado para estimar a área queimada
+PIXEL_SIZE = 375
+
+# Quantos dias sem focos vizinhos encerram um evento
+MAX_GAP_DAYS = 1
+
+# Tipos de território listados na tabela de eventos
+TERRITORY_COLUMNS = ["cod_ti", "cod_uc", "cod_cidade"]
+
+
+###############
+### Helpers ###
+###############
+
+def quantize(longitudes, latitudes, size):
+    '''
+    Retorna os índices de coluna e linha das células
+    de lado 'size' (em metros) que contêm cada ponto.
+    '''
+
+    x, y = grid_pyramid.TO_EQUAL_AREA.transform(np.asarray(longitudes, dtype=float), np.asarray(latitudes, dtype=float))
+
+    return np.floor(x / size).astype(np.int64), np.floor(y / size).astype(np.int64)
+
+
+def day_numbers(dates):
+    '''
+    Converte datas em números inteiros de dias.
+    '''
+
+    return pd.to_datetime(pd.Series(dates)).dt.normalize().to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def connected_components(n_nodes, sources, targets):
+    '''
+    Union-find vetorizada. Retorna, para cada nó, o menor
+    índice do componente conexo ao qual ele pertence.
+
+    Em cada rodada, a raiz maior de cada aresta é pendurada
+    na raiz menor, e os caminhos são encurtados por saltos
+    de ponteiros. O número de rodadas é pequeno, já que as
+    árvores são achatadas a cada rodada.
+    '''
+
+    parent = np.arange(n_nodes)
+
+    while True:
+
+        roots_a, roots_b = parent[sources], parent[targets]
+
+        pending = roots_a != roots_b
+
+        if not pending.any():
+            return parent
+
+        low = np.minimum(roots_a[pending], roots_b[pending])
+        high = np.maximum(roots_a[pending], roots_b[pending])
+
+        np.minimum.at(parent, high, low)
+
+        # Saltos de ponteiros até que cada nó aponte para a sua raiz
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+
+
+def neighbor_edges(nodes):
+    '''
+    Encontra os pares de nós (células com foco em um dia) que
+    são vizinhos: células adjacentes (incluindo diagonais) no
+    mesmo dia ou com até MAX_GAP_DAYS dias de diferença.
+
+    Parâmetros:
+
+    > nodes: dataframe com as colunas 'cx', 'cy' e 'dia', sem repetições
+    '''
+
+    keyed = nodes.reset_index(drop=True).reset_index().rename(columns={"index": "node"})
+
+    sources, targets = [ ], [ ]
+
+    for dd in range(0, MAX_GAP_DAYS + 1):
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+
+                # Cada par só precisa ser visto uma vez
+                if dd == 0 and (dx, dy) <= (0, 0):
+                    continue
+
+                shifted = keyed.assign(cx=keyed.cx + dx, cy=keyed.cy + dy, dia=keyed.dia + dd)
+
+                pairs = shifted.merge(keyed, on=["cx", "cy", "dia"], suffixes=("_a", "_b"))
+
+                sources.append(pairs.node_a.to_numpy())
+                targets.append(pairs.node_b.to_numpy())
+
+    return np.concatenate(sources), np.concatenate(targets)
+
+
+##########################
+### Funções principais ###
+##########################
+
+def assign_events(new_points, frontier, next_id):
+    '''
+    Atribui cada foco novo a um evento. Retorna uma tupla com
+    o array de eventos dos focos novos, um dicionário com os eventos
+    antigos que foram unidos a outro ({evento antigo: evento novo})
+    e o próximo identificador livre.
+
+    Parâmetros:
+
+    > new_points: dataframe com as colunas 'cx', 'cy' e 'dia' dos focos novos
+
+    > frontier: dataframe com as colunas 'cx', 'cy', 'dia' e 'evento'
+    dos focos recentes que já pertencem a eventos
+
+    > next_id: o primeiro identificador que pode ser dado a um evento novo
+    '''
+
+    points = pd.concat([
+        new_points[["cx", "cy", "dia"]].assign(evento=-1),
+        frontier[["cx", "cy", "dia", "evento"]],
+    ], ignore_index=True)
+
+    # Cada célula com foco em um dia é um nó do grafo
+    # (os nós são numerados na ordem em que aparecem, a mesma do drop_duplicates)
+    node_of_point = points.groupby(["cx", "cy", "dia"], sort=False).ngroup().to_numpy()
+    nodes = points[["cx", "cy", "dia"]].drop_duplicates()
+
+    sources, targets = neighbor_edges(nodes)
+
+    # Focos antigos do mesmo evento já estão ligados, mesmo que por
+    # dias que ficaram fora da fronteira
+    existing = points.evento.to_numpy()
+    old = existing >= 0
+
+    old_nodes = pd.Series(node_of_point[old])
+    first_node = old_nodes.groupby(existing[old]).transform("first")
+
+    sources = np.concatenate([sources, old_nodes.to_numpy()])
+    targets = np.concatenate([targets, first_node.to_numpy()])
+
+    components = connected_components(nodes.shape[0], sources, targets)[node_of_point]
+
+    # O evento de cada componente é o menor evento antigo que ele contém
+
+    inherited = pd.Series(existing[old]).groupby(components[old]).min()
+
+    labels = pd.Series(components).map(inherited)
+
+    # Componentes sem eventos antigos são eventos novos
+    unlabeled = labels.isna()
+    new_components, _ = pd.factorize(pd.Series(components[unlabeled.to_numpy()]))
+    labels[unlabeled] = next_id + new_components
+
+    labels = labels.to_numpy().astype(np.int64)
+
+    next_id = next_id + (new_components.max() + 1 if new_components.size else 0)
+
+    merges = {int(a): int(b) for a, b in zip(existing[old], labels[old]) if a != b}
+
+    return labels[:new_points.shape[0]], merges, next_id
+
+
+def update_events(new_rows, assignments=None):
+    '''
+    Acrescenta os focos novos à tabela que liga cada foco a um
+    evento e a retorna. Apenas os focos novos e os focos dos
+    eventos que ainda podem crescer são agrupados.
+
+    Parâmetros:
+
+    > new_rows: dataframe com os focos novos, sem duplicatas
+
+    > assignments: a tabela retornada pela execução anterior, ou None
+    para agrupar todos os focos do zero
+    '''
+
+    print(">> Clustering fire events")
+
+    columns = ["uuid", "data", "latitude", "longitude", "frp"] + TERRITORY_COLUMNS
+
+    new_rows = new_rows[columns].reset_index(drop=True)
+    new_rows["data"] = new_rows["data"].astype(str)
+
+    new_rows["cx"], new_rows["cy"] = quantize(new_rows.longitude, new_rows.latitude, EVENT_CELL)
+    new_rows["dia"] = day_numbers(new_rows.data)
+
+    if assignments is None or assignments.shape[0] == 0:
+        assignments = new_rows.iloc[:0].assign(evento=np.array([], dtype=np.int64))
+
+    if new_rows.shape[0] == 0:
+        return assignments
+
+    # Só os focos que estão a até MAX_GAP_DAYS dias dos novos podem se ligar a eles
+    first_new_day = new_rows.dia.min() - MAX_GAP_DAYS
+    frontier = assignments[assignments.dia >= first_new_day]
+
+    next_id = int(assignments.evento.max()) + 1 if assignments.shape[0] else 0
+
+    new_rows["evento"], merges, _ = assign_events(new_rows, frontier, next_id)
+
+    if merges:
+        assignments = assignments.assign(evento=assignments.evento.replace(merges))
+
+    return pd.concat([assignments, new_rows], ignore_index=True)
+
+
+def summarize_events(assignments):
+    '''
+    Calcula a tabela de eventos: início, fim, duração em dias,
+    quantidade de focos, área estimada (pixels distintos do VIIRS),
+    FRP total, posição média, territórios atingidos e se o
+    evento ainda está ativo (teve focos no último dia dos dados).
+
+    Parâmetros:
+
+    > assignments: a tabela retornada por update_events
+    '''
+
+    print(">> Summarizing fire events")
+
+    # Pixels distintos, para não contar duas vezes a mesma área queimada em dias diferentes
+    px, py = quantize(assignments.longitude, assignments.latitude, PIXEL_SIZE)
+    pixels = pd.DataFrame({"evento": assignments.evento.to_numpy(), "px": px, "py": py}).drop_duplicates()
+    area = pixels.groupby("evento").size() * (PIXEL_SIZE / 1000) ** 2
+
+    grouped = assignments.groupby("evento")
+
+    events = grouped.agg(
+        inicio=("data", "min"),
+        fim=("data", "max"),
+        focos=("uuid", "size"),
+        frp_total=("frp", "sum"),
+        latitude=("latitude", "mean"),
+        longitude=("longitude", "mean"),
+    )
+
+    events["duracao_dias"] = (pd.to_datetime(events.fim) - pd.to_datetime(events.inicio)).dt.days + 1
+    events["area_km2"] = area.reindex(events.index).round(3)
+
+    # Territórios atingidos, como listas de códigos separados por vírgulas
+    for column in TERRITORY_COLUMNS:
+        touched = assignments.dropna(subset=[column]).drop_duplicates(["evento", column])
+        events[column] = touched[column].astype(str).groupby(touched.evento).agg(lambda codes: ",".join(sorted(codes)))
+
+    events["ativo"] = events.fim == assignments.data.max()
+
+    return events.reset_index()
@@ -0,0 +1,304 @@
+'''
+Gerencia as "gerações" do diretório de output.
+
+Em vez de copiar o diretório output inteiro antes de cada
+atualização (e de volta, em caso de erro), cada execução escreve
+em uma geração nova, dentro de output_generations. A geração nova
+começa como uma cópia feita de hardlinks da anterior, de forma
+que arquivos que não mudam não ocupam espaço nem tempo de cópia.
+
+O caminho output passa a ser um link simbólico para a geração
+de trabalho. A publicação (o antigo cp -r para o diretório estático)
+é apenas a troca atômica de outro link simbólico, e desfazer uma
+publicação é apontar esse link de volta para a geração anterior.
+
+Uso pela linha de comando:
+
+python generations.py publish /caminho/do/diretorio/estatico
+python generations.py rollback /caminho/do/diretorio/estatico
+'''
+
+from datetime import datetime
+import os
+import shutil
+import sys
+
+
+###########################
+### Rename os functions ###
+### for readability     ###
+###########################
+
+abspath = os.path.abspath
+dirname = os.path.dirname
+
+
+###############
+### Globals ###
+###############
+
+PROJECT_ROOT = dirname(abspath(dirname(__file__)))
+
+OUTPUT = f"{PROJECT_ROOT}/output"
+
+GENERATIONS = f"{PROJECT_ROOT}/output_generations"
+
+# Quantas gerações antigas mantemos em disco, além da atual e da publicada
+KEEP_GENERATIONS = 7
+
+
+###############
+### Helpers ###
+###############
+
+def list_generations():
+    '''
+    Retorna os caminhos de todas as gerações existentes,
+    da mais antiga para a mais recente. Os nomes são
+    timestamps, então a ordem alfabética é a cronológica.
+    '''
+
+    if not os.path.isdir(GENERATIONS):
+        return []
+
+    names = sorted(name for name in os.listdir(GENERATIONS) if not name.startswith("."))
+
+    return [f"{GENERATIONS}/{name}" for name in names]
+
+
+def current_generation():
+    '''
+    Retorna o caminho real da geração para a qual
+    o diretório output aponta, ou None caso output
+    ainda seja um diretório comum.
+    '''
+
+    if not os.path.islink(OUTPUT):
+        return None
+
+    return os.path.realpath(OUTPUT)
+
+
+def swap_symlink(link, target):
+    '''
+    Faz o link simbólico 'link' apontar para 'target'
+    de forma atômica: um link temporário é criado ao lado
+    e renomeado por cima do antigo. Quem lê o caminho
+    vê sempre a versão anterior ou a nova, nunca um meio termo.
+    '''
+
+    tmp_link = f"{link}.tmp-{os.getpid()}"
+
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link)
+
+
+def hardlink_tree(src, dst):
+    '''
+    Recria a árvore de diretórios de 'src' em 'dst', usando
+    hardlinks para os arquivos. Nenhum byte de dado é copiado.
+    '''
+
+    for root, dirs, files in os.walk(src):
+
+        relative = os.path.relpath(root, src)
+        new_root = os.path.normpath(f"{dst}/{relative}")
+
+        os.makedirs(new_root, exist_ok=True)
+
+        for file in files:
+            os.link(f"{root}/{file}", f"{new_root}/{file}")
+
+
+def detach(path, keep_contents=False):
+    '''
+    Deve ser chamada antes de escrever em qualquer arquivo do output.
+
+    Como as gerações compartilham arquivos por hardlink, escrever
+    no arquivo existente alteraria também as gerações anteriores
+    (inclusive a publicada). Essa função desfaz o compartilhamento:
+    remove o link, para que a escrita crie um arquivo novo, ou,
+    se 'keep_contents' for verdadeiro (arquivos abertos em modo de
+    append), substitui o link por uma cópia privada do conteúdo.
+
+    Parâmetros:
+
+    > path: o caminho do arquivo que será escrito
+
+    > keep_contents: se o conteúdo atual deve ser preservado
+    '''
+
+    if not os.path.isfile(path) or os.stat(path).st_nlink < 2:
+        return
+
+    if keep_contents:
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.copy2(path, tmp_path)
+        os.replace(tmp_path, path)
+
+    else:
+        os.remove(path)
+
+
+##########################
+### Funções principais ###
+##########################
+
+def begin_generation():
+    '''
+    Cria uma nova geração a partir da atual, usando hardlinks,
+    e aponta o diretório output para ela. Retorna o caminho
+    da geração anterior, que serve para desfazer a operação.
+
+    Na primeira execução, output ainda é um diretório comum.
+    Ele é movido para dentro de output_generations e vira
+    a primeira geração.
+    '''
+
+    os.makedirs(GENERATIONS, exist_ok=True)
+
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+    if not os.path.islink(OUTPUT):
+        first_generation = f"{GENERATIONS}/{stamp}-inicial"
+        os.rename(OUTPUT, first_generation)
+        os.symlink(first_generation, OUTPUT)
+
+    previous = current_generation()
+
+    new = f"{GENERATIONS}/{stamp}"
+    hardlink_tree(previous, new)
+
+    swap_symlink(OUTPUT, new)
+
+    return previous
+
+
+def rollback_generation(previous):
+    '''
+    Descarta a geração de trabalho, que pode estar pela metade,
+    e volta ao estado de 'previous'. Para que as etapas seguintes
+    do fluxo não escrevam dentro de uma geração que pode estar
+    publicada, o trabalho continua em uma geração nova, idêntica
+    à anterior.
+
+    Parâmetros:
+
+    > previous: o caminho retornado por begin_generation
+    '''
+
+    failed = current_generation()
+
+    swap_symlink(OUTPUT, previous)
+
+    if failed and failed != previous:
+        shutil.rmtree(failed)
+
+    begin_generation()
+
+
+def publish(target):
+    '''
+    Publica a geração atual no caminho 'target' (por exemplo,
+    o diretório servido como output estático), trocando um
+    link simbólico de forma atômica. A geração publicada
+    anteriormente fica registrada em 'target'.previous, para
+    que possa ser restaurada por rollback_publication.
+
+    Depois da publicação, output passa a apontar para uma geração
+    de trabalho nova. Assim, scripts que rodam antes do próximo
+    process_data.py (como update_tweet_data.py ou update_land_datasets.py)
+    não escrevem dentro da geração publicada: detach só separa arquivos
+    compartilhados por hardlink, e sem a geração nova os arquivos da
+    geração publicada não teriam com quem estar compartilhados.
+
+    Parâmetros:
+
+    > target: o caminho em que o output deve ser publicado
+    '''
+
+    generation = current_generation()
+    assert generation, "output não é uma geração. Execute process_data.py primeiro."
+
+    target = abspath(target)
+
+    # A primeira publicação encontra um diretório comum no lugar do link
+    if os.path.isdir(target) and not os.path.islink(target):
+        os.rename(target, f"{target}_legado")
+
+    if os.path.islink(target):
+        swap_symlink(f"{target}.previous", os.path.realpath(target))
+
+    swap_symlink(target, generation)
+
+    begin_generation()
+
+    prune_generations(keep=[generation, os.path.realpath(f"{target}.previous")])
+
+
+def rollback_publication(target):
+    '''
+    Volta a publicação em 'target' para a geração
+    publicada antes da atual.
+
+    Parâmetros:
+
+    > target: o caminho em que o output foi publicado
+    '''
+
+    target = abspath(target)
+
+    assert os.path.islink(f"{target}.previous"), "não há publicação anterior registrada"
+
+    previous = os.path.realpath(f"{target}.previous")
+
+    swap_symlink(f"{target}.previous", os.path.realpath(target))
+    swap_symlink(target, previous)
+
+
+def prune_generations(keep):
+    '''
+    Remove gerações antigas, mantendo as KEEP_GENERATIONS
+    mais recentes e todas as que estão em 'keep'.
+
+    Parâmetros:
+
+    > keep: lista de caminhos de gerações que não podem ser removidas
+    '''
+
+    keep = set(keep)
+
+    current = current_generation()
+    if current:
+        keep.add(current)
+
+    old_generations = list_generations()[:-KEEP_GENERATIONS]
+
+    for generation in old_generations:
+        if generation not in keep:
+            print(f"> Removing old generation {generation}")
+            shutil.rmtree(generation)
+
+
+################
+### Execução ###
+################
+
+def main(argv):
+
+    if len(argv) != 3 or argv[1] not in ("publish", "rollback"):
+        print("Usage: python generations.py [publish|rollback] path/to/static-output")
+        sys.exit(1)
+
+    if argv[1] == "publish":
+        publish(argv[2])
+
+    elif argv[1] == "rollback":
+        rollback_publication(argv[2])
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,420 @@
+'''
+Escritor de GeoJSON em streaming.
+
+O GeoDataFrame.to_file(driver="GeoJSON") passa pelo Fiona/GDAL,
+que converte e escreve os dados feição por feição, sempre com
+a precisão completa das coordenadas. Esse módulo serializa
+as feições diretamente a partir dos arrays de coordenadas e das
+colunas de propriedades, com arredondamento configurável das
+coordenadas, uma lista opcional de propriedades e saída opcional
+em gzip. Os focos também podem ser lidos de um arquivo feather e
+enviados, linha a linha, para outro processo.
+
+Para comparar com o caminho do Fiona:
+
+python geojson_stream.py benchmark
+'''
+
+from generations import detach
+import gzip
+import json
+from json.encoder import encode_basestring
+import math
+import numpy as np
+import os
+import pandas as pd
+from pyarrow import feather
+import sys
+import time
+
+
+###########################
+### Rename os functions ###
+### for readability     ###
+###########################
+
+abspath = os.path.abspath
+dirname = os.path.dirname
+
+
+###############
+### Globals ###
+###############
+
+PROJECT_ROOT = dirname(abspath(dirname(__file__)))
+
+# Seis casas decimais equivalem a cerca de 10cm no equador,
+# bem abaixo da resolução de 375m dos pixels do VIIRS
+DEFAULT_PRECISION = 6
+
+# Quantas feições são serializadas de cada vez. Só um bloco
+# fica em memória como texto enquanto o arquivo é escrito.
+CHUNK_ROWS = 10_000
+
+
+###############
+### Helpers ###
+###############
+
+def serialize_value(value):
+    '''
+    Transforma um valor de uma coluna em um fragmento JSON.
+    Valores nulos do pandas (NaN, NaT e None) e números não
+    finitos, que não existem em JSON, viram null.
+    '''
+
+    if value is None:
+        return "null"
+
+    # Caso mais comum, tratado pela implementação em C do módulo json
+    if isinstance(value, str):
+        return encode_basestring(value)
+
+    if isinstance(value, float) and not math.isfinite(value):
+        return "null"
+
+    try:
+        return json.dumps(value, ensure_ascii=False)
+
+    # Tipos que o json não conhece, como datas e horários
+    except TypeError:
+        if str(value) in ("NaT", "nan"):
+            return "null"
+        return json.dumps(str(value), ensure_ascii=False)
+
+
+def serialize_column(series):
+    '''
+    Serializa uma coluna inteira de uma vez. Colunas de ponto
+    flutuante são convertidas diretamente. Nas demais, cada valor
+    distinto é serializado uma única vez e o resultado é repetido
+    para todas as linhas com o mesmo valor, o que é muito mais
+    rápido para colunas como nomes de territórios e códigos.
+    '''
+
+    # O repr de infinito ('inf') não é JSON válido, então também vira null
+    if series.dtype.kind == "f":
+        values = series.to_numpy()
+        serialized = np.array([repr(value) for value in values.tolist()], dtype=object)
+        serialized[~np.isfinite(values)] = "null"
+        return serialized
+
+    # Valores nulos recebem o código -1, que aponta para o último item do array
+    codes, uniques = pd.factorize(series)
+    fragments = np.array([serialize_value(value) for value in np.asarray(uniques, dtype=object).tolist()] + ["null"], dtype=object)
+
+    return fragments[codes]
+
+
+def serialize_properties(gdf, properties):
+    '''
+    Serializa as propriedades de todas as feições, coluna a
+    coluna. Retorna uma lista com o objeto "properties" de
+    cada feição já em formato de texto.
+
+    Parâmetros:
+
+    > gdf: o geodataframe
+
+    > properties: lista com as colunas que devem ser exportadas
+    '''
+
+    if not properties:
+        return ["{}"] * gdf.shape[0]
+
+    columns = [ ]
+
+    for column in properties:
+        key = json.dumps(str(column), ensure_ascii=False)
+        columns.append(f"{key}: " + serialize_column(gdf[column]))
+
+    return ["{" + ", ".join(row) + "}" for row in zip(*columns)]
+
+
+def round_coordinates(coordinates, precision):
+    '''
+    Arredonda, recursivamente, as coordenadas de uma
+    geometria no formato __geo_interface__.
+    '''
+
+    if isinstance(coordinates[0], (float, int)):
+        return [round(value, precision) for value in coordinates]
+
+    return [round_coordinates(item, precision) for item in coordinates]
+
+
+def serialize_geometries(geometries, precision):
+    '''
+    Serializa a coluna de geometria. Pontos são tratados de forma
+    vetorizada, a partir dos arrays de coordenadas. Outros tipos
+    de geometria (os polígonos dos territórios) são convertidos
+    a partir da sua representação __geo_interface__.
+
+    Parâmetros:
+
+    > geometries: uma GeoSeries
+
+    > precision: o número de casas decimais das coordenadas
+    '''
+
+    is_point = (geometries.geom_type == "Point").to_numpy()
+
+    serialized = [None] * len(geometries)
+
+    if is_point.any():
+
+        points = geometries[is_point]
+
+        xs = np.round(points.x.to_numpy(), precision).tolist()
+        ys = np.round(points.y.to_numpy(), precision).tolist()
+
+        for position, x, y in zip(np.flatnonzero(is_point), xs, ys):
+            serialized[position] = f'{{"type": "Point", "coordinates": [{x}, {y}]}}'
+
+    for position in np.flatnonzero(~is_point):
+
+        geometry = geometries.iloc[position]
+
+        if geometry is None or geometry.is_empty:
+            serialized[position] = "null"
+            continue
+
+        mapping = geometry.__geo_interface__
+
+        if mapping["type"] == "GeometryCollection":
+            serialized[position] = json.dumps(mapping)
+            continue
+
+        serialized[position] = json.dumps({
+            "type": mapping["type"],
+            "coordinates": round_coordinates(mapping["coordinates"], precision)
+        })
+
+    return serialized
+
+
+def iter_feature_chunks(gdf, precision=DEFAULT_PRECISION, properties=None, chunk_rows=CHUNK_ROWS):
+    '''
+    Gera as feições do geodataframe já em texto, em listas de
+    até chunk_rows feições. Cada bloco é serializado só quando
+    é pedido, então o documento inteiro nunca fica em memória.
+
+    Parâmetros:
+
+    > gdf: o geodataframe que será serializado
+
+    > precision: número de casas decimais das coordenadas
+
+    > properties: lista com as colunas que devem ser exportadas.
+    Se for None, todas as colunas, exceto a geometria, são exportadas.
+
+    > chunk_rows: quantidade máxima de feições de cada bloco
+    '''
+
+    if properties is None:
+        properties = [column for column in gdf.columns if column != gdf.geometry.name]
+
+    for start in range(0, gdf.shape[0], chunk_rows):
+
+        chunk = gdf.iloc[start:start + chunk_rows]
+
+        geometries = serialize_geometries(chunk.geometry, precision)
+        props = serialize_properties(chunk, properties)
+
+        yield [
+            f'{{"type": "Feature", "properties": {prop}, "geometry": {geometry}}}'
+            for geometry, prop in zip(geometries, props)
+        ]
+
+
+def iter_features(gdf, precision=DEFAULT_PRECISION, properties=None):
+    '''
+    Gera, uma a uma, as feições do geodataframe já em texto.
+    Os parâmetros são os de iter_feature_chunks.
+    '''
+
+    for chunk in iter_feature_chunks(gdf, precision, properties):
+        yield from chunk
+
+
+##########################
+### Funções principais ###
+##########################
+
+def write_geojson(gdf, fname, precision=DEFAULT_PRECISION, properties=None, compress=False):
+    '''
+    Escreve um geodataframe como um FeatureCollection GeoJSON.
+    O arquivo é escrito em um caminho temporário e renomeado ao
+    final, para que ninguém leia um arquivo pela metade.
+
+    Parâmetros:
+
+    > gdf: o geodataframe que será salvo
+
+    > fname: o caminho do arquivo de destino
+
+    > precision: número de casas decimais das coordenadas
+
+    > properties: lista com as colunas que devem ser exportadas.
+    Se for None, todas as colunas, exceto a geometria, são exportadas.
+
+    > compress: se verdadeiro, escreve o arquivo comprimido com gzip
+    '''
+
+    tmp_fname = f"{fname}.tmp-{os.getpid()}"
+
+    if compress:
+        f = gzip.open(tmp_fname, "wt", encoding="utf-8", compresslevel=6)
+    else:
+        f = open(tmp_fname, "w", encoding="utf-8")
+
+    with f:
+
+        f.write('{"type": "FeatureCollection", "features": [\n')
+
+        separator = ""
+        for chunk in iter_feature_chunks(gdf, precision, properties):
+            f.write(separator + ",\n".join(chunk))
+            separator = ",\n"
+
+        f.write("\n]}\n")
+
+    detach(fname)
+    os.replace(tmp_fname, fname)
+
+
+def write_points(df, f, properties, precision=DEFAULT_PRECISION):
+    '''
+    Escreve os focos de um dataframe em GeoJSONSeq (uma feição
+    por linha) em um arquivo já aberto. A geometria é montada a
+    partir das colunas 'longitude' e 'latitude', sem decodificar o WKB.
+
+    Parâmetros:
+
+    > df: dataframe com as colunas 'longitude', 'latitude' e as propriedades
+
+    > f: o arquivo de destino, aberto em modo texto
+
+    > properties: lista com as colunas que devem ser exportadas
+
+    > precision: número de casas decimais das coordenadas
+    '''
+
+
+    xs = np.round(df.longitude.to_numpy(), precision).tolist()
+    ys = np.round(df.latitude.to_numpy(), precision).tolist()
+    props = serialize_properties(df, properties)
+
+    f.write("".join(
+        f'{{"type": "Feature", "properties": {prop}, "geometry": {{"type": "Point", "coordinates": [{x}, {y}]}}}}\n'
+        for x, y, prop in zip(xs, ys, props)
+    ))
+
+
+def stream_feather_points(fname, f, properties, precision=DEFAULT_PRECISION, batch_rows=100_000, uuids=None):
+    '''
+    Escreve os focos de um arquivo feather em GeoJSONSeq (uma
+    feição por linha) em um arquivo já aberto, como a entrada
+    padrão do tippecanoe. O feather é lido em lotes, com
+    mapeamento de memória, e só as colunas pedidas e as
+    coordenadas são carregadas. A geometria é montada a partir
+    das colunas 'longitude' e 'latitude', sem decodificar o WKB.
+
+    Parâmetros:
+
+    > fname: o caminho do arquivo feather
+
+    > f: o arquivo de destino, aberto em modo texto
+
+    > properties: lista com as colunas que devem ser exportadas
+
+    > precision: número de casas decimais das coordenadas
+
+    > batch_rows: quantidade máxima de linhas lidas de uma vez
+
+    > uuids: se informado, apenas os focos com esses identificadores são escritos
+    '''
+
+    columns = list(dict.fromkeys(list(properties) + ["longitude", "latitude"] + (["uuid"] if uuids is not None else [ ])))
+
+    table = feather.read_table(fname, columns=columns, memory_map=True)
+
+    for batch in table.to_batches(max_chunksize=batch_rows):
+
+        df = batch.to_pandas()
+
+        if uuids is not None:
+            df = df[df.uuid.isin(uuids)]
+
+        write_points(df, f, properties, precision)
+
+
+def benchmark(n=200_000, precision=DEFAULT_PRECISION):
+    '''
+    Compara o tempo de escrita deste módulo com o do
+    to_file do Fiona em um conjunto sintético de pontos
+    com as mesmas colunas do banco de dados de focos.
+
+    Parâmetros:
+
+    > n: quantidade de pontos
+
+    > precision: número de casas decimais das coordenadas
+    '''
+
+    import geopandas as gpd
+    import tempfile
+
+    rng = np.random.default_rng(0)
+
+    df = pd.DataFrame({
+        "uuid": [f"{i:032x}" for i in range(n)],
+        "data": "2021-08-01",
+        "hora": "17:30:00",
+        "latitude": rng.uniform(-18, 5, n),
+        "longitude": rng.uniform(-74, -44, n),
+        "bright_ti4": rng.uniform(300, 360, n),
+        "frp": rng.exponential(5, n),
+        "cod_ti": np.where(rng.random(n) < .1, "1234", None),
+    })
+
+    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df.longitude, df.latitude), crs="EPSG:4674")
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        results = { }
+
+        start = time.perf_counter()
+        gdf.to_file(f"{directory}/fiona.json", driver="GeoJSON")
+        results["to_file"] = (time.perf_counter() - start, os.path.getsize(f"{directory}/fiona.json"))
+
+        start = time.perf_counter()
+        write_geojson(gdf, f"{directory}/stream.json", precision=precision)
+        results["stream"] = (time.perf_counter() - start, os.path.getsize(f"{directory}/stream.json"))
+
+        start = time.perf_counter()
+        write_geojson(gdf, f"{directory}/stream.json.gz", precision=precision, compress=True)
+        results["stream_gzip"] = (time.perf_counter() - start, os.path.getsize(f"{directory}/stream.json.gz"))
+
+    for label, (seconds, size) in results.items():
+        print(f"{label:>12}: {seconds:7.2f}s  {size / 1e6:8.1f} MB")
+
+    return results
+
+
+################
+### Execução ###
+################
+
+def main(argv):
+
+    if len(argv) < 2 or argv[1] != "benchmark":
+        print("Usage: python geojson_stream.py benchmark [n_points]")
+        sys.exit(1)
+
+    n = int(argv[2]) if len(argv) > 2 else 200_000
+    benchmark(n)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
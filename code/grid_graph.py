@@ -0,0 +1,180 @@
+'''
+Grafo de vizinhança das células do grid de 20km.
+
+A vizinhança é calculada uma única vez, por prepare.py, e salva
+em formato CSR (compressed sparse row): para a célula i, os índices
+das vizinhas estão em indices[indptr[i]:indptr[i + 1]]. Com esses
+dois arrays, somas de vizinhança e regiões de células quentes
+vizinhas são calculadas com operações vetorizadas do numpy, sem
+nenhum spatial join durante a atualização diária.
+'''
+
+from fire_events import connected_components
+import numpy as np
+import pandas as pd
+
+
+###############
+### Globals ###
+###############
+
+# Quantidade mínima de focos na semana para que uma célula seja considerada quente
+HOTSPOT_MIN_FIRES = 10
+
+
+###############
+### Helpers ###
+###############
+
+def edges(indptr, indices):
+    '''
+    Retorna as arestas do grafo como dois arrays (origem, destino).
+    '''
+
+    sources = np.repeat(np.arange(indptr.shape[0] - 1), np.diff(indptr))
+
+    return sources, indices
+
+
+##########################
+### Funções principais ###
+##########################
+
+def build_adjacency(geometries):
+    '''
+    Calcula a vizinhança (células que se tocam, inclusive
+    pelos cantos) a partir de uma GeoSeries de polígonos.
+    Retorna os arrays indptr e indices do formato CSR.
+
+    Parâmetros:
+
+    > geometries: a coluna de geometria do grid
+    '''
+
+    geometries = geometries.reset_index(drop=True)
+
+    sources, targets = geometries.sindex.query_bulk(geometries, predicate="intersects")
+
+    # Uma célula não é vizinha de si mesma
+    keep = sources != targets
+    sources, targets = sources[keep], targets[keep]
+
+    order = np.lexsort((targets, sources))
+    sources, targets = sources[order], targets[order]
+
+    indptr = np.zeros(geometries.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=geometries.shape[0]), out=indptr[1:])
+
+    return indptr, targets.astype(np.int64)
+
+
+def save_adjacency(fname, codes, indptr, indices):
+    '''
+    Salva a vizinhança e a ordem das células em um arquivo .npz.
+    '''
+
+    np.savez(fname, codes=np.asarray(codes, dtype=str), indptr=indptr, indices=indices)
+
+
+def load_adjacency(fname):
+    '''
+    Lê a vizinhança salva por save_adjacency. Retorna
+    uma tupla (codes, indptr, indices).
+    '''
+
+    with np.load(fname) as data:
+        return data["codes"], data["indptr"], data["indices"]
+
+
+def neighborhood_sums(indptr, indices, values, include_self=True):
+    '''
+    Soma os valores das vizinhas de cada célula, de forma
+    vetorizada. Equivale ao produto da matriz de adjacência
+    pelo vetor de valores.
+
+    Parâmetros:
+
+    > indptr, indices: a vizinhança em formato CSR
+
+    > values: array com um valor por célula, na ordem da vizinhança
+
+    > include_self: se verdadeiro, soma também o valor da própria célula
+    '''
+
+    values = np.asarray(values, dtype=float)
+
+    sources, targets = edges(indptr, indices)
+
+    sums = np.bincount(sources, weights=values[targets], minlength=values.shape[0])
+
+    if include_self:
+        sums += values
+
+    return sums
+
+
+def hotspot_regions(indptr, indices, hot):
+    '''
+    Agrupa as células quentes vizinhas em regiões. Retorna um
+    array com o número da região de cada célula (-1 para células
+    que não são quentes). As regiões são numeradas a partir de 0.
+
+    Parâmetros:
+
+    > indptr, indices: a vizinhança em formato CSR
+
+    > hot: array booleano indicando as células quentes
+    '''
+
+    hot = np.asarray(hot, dtype=bool)
+
+    sources, targets = edges(indptr, indices)
+
+    # Apenas arestas entre duas células quentes ligam regiões
+    keep = hot[sources] & hot[targets]
+
+    components = connected_components(hot.shape[0], sources[keep], targets[keep])
+
+    regions = np.full(hot.shape[0], -1, dtype=np.int64)
+    regions[hot], _ = pd.factorize(components[hot])
+
+    return regions
+
+
+def summarize_regions(grid, regions, current, previous):
+    '''
+    Resume as regiões de células quentes: quantidade de células,
+    focos na semana, focos na semana anterior nas mesmas células,
+    quantas delas já estavam quentes na semana anterior e a variação.
+    Retorna um dataframe ordenado pela quantidade de focos.
+
+    Parâmetros:
+
+    > grid: dataframe do grid, na ordem da vizinhança
+
+    > regions: o array retornado por hotspot_regions
+
+    > current, previous: arrays com os focos de cada célula nesta semana e na anterior
+    '''
+
+    df = pd.DataFrame({
+        "regiao": regions,
+        "focos_7d": current,
+        "focos_7d_anterior": previous,
+        "ja_quente": previous >= HOTSPOT_MIN_FIRES,
+        "cod_box": grid.cod_box.to_numpy(),
+    })
+
+    df = df[df.regiao >= 0]
+
+    summary = df.groupby("regiao").agg(
+        celulas=("cod_box", "size"),
+        celulas_ja_quentes=("ja_quente", "sum"),
+        focos_7d=("focos_7d", "sum"),
+        focos_7d_anterior=("focos_7d_anterior", "sum"),
+        cod_box=("cod_box", lambda codes: ",".join(codes)),
+    )
+
+    summary["variacao"] = summary.focos_7d - summary.focos_7d_anterior
+
+    return summary.sort_values("focos_7d", ascending=False).reset_index()
@@ -0,0 +1,144 @@
+'''
+Grades hierárquicas de áreas iguais (5km, 20km e 80km).
+
+Diferente do grid de 20km lido de um shapefile, que exige um
+spatial join para saber em que quadrado cada foco está, os
+identificadores das células destas grades são calculados
+aritmeticamente a partir das coordenadas: os pontos são projetados
+uma vez para uma projeção cônica de áreas iguais e a célula é a
+divisão inteira das coordenadas pelo tamanho do lado.
+
+As grades são aninhadas: cada célula de 20km contém exatamente
+16 células de 5km, e cada célula de 80km, 16 de 20km.
+'''
+
+import numpy as np
+import pyproj
+from shapely.geometry import Polygon
+
+
+###############
+### Globals ###
+###############
+
+# Cônica de áreas iguais de Albers para a América do Sul (equivalente ao ESRI:102033)
+EQUAL_AREA = "+proj=aea +lat_0=-32 +lon_0=-60 +lat_1=-5 +lat_2=-42 +x_0=0 +y_0=0 +ellps=GRS80 +units=m +no_defs"
+
+# SIRGAS 2000, o CRS dos dados do projeto
+GEOGRAPHIC = "EPSG:4674"
+
+TO_EQUAL_AREA = pyproj.Transformer.from_crs(GEOGRAPHIC, EQUAL_AREA, always_xy=True)
+FROM_EQUAL_AREA = pyproj.Transformer.from_crs(EQUAL_AREA, GEOGRAPHIC, always_xy=True)
+
+# Tamanho do lado das células de cada nível, em metros
+BASE_SIZE = 5_000
+
+LEVELS = {
+    "cod_grade_5km": 5_000,
+    "cod_grade_20km": 20_000,
+    "cod_grade_80km": 80_000,
+}
+
+# Os índices de coluna e linha são deslocados para que os ids sejam sempre positivos
+OFFSET = 500_000
+FACTOR = 1_000_000
+
+
+###############
+### Helpers ###
+###############
+
+def encode(columns, rows):
+    '''
+    Junta os índices de coluna e linha de uma
+    célula em um único identificador inteiro.
+    '''
+
+    return (columns + OFFSET) * FACTOR + (rows + OFFSET)
+
+
+def decode(ids):
+    '''
+    Separa um identificador de célula nos
+    seus índices de coluna e linha.
+    '''
+
+    ids = np.asarray(ids, dtype=np.int64)
+
+    return ids // FACTOR - OFFSET, ids % FACTOR - OFFSET
+
+
+##########################
+### Funções principais ###
+##########################
+
+def cell_ids(longitudes, latitudes):
+    '''
+    Calcula, em uma única passada vetorizada, o identificador da
+    célula de cada ponto em todos os níveis da pirâmide. Retorna
+    um dicionário no formato {nível: array de identificadores}.
+
+    Parâmetros:
+
+    > longitudes, latitudes: arrays com as coordenadas dos pontos
+    '''
+
+    x, y = TO_EQUAL_AREA.transform(np.asarray(longitudes, dtype=float), np.asarray(latitudes, dtype=float))
+
+    # Índices das células do nível mais fino
+    base_columns = np.floor(x / BASE_SIZE).astype(np.int64)
+    base_rows = np.floor(y / BASE_SIZE).astype(np.int64)
+
+    ids = { }
+
+    # Os níveis mais grossos são divisões inteiras do nível mais fino
+    for level, size in LEVELS.items():
+        factor = size // BASE_SIZE
+        ids[level] = encode(base_columns // factor, base_rows // factor)
+
+    return ids
+
+
+def add_cell_ids(df, lat_col="latitude", lon_col="longitude"):
+    '''
+    Adiciona ao dataframe uma coluna com o identificador
+    da célula de cada nível da pirâmide.
+    '''
+
+    ids = cell_ids(df[lon_col].to_numpy(), df[lat_col].to_numpy())
+
+    for level, values in ids.items():
+        df[level] = values
+
+    return df
+
+
+def cell_polygons(ids, level):
+    '''
+    Desenha, no CRS do projeto, os polígonos das células
+    informadas. Apenas os quatro cantos de cada célula são
+    reprojetados.
+
+    Parâmetros:
+
+    > ids: os identificadores das células
+
+    > level: o nível da pirâmide. Exemplo: 'cod_grade_20km'
+    '''
+
+    size = LEVELS[level]
+
+    columns, rows = decode(ids)
+
+    x0, y0 = columns * size, rows * size
+    x1, y1 = x0 + size, y0 + size
+
+    corners_x = np.stack([x0, x1, x1, x0], axis=1).ravel()
+    corners_y = np.stack([y0, y0, y1, y1], axis=1).ravel()
+
+    lons, lats = FROM_EQUAL_AREA.transform(corners_x, corners_y)
+
+    lons = lons.reshape(-1, 4)
+    lats = lats.reshape(-1, 4)
+
+    return [Polygon(zip(lon, lat)) for lon, lat in zip(lons, lats)]
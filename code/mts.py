@@ -0,0 +1,181 @@
+'''
+Cliente da API de tilesets do Mapbox (Mapbox Tiling Service, MTS).
+
+Em vez de enviar um .mbtiles inteiro pela API de uploads, o MTS
+guarda as feições em fontes (tileset sources) no próprio Mapbox,
+e os tiles são gerados lá, a partir de uma receita (recipe). Assim,
+a atualização diária só precisa acrescentar os focos novos à fonte
+e pedir a publicação do tileset.
+
+O endereço da API pode ser trocado pela variável de ambiente
+MAPBOX_API_URL, por exemplo para testar com um servidor local
+que imita os endpoints do MTS.
+
+Veja mais:
+
+https://docs.mapbox.com/api/maps/mapbox-tiling-service/
+'''
+
+import json
+import os
+import requests
+
+
+###############
+### Globals ###
+###############
+
+API_URL = os.environ.get("MAPBOX_API_URL", "https://api.mapbox.com")
+
+# Quantidade máxima de arquivos em uma fonte do MTS. Cada envio com
+# append acrescenta um arquivo; depois do limite, a fonte precisa ser
+# substituída por um único arquivo.
+MAX_SOURCE_FILES = 10
+
+# Tempo máximo de espera por uma resposta, em segundos. O envio
+# de uma fonte grande pode demorar.
+TIMEOUT = 600
+
+
+###############
+### Helpers ###
+###############
+
+def endpoint(path):
+    '''
+    Retorna o endereço completo de um endpoint do MTS.
+    '''
+
+    return f"{API_URL}/tilesets/v1/{path}"
+
+
+def request(method, path, token, **kwargs):
+    '''
+    Faz uma requisição à API e retorna a resposta em JSON.
+    Respostas de erro levantam requests.HTTPError.
+
+    Parâmetros:
+
+    > method: o método HTTP. Exemplo: 'POST'
+
+    > path: o caminho depois de /tilesets/v1/. Exemplo: 'infoamazonia.amzsufocada-24h/publish'
+
+    > token: o token de acesso do Mapbox
+    '''
+
+    response = requests.request(method, endpoint(path), params={"access_token": token}, timeout=TIMEOUT, **kwargs)
+    response.raise_for_status()
+
+    return response.json() if response.content else { }
+
+
+##########################
+### Funções principais ###
+##########################
+
+def make_recipe(username, layer, properties, minzoom=0, maxzoom=10):
+    '''
+    Monta a receita de um tileset com uma única camada, lida
+    da fonte de mesmo nome. Apenas as propriedades listadas
+    vão para os tiles.
+
+    Parâmetros:
+
+    > username: o usuário do Mapbox
+
+    > layer: o nome da camada, que também é o nome da fonte
+
+    > properties: lista com as propriedades mantidas nos tiles
+
+    > minzoom, maxzoom: os níveis de zoom em que a camada aparece
+    '''
+
+    return {
+        "version": 1,
+        "layers": {
+            layer: {
+                "source": f"mapbox://tileset-source/{username}/{layer}",
+                "minzoom": minzoom,
+                "maxzoom": maxzoom,
+                "features": {"attributes": {"allowed_output": list(properties)}},
+            }
+        }
+    }
+
+
+def save_recipe(recipe, fname):
+    '''
+    Salva uma receita em um arquivo novo, sem alterar
+    o arquivo compartilhado com gerações anteriores do output.
+    '''
+
+    tmp_fname = f"{fname}.tmp-{os.getpid()}"
+
+    with open(tmp_fname, "w") as f:
+        json.dump(recipe, f, indent=2)
+
+    os.replace(tmp_fname, fname)
+
+
+def upload_source(username, source_id, fname, token, append=True):
+    '''
+    Envia um arquivo GeoJSONSeq (uma feição por linha) para
+    uma fonte do MTS. Com append, as feições são acrescentadas
+    à fonte como um arquivo novo, até MAX_SOURCE_FILES arquivos;
+    sem ele, a fonte é substituída pelo arquivo.
+
+    Parâmetros:
+
+    > username: o usuário do Mapbox
+
+    > source_id: o nome da fonte
+
+    > fname: o caminho do arquivo GeoJSONSeq
+
+    > token: o token de acesso do Mapbox
+
+    > append: se verdadeiro, acrescenta as feições à fonte existente
+    '''
+
+    with open(fname, "rb") as f:
+        return request("POST" if append else "PUT", f"sources/{username}/{source_id}", token, files={"file": f})
+
+
+def update_tileset(tileset, recipe, token):
+    '''
+    Atualiza a receita de um tileset ou, se ele ainda
+    não existir, cria o tileset com essa receita.
+
+    Parâmetros:
+
+    > tileset: o id do tileset. Exemplo: 'infoamazonia.amzsufocada-24h'
+
+    > recipe: a receita retornada por make_recipe
+
+    > token: o token de acesso do Mapbox
+    '''
+
+    response = requests.patch(endpoint(f"{tileset}/recipe"), params={"access_token": token}, json=recipe, timeout=TIMEOUT)
+
+    if response.status_code == 404:
+        return request("POST", tileset, token, json={"recipe": recipe, "name": tileset.split(".", 1)[1]})
+
+    response.raise_for_status()
+
+
+def publish(tileset, token):
+    '''
+    Pede a publicação de um tileset, que é feita pelo Mapbox
+    a partir da fonte e da receita. Retorna o id do job.
+    '''
+
+    return request("POST", f"{tileset}/publish", token)["jobId"]
+
+
+def job_status(tileset, job_id, token):
+    '''
+    Retorna o estado de um job de publicação: 'queued',
+    'processing', 'success' ou 'failed'.
+    '''
+
+    return request("GET", f"{tileset}/jobs/{job_id}", token)["stage"]
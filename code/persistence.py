@@ -0,0 +1,135 @@
+'''
+Índice de persistência do fogo por pixel.
+
+A contagem de dias consecutivos de update_land_datasets é feita por
+território, então uma terra indígena grande com focos em lugares
+diferentes a cada dia parece um único fogo contínuo. Este índice
+guarda, para cada pixel do VIIRS (as coordenadas quantizadas em
+células de 375m em uma projeção de áreas iguais), a sequência de
+dias seguidos com detecção naquele mesmo lugar.
+
+O índice é uma tabela indexada pelo identificador do pixel, o que
+permite buscas por hash. A atualização diária olha apenas os pixels
+dos focos novos, sem reler o resto do ano, e o índice é copiado uma
+única vez por atualização, e não uma vez por dia.
+'''
+
+from fire_events import PIXEL_SIZE, day_numbers, quantize
+import grid_pyramid
+import numpy as np
+import pandas as pd
+
+
+###############
+### Globals ###
+###############
+
+COLUMNS = ["inicio_sequencia", "ultimo_dia", "dias_consecutivos", "maior_sequencia", "latitude", "longitude", "cod_ti", "cod_uc"]
+
+
+##########################
+### Funções principais ###
+##########################
+
+def empty_index():
+    '''
+    Retorna um índice de persistência vazio.
+    '''
+
+    return pd.DataFrame(columns=COLUMNS, index=pd.Index([], dtype=np.int64, name="pixel"))
+
+
+def update_persistence(index, new_rows):
+    '''
+    Atualiza o índice de persistência com os focos novos
+    e o retorna. Os dias dos focos novos são processados
+    em ordem: um pixel que também teve fogo no dia anterior
+    tem a sua sequência estendida; os demais começam uma
+    sequência nova. Detecções de um dia anterior ao último
+    dia já registrado para o pixel são ignoradas.
+
+    Parâmetros:
+
+    > index: o índice retornado pela execução anterior, ou None
+
+    > new_rows: dataframe com os focos que ainda não foram registrados no índice
+    '''
+
+    print(">> Updating pixel persistence index")
+
+    if index is None:
+        index = empty_index()
+
+    px, py = quantize(new_rows.longitude, new_rows.latitude, PIXEL_SIZE)
+
+    detections = pd.DataFrame({
+        "pixel": grid_pyramid.encode(px, py),
+        "dia": day_numbers(new_rows.data),
+        "latitude": new_rows.latitude.to_numpy(),
+        "longitude": new_rows.longitude.to_numpy(),
+        "cod_ti": new_rows.cod_ti.to_numpy(),
+        "cod_uc": new_rows.cod_uc.to_numpy(),
+    })
+
+    # Uma linha por pixel e dia
+    detections = detections.sort_values("dia").drop_duplicates(["pixel", "dia"], keep="last")
+
+    # O índice ganha, de uma só vez, uma linha para cada pixel novo. Os dias são
+    # aplicados por posição sobre os arrays das colunas, sem copiar o índice a cada dia.
+    pixels = index.index.union(pd.Index(detections.pixel.unique())).rename("pixel")
+    table = index.reindex(pixels)
+
+    arrays = {column: table[column].astype(float).to_numpy().copy() for column in COLUMNS if column not in ("cod_ti", "cod_uc")}
+    arrays["cod_ti"] = table.cod_ti.to_numpy(dtype=object).copy()
+    arrays["cod_uc"] = table.cod_uc.to_numpy(dtype=object).copy()
+
+    for day, group in detections.groupby("dia"):
+
+        positions = pixels.get_indexer(group.pixel)
+        last_day = arrays["ultimo_dia"][positions]
+
+        # Pixels já registrados neste dia, ou em um dia posterior, não mudam
+        fresh = ~(last_day >= day)
+        group, positions, last_day = group[fresh], positions[fresh], last_day[fresh]
+
+        continues = last_day == day - 1
+
+        runs = np.where(continues, np.nan_to_num(arrays["dias_consecutivos"][positions]) + 1, 1)
+
+        arrays["inicio_sequencia"][positions] = np.where(continues, arrays["inicio_sequencia"][positions], day)
+        arrays["ultimo_dia"][positions] = day
+        arrays["dias_consecutivos"][positions] = runs
+        arrays["maior_sequencia"][positions] = np.maximum(np.nan_to_num(arrays["maior_sequencia"][positions]), runs)
+
+        for column in ("latitude", "longitude", "cod_ti", "cod_uc"):
+            arrays[column][positions] = group[column].to_numpy()
+
+    index = pd.DataFrame(arrays, index=pixels)[COLUMNS]
+
+    for column in ("inicio_sequencia", "ultimo_dia", "dias_consecutivos", "maior_sequencia"):
+        index[column] = index[column].astype(np.int64)
+
+    return index
+
+
+def prune_persistence(index, first_day):
+    '''
+    Remove do índice os pixels sem focos desde antes
+    de 'first_day' (no formato 'AAAA-MM-DD').
+    '''
+
+    return index[index.ultimo_dia >= day_numbers([first_day])[0]]
+
+
+def burning_spots(index, reference_date, min_days=2):
+    '''
+    Retorna os pixels que tiveram fogo na data de referência
+    e estão queimando há pelo menos 'min_days' dias seguidos,
+    do que queima há mais tempo para o que queima há menos.
+    '''
+
+    reference = day_numbers([reference_date])[0]
+
+    spots = index[(index.ultimo_dia == reference) & (index.dias_consecutivos >= min_days)]
+
+    return spots.sort_values("dias_consecutivos", ascending=False)
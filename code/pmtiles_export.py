@@ -0,0 +1,354 @@
+'''
+Converte arquivos .mbtiles em arquivos PMTiles (versão 3).
+
+O PMTiles guarda todos os tiles em um único arquivo, com um
+diretório que diz em que posição (offset) e com que tamanho cada
+tile está. Um mapa pode então pedir cada tile com uma requisição
+HTTP com cabeçalho Range a um servidor de arquivos estáticos, sem
+nenhum servidor de tiles e sem a API de uploads do Mapbox.
+
+Os tiles são ordenados pelo seu id na curva de Hilbert (arquivo
+"clustered"), tiles com conteúdo igual (como os do oceano ou de
+áreas sem focos) são gravados uma única vez e sequências de tiles
+iguais viram uma única entrada do diretório.
+
+Veja mais:
+
+https://github.com/protomaps/PMTiles/blob/main/spec/v3/spec.md
+'''
+
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+
+
+###############
+### Globals ###
+###############
+
+HEADER_SIZE = 127
+
+# O cabeçalho e o diretório raiz precisam caber nos primeiros 16KB do arquivo
+ROOT_SIZE = 16_384
+
+# Valores dos campos de compressão e de tipo de tile do cabeçalho
+COMPRESSION_NONE = 1
+COMPRESSION_GZIP = 2
+TILE_TYPE_MVT = 1
+
+
+###############
+### Helpers ###
+###############
+
+def varint(value):
+    '''
+    Codifica um inteiro não negativo como varint.
+    '''
+
+    encoded = bytearray()
+
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    encoded.append(value)
+
+    return bytes(encoded)
+
+
+def read_varint(data, position):
+    '''
+    Lê um varint a partir de uma posição. Retorna
+    uma tupla (valor, próxima posição).
+    '''
+
+    value = shift = 0
+
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, position
+
+
+def tile_id(z, x, y):
+    '''
+    Retorna o id de um tile: a quantidade de tiles dos zooms
+    anteriores somada à posição do tile na curva de Hilbert
+    do seu zoom.
+    '''
+
+    acc = ((1 << (2 * z)) - 1) // 3
+    d = 0
+
+    s = (1 << z) >> 1
+
+    while s > 0:
+
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+
+        d += s * s * ((3 * rx) ^ ry)
+
+        # Rotaciona o quadrante
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - (x & (s - 1))
+                y = s - 1 - (y & (s - 1))
+            x, y = y, x
+
+        s >>= 1
+
+    return acc + d
+
+
+def serialize_directory(entries):
+    '''
+    Codifica e comprime uma lista de entradas do diretório,
+    no formato (tile_id, offset, length, run_length), ordenada
+    pelo tile_id. Os ids são gravados como diferenças e os offsets
+    de tiles contíguos ao anterior são gravados como zero.
+    '''
+
+    data = bytearray(varint(len(entries)))
+
+    last_id = 0
+    for entry in entries:
+        data += varint(entry[0] - last_id)
+        last_id = entry[0]
+
+    for entry in entries:
+        data += varint(entry[3])
+
+    for entry in entries:
+        data += varint(entry[2])
+
+    for i, entry in enumerate(entries):
+        if i > 0 and entry[1] == entries[i - 1][1] + entries[i - 1][2]:
+            data += varint(0)
+        else:
+            data += varint(entry[1] + 1)
+
+    return gzip.compress(bytes(data), mtime=0)
+
+
+def build_directories(entries):
+    '''
+    Monta o diretório raiz e, se ele não couber nos primeiros
+    16KB do arquivo, os diretórios-folha. Retorna uma tupla
+    (raiz comprimida, folhas comprimidas).
+    '''
+
+    root = serialize_directory(entries)
+
+    if HEADER_SIZE + len(root) <= ROOT_SIZE:
+        return root, b""
+
+    leaf_size = 4096
+
+    while True:
+
+        leaves, root_entries = bytearray(), [ ]
+
+        for start in range(0, len(entries), leaf_size):
+            leaf = serialize_directory(entries[start:start + leaf_size])
+            root_entries.append((entries[start][0], len(leaves), len(leaf), 0))
+            leaves += leaf
+
+        root = serialize_directory(root_entries)
+
+        if HEADER_SIZE + len(root) <= ROOT_SIZE:
+            return root, bytes(leaves)
+
+        leaf_size *= 2
+
+
+def read_mbtiles(fname):
+    '''
+    Lê os metadados e os tiles de um .mbtiles. Retorna uma tupla
+    (metadados, lista de (tile_id, dados)) ordenada pelo tile_id.
+    '''
+
+    connection = sqlite3.connect(f"file:{fname}?mode=ro", uri=True)
+
+    try:
+        metadata = dict(connection.execute("SELECT name, value FROM metadata"))
+
+        tiles = [
+            (tile_id(z, x, (1 << z) - 1 - row), data)
+            for z, x, row, data in connection.execute("SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles")
+        ]
+
+    finally:
+        connection.close()
+
+    tiles.sort(key=lambda tile: tile[0])
+
+    return metadata, tiles
+
+
+def e7(value):
+    '''
+    Converte graus em inteiros de 1e-7 graus, como no cabeçalho.
+    '''
+
+    return int(round(float(value) * 10_000_000))
+
+
+##########################
+### Funções principais ###
+##########################
+
+def convert(mbtiles, fname):
+    '''
+    Converte um arquivo .mbtiles em PMTiles. O arquivo é escrito
+    em um caminho temporário e renomeado ao final, sem alterar o
+    arquivo compartilhado com gerações anteriores do output.
+    Retorna um dicionário com a quantidade de tiles endereçados,
+    de entradas do diretório e de conteúdos distintos.
+
+    Parâmetros:
+
+    > mbtiles: o caminho do .mbtiles
+
+    > fname: o caminho do arquivo PMTiles
+    '''
+
+    metadata, tiles = read_mbtiles(mbtiles)
+
+    # Tiles com conteúdo igual apontam para os mesmos bytes
+    entries, contents, offsets = [ ], bytearray(), { }
+
+    for id_, data in tiles:
+
+        digest = hashlib.sha1(data).digest()
+
+        if digest not in offsets:
+            offsets[digest] = (len(contents), len(data))
+            contents += data
+
+        offset, length = offsets[digest]
+
+        # Tiles seguidos com o mesmo conteúdo viram uma única entrada
+        previous = entries[-1] if entries else None
+        if previous and previous[1] == offset and previous[0] + previous[3] == id_:
+            entries[-1] = (previous[0], offset, length, previous[3] + 1)
+        else:
+            entries.append((id_, offset, length, 1))
+
+    root, leaves = build_directories(entries)
+
+    # Os campos do .mbtiles que não são do cabeçalho vão para os metadados em JSON
+    json_metadata = json.loads(metadata.get("json", "{}"))
+    json_metadata.update({key: value for key, value in metadata.items() if key not in ("json", "bounds", "center", "minzoom", "maxzoom", "format")})
+    metadata_bytes = gzip.compress(json.dumps(json_metadata).encode("utf-8"), mtime=0)
+
+    west, south, east, north = metadata.get("bounds", "-180,-85,180,85").split(",")
+    center_lon, center_lat, center_zoom = metadata.get("center", "0,0,0").split(",")
+
+    min_zoom = int(metadata.get("minzoom", 0))
+    max_zoom = int(metadata.get("maxzoom", 0))
+
+    tile_compression = COMPRESSION_GZIP if tiles and tiles[0][1][:2] == b"\x1f\x8b" else COMPRESSION_NONE
+
+    root_offset = HEADER_SIZE
+    metadata_offset = root_offset + len(root)
+    leaves_offset = metadata_offset + len(metadata_bytes)
+    data_offset = leaves_offset + len(leaves)
+
+    header = b"PMTiles" + struct.pack(
+        "<BQQQQQQQQQQQBBBBBBiiiiBii",
+        3,
+        root_offset, len(root),
+        metadata_offset, len(metadata_bytes),
+        leaves_offset, len(leaves),
+        data_offset, len(contents),
+        len(tiles), len(entries), len(offsets),
+        1, COMPRESSION_GZIP, tile_compression, TILE_TYPE_MVT,
+        min_zoom, max_zoom,
+        e7(west), e7(south), e7(east), e7(north),
+        int(float(center_zoom)), e7(center_lon), e7(center_lat),
+    )
+
+    tmp_fname = f"{fname}.tmp-{os.getpid()}"
+
+    with open(tmp_fname, "wb") as f:
+        f.write(header)
+        f.write(root)
+        f.write(metadata_bytes)
+        f.write(leaves)
+        f.write(contents)
+
+    os.replace(tmp_fname, fname)
+
+    return {"tiles": len(tiles), "entradas": len(entries), "conteudos": len(offsets)}
+
+
+def get_tile(fetch, z, x, y):
+    '''
+    Lê um tile de um arquivo PMTiles, como faria um mapa no
+    navegador, apenas com leituras de trechos do arquivo. Retorna
+    os bytes do tile, ou None se ele não existir.
+
+    Parâmetros:
+
+    > fetch: função fetch(offset, length) que retorna os bytes de um
+    trecho do arquivo, como uma requisição HTTP com cabeçalho Range
+
+    > z, x, y: as coordenadas do tile, no esquema XYZ
+    '''
+
+    header = fetch(0, HEADER_SIZE)
+
+    fields = struct.unpack("<BQQQQQQQQQQQ", header[7:7 + 89])
+    root_offset, root_length = fields[1], fields[2]
+    leaves_offset, data_offset = fields[5], fields[7]
+
+    wanted = tile_id(z, x, y)
+    offset, length = root_offset, root_length
+
+    # No máximo a raiz e um nível de folhas, como nos arquivos de convert
+    for _ in range(4):
+
+        data = gzip.decompress(fetch(offset, length))
+
+        count, position = read_varint(data, 0)
+        columns = [[ ], [ ], [ ], [ ]]
+
+        for column in range(4):
+            for _ in range(count):
+                value, position = read_varint(data, position)
+                columns[column].append(value)
+
+        ids, run_lengths, lengths, raw_offsets = columns
+
+        entries = [ ]
+        last_id = 0
+        for i in range(count):
+            last_id += ids[i]
+            entry_offset = raw_offsets[i] - 1 if raw_offsets[i] else entries[i - 1][1] + entries[i - 1][2]
+            entries.append((last_id, entry_offset, lengths[i], run_lengths[i]))
+
+        candidates = [entry for entry in entries if entry[0] <= wanted]
+        if not candidates:
+            return None
+
+        entry = candidates[-1]
+
+        # Entradas com run_length zero apontam para diretórios-folha
+        if entry[3] == 0:
+            offset, length = leaves_offset + entry[1], entry[2]
+            continue
+
+        if wanted < entry[0] + entry[3]:
+            return fetch(data_offset + entry[1], entry[2])
+
+        return None
+
+    return None
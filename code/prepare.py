@@ -5,6 +5,8 @@ de forma otimizada.
 '''
 
 import geopandas as gpd
+import grid_graph
+import grid_pyramid
 import numpy as np
 import pandas as pd
 import os
@@ -31,6 +33,9 @@ dirname = os.path.dirname
 
 PROJECT_ROOT = dirname(abspath(dirname(__file__)))
 
+# Faixas de entorno ao redor de terras indígenas e unidades de conservação, em km
+BUFFER_BANDS = [5, 10]
+
 ###############
 ### Helpers ###
 ###############
@@ -224,6 +229,43 @@ def shorten_name(row):
     })
 
 
+def buffer_rings(gdf, code):
+    '''
+    Desenha as faixas de entorno (anéis) ao redor de cada território,
+    na projeção de áreas iguais de grid_pyramid.py. A faixa de 5km vai
+    da borda do território até 5km dela; a de 10km, de 5km até 10km.
+    Retorna uma tupla com um geodataframe de anéis, com as colunas
+    [código, faixa_km, geometry], e outro com os próprios territórios
+    na mesma projeção, usados para calcular distâncias.
+
+    Parâmetros:
+
+    > gdf: o geodataframe com os territórios
+
+    > code: a coluna com o código dos territórios. Exemplo: 'cod_ti'
+    '''
+
+    territories = gdf[[code, "geometry"]].to_crs(grid_pyramid.EQUAL_AREA).reset_index(drop=True)
+    territories["geometry"] = territories.geometry.buffer(0)
+
+    rings = [ ]
+    inner = territories.geometry
+
+    for band in BUFFER_BANDS:
+
+        outer = territories.geometry.buffer(band * 1000)
+
+        ring = gpd.GeoDataFrame({code: territories[code], "faixa_km": band}, geometry=outer.difference(inner), crs=grid_pyramid.EQUAL_AREA)
+        rings.append(ring)
+
+        inner = outer
+
+    rings = pd.concat(rings, ignore_index=True)
+    rings = rings[~rings.geometry.is_empty].reset_index(drop=True)
+
+    return rings, territories
+
+
 ##########################
 ### Funções principais ###
 ##########################
@@ -428,6 +470,20 @@ def featherize_sources():
     ind_lands.to_feather(f"{out_path}/terras_indigenas.feather")
 
 
+    #####################################
+    ### Entorno de TIs e UCs (buffer) ###
+    #####################################
+
+    # Os anéis são desenhados uma única vez aqui. O process_data.py apenas
+    # consulta o índice espacial deles para cada lote de focos.
+    for name, gdf, code in (("terras_indigenas", ind_lands, "cod_ti"), ("unidades_de_conservacao", con_units, "cod_uc")):
+
+        rings, territories = buffer_rings(gdf, code)
+
+        rings.to_feather(f"{out_path}/entorno_{name}.feather")
+        territories.to_feather(f"{out_path}/{name}_area_igual.feather")
+
+
     ########################################
     ### Quadrados da divisão da Amazônia ###
     ########################################
@@ -520,6 +576,10 @@ def featherize_sources():
 
     grid.to_feather(f"{out_path}/grid_20km.feather")
 
+    # Vizinhança entre as células, em formato CSR, para encontrar regiões de células quentes
+    indptr, indices = grid_graph.build_adjacency(grid.geometry)
+    grid_graph.save_adjacency(f"{out_path}/grid_20km_adjacencia.npz", grid.cod_box, indptr, indices)
+
 def main():
 	featherize_sources()
 
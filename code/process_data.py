@@ -1,10 +1,24 @@
+import baselines
+from concurrent.futures import ThreadPoolExecutor
 import datetime
-from distutils.dir_util import copy_tree
+import density_rasters
+import fire_events
 from functools import reduce
+from generations import begin_generation, detach, rollback_generation
+from geojson_stream import write_geojson
 import geopandas as gpd
+import grid_graph
+import grid_pyramid
+import hashlib
+import json
+import numpy as np
 import os
 import pandas as pd
+import persistence
+import pyarrow.dataset as ds
+import shutil
 from shapely.geometry import Point
+from streaks import consecutive_days
 import sys
 import uuid
 import warnings; warnings.filterwarnings('ignore', message='.*initial implementation of Parquet.*')
@@ -27,6 +41,100 @@ dirname = os.path.dirname
 
 PROJECT_ROOT = dirname(abspath(dirname(__file__)))
 
+# Casas decimais das coordenadas nos arquivos GeoJSON. Seis casas
+# (cerca de 10cm) bastam para os pixels de 375m do VIIRS.
+GEOJSON_PRECISION = 6
+
+# Tipos de território pelos quais os focos são agregados
+LAYERS = ["cod_ti", "cod_uc", "cod_bioma", "cod_box", "cod_cidade"]
+
+# Colunas com o território mais próximo de focos que estão no entorno
+# (até 10km, fora do território) de terras indígenas e unidades de conservação
+BUFFER_LAYERS = {"cod_ti": "cod_ti_entorno", "cod_uc": "cod_uc_entorno"}
+
+# Além dos territórios, o cubo conta os focos no entorno das TIs e UCs
+# e nas células das grades hierárquicas de 5km, 20km e 80km (veja grid_pyramid.py)
+CUBE_LAYERS = LAYERS + list(BUFFER_LAYERS.values()) + list(grid_pyramid.LEVELS)
+
+# Diretório do cubo de focos por território e dia. Há um arquivo por
+# tipo de território, com as colunas [código, dia, focos], apenas para
+# as combinações que tiveram algum foco.
+CUBE_DIR = f"{PROJECT_ROOT}/output/feathers/cube"
+
+# Diretório com a tabela que liga cada foco a um evento de fogo
+# (veja fire_events.py), usada para agrupar os focos novos de forma incremental
+EVENTS_DIR = f"{PROJECT_ROOT}/output/feathers/eventos"
+
+# Índice de persistência do fogo por pixel do VIIRS (veja persistence.py)
+PERSISTENCE_FILE = f"{PROJECT_ROOT}/output/feathers/persistencia/pixels.feather"
+
+# Arquivos e diretórios de versões anteriores do output que nenhuma etapa lê
+# mais, relativos a output. Eles são removidos da nova geração por
+# remove_retired_outputs, para não serem copiados de geração em geração.
+RETIRED_OUTPUTS = [
+    # O tileset do grid voltou a ser criado a partir do GeoJSON completo
+    "jsons/land_info/geometrias/grid_20km.json",
+    "jsons/land_info/geometrias/grid_20km.json.versao",
+    "jsons/land_info/atributos/grid_20km.json",
+    "feathers/land_info/atributos/grid_20km.feather",
+    # Os segmentos diários em GeoJSONSeq do banco completo foram abandonados:
+    # o tippecanoe volta a ler o feather do banco
+    "jsons/tilesets/bd_completo",
+]
+
+# Quantidade máxima de linhas do banco de focos convertidas para o pandas
+# de uma vez por stream_fire_cube
+BATCH_ROWS = 100_000
+
+# Registro de exportação: para cada conjunto de dados salvo por este script,
+# os formatos que as etapas seguintes de fato leem. O feather é o formato
+# canônico e está sempre presente; os demais formatos só são gerados sob
+# demanda, com export_on_demand.
+EXPORTS = {
+    # Lidos por process_subsets, process_tweet_*, update_land_datasets e process_tilesets.
+    # O process_tilesets envia as feições diretamente do feather para o tippecanoe.
+    "tilesets/24h": ["feather"],
+    "tilesets/7d": ["feather"],
+    "tilesets/bd_completo": ["feather"],
+
+    # Usados apenas para recalcular os dados de terras
+    "tilesets/24h_com_duplicatas": ["feather"],
+    "tilesets/7d_com_duplicatas": ["feather"],
+    "tilesets/bd_completo_com_duplicatas": ["feather"],
+
+    # Lidos por process_tweet_* e process_subsets. Os tilesets desses territórios
+    # usam os polígonos de land_info/geometrias (veja save_static_geometry), e o
+    # mapa junta a eles as tabelas de atributos abaixo.
+    "land_info/terras_indigenas": ["feather"],
+    "land_info/unidades_de_conservacao": ["feather"],
+    "land_info/biomas": ["feather"],
+    "land_info/cidades": ["feather"],
+
+    # O estilo do grid nas imagens estáticas colore as células pelas contagens de
+    # focos, e a API de imagens estáticas não junta tabelas aos tiles. Por isso, o
+    # tileset do grid é criado a partir do GeoJSON completo, com as contagens.
+    "land_info/grid_20km": ["feather", "geojson"],
+
+    # Dados diários de fogo de cada território, sem geometria, indexados pelo código.
+    # O mapa junta essas tabelas aos tilesets de polígonos.
+    "land_info/atributos/terras_indigenas": ["feather", "json"],
+    "land_info/atributos/unidades_de_conservacao": ["feather", "json"],
+    "land_info/atributos/biomas": ["feather", "json"],
+    "land_info/atributos/cidades": ["feather", "json"],
+
+    # Grades hierárquicas, para visões nacionais e regionais do mapa
+    "land_info/grade_5km": ["feather", "geojson"],
+    "land_info/grade_20km": ["feather", "geojson"],
+    "land_info/grade_80km": ["feather", "geojson"],
+
+    # Regiões de células quentes vizinhas do grid de 20km, lidas por process_tweet_variables
+    "land_info/regioes_grid": ["feather", "geojson"],
+
+    # Eventos de fogo: focos agrupados no espaço e no tempo. O CSV pode ser
+    # gerado sob demanda com 'python process_data.py export eventos/eventos csv'.
+    "eventos/eventos": ["feather"],
+}
+
 
 ########################
 ### Dados constantes ###
@@ -39,6 +147,21 @@ GRID = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/grid_20km.feath
 INDIGENOUS_LAND = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/terras_indigenas.feather")
 LEGAL_AMAZON = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/limites_amazonia_legal.feather")
 
+# Faixas de entorno e territórios na projeção de áreas iguais, criados por prepare.py
+BUFFERS = {
+    "cod_ti": (
+        gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/entorno_terras_indigenas.feather"),
+        gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/terras_indigenas_area_igual.feather"),
+    ),
+    "cod_uc": (
+        gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/entorno_unidades_de_conservacao.feather"),
+        gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/unidades_de_conservacao_area_igual.feather"),
+    ),
+}
+
+# Vizinhança entre as células do grid, criada por prepare.py
+GRID_CODES, GRID_INDPTR, GRID_INDICES = grid_graph.load_adjacency(f"{PROJECT_ROOT}/output/feathers/sources/grid_20km_adjacencia.npz")
+
 # Conversão de CRS
 GRID.crs = LEGAL_AMAZON.crs
 CONSERVATION_UNITS.crs = LEGAL_AMAZON.crs
@@ -86,77 +209,303 @@ def clip_over_amazon(gdf, rtree=True):
     return gdf
 
 
-def df_to_gdf(df, lat_col="latitude", lon_col="longitude"):
+def cube_slice(df, layer):
     '''
-    Transforma um dataframe normal em um geodataframe
-    usando as colunas de latitude e longitude para isso
+    Conta os focos de um dataframe por território e dia,
+    no formato do cubo de focos.
+
+    Parâmetros:
+
+    > df: um dataframe com focos de fogo
+
+    > layer: o tipo de território. Exemplo: 'cod_ti'
     '''
 
-    print(">> Converting to GDF")
+    days = pd.to_datetime(df.data).dt.normalize().rename("dia")
 
-    points = df.apply(lambda row: Point (row[lon_col], row[lat_col]), axis=1)
+    counts = df.groupby([df[layer], days]).size().rename("focos").reset_index()
 
-    gdf = gpd.GeoDataFrame(df, geometry=points)
+    return counts
 
-    # Padroniza o CRS para usar Sirgas 2000, como nas constantes
-    gdf.crs = LEGAL_AMAZON.crs
 
-    return gdf
+def read_fire_cube(layer):
+    '''
+    Lê o cubo de focos de um tipo de território.
+    Retorna None caso ele ainda não exista.
+    '''
+
+    fname = f"{CUBE_DIR}/{layer}.feather"
+
+    if not os.path.isfile(fname):
+        return None
 
+    return pd.read_feather(fname)
 
-def get_consecutive_days(gpby):
+
+def update_fire_cube(new_rows, first_day, rebuild=False):
     '''
-    Função que recebe um dataframe
-    com fogos de fogo agrupado
-    por terra indígena ou unidade
-    de conservação e calcula a quantos
-    dias consecutivos cada uma delas está
-    queimando.
+    Acrescenta ao cubo de focos apenas a contagem dos focos novos
+    e descarta os dias anteriores à janela de retenção. Retorna um
+    dicionário com o cubo atualizado de cada tipo de território.
+
+    Parâmetros:
+
+    > new_rows: os focos (com duplicatas) que ainda não foram contados no cubo
+
+    > first_day: o primeiro dia que deve ser mantido, no formato 'AAAA-MM-DD'
+
+    > rebuild: se verdadeiro, ignora o cubo salvo e o recria a partir de new_rows
     '''
 
-    def gen_prior_date(start_date):
-        '''
-        Uma função geradora que sempre reduz
-        a data passada como argumento em
-        um dia a cada chamada'''
+    print(">> Updating fire cube")
 
-        yield start_date
+    os.makedirs(CUBE_DIR, exist_ok=True)
 
-        while True:
+    # Identifica as células das grades hierárquicas de cada foco
+    new_rows = grid_pyramid.add_cell_ids(new_rows.copy())
 
-            start_date -= datetime.timedelta(days=1)
-            yield start_date
-        
-    def count_consec_dates(dates, start_date):
+    cubes = { }
+
+    for layer in CUBE_LAYERS:
+
+        cube = None if rebuild else read_fire_cube(layer)
+        new_slice = cube_slice(new_rows, layer)
+
+        if cube is not None:
+            cube = pd.concat((cube, new_slice))
+            cube = cube.groupby([layer, "dia"]).focos.sum().reset_index()
+        else:
+            cube = new_slice
+
+        cube = cube[cube.dia >= pd.to_datetime(first_day)].reset_index(drop=True)
+
+        save_feather(cube, f"{CUBE_DIR}/{layer}.feather")
+
+        cubes[layer] = cube
+
+    return cubes
+
+
+def stream_fire_cube(fname, first_day=None, batch_rows=BATCH_ROWS):
+    '''
+    Recria o cubo de focos lendo do banco de dados apenas as
+    colunas necessárias (a data, as coordenadas e os códigos dos
+    territórios). O arquivo é lido lote a lote, com no máximo
+    'batch_rows' linhas de cada vez, e só essas colunas de cada
+    lote são descomprimidas: a geometria e as demais colunas não
+    são lidas. As contagens de cada lote são acumuladas e combinadas
+    de tempos em tempos, então a memória usada depende do tamanho
+    do lote e da quantidade de células e dias, e não do tamanho
+    do banco de dados.
+
+    Retorna um dicionário com o cubo de cada tipo de território.
+
+    Parâmetros:
+
+    > fname: o caminho do banco de dados em formato feather
+
+    > first_day: o primeiro dia que deve ser mantido, no formato 'AAAA-MM-DD'.
+    Se for None, mantém todo o histórico.
+
+    > batch_rows: quantidade máxima de linhas lidas de cada vez
+    '''
+
+    print(">> Streaming fire cube")
+
+    os.makedirs(CUBE_DIR, exist_ok=True)
+
+    columns = ["data", "latitude", "longitude"] + LAYERS + list(BUFFER_LAYERS.values())
+
+    partials = {layer: [ ] for layer in CUBE_LAYERS}
+
+    def combine(frames, layer):
         '''
-        Uma função que conta os dias consecutivos
-        em que uma observação ocorre no DataFrame,
-        de forma regresssiva, a partir de uma data
-        especificada.
+        Soma as contagens parciais acumuladas até aqui.
         '''
-        
-        dates = pd.to_datetime(dates.values).date
+        return [pd.concat(frames).groupby([layer, "dia"]).focos.sum().reset_index()]
 
-        dates_set = set(dates) # O(1) vs O(n) lookup times
+    # Os feathers são gravados em lotes (record batches) de até 64 mil linhas pelo
+    # pyarrow. O dataset lê um lote de cada vez, apenas com as colunas pedidas.
+    dataset = ds.dataset(fname, format="ipc")
 
-        back_in_time = gen_prior_date(start_date)
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_rows):
 
-        tally = 0
+        df = batch.to_pandas()
 
-        while next(back_in_time) in dates_set:  # jump out on first miss
-            tally += 1
+        if first_day is not None:
+            df = df[pd.to_datetime(df.data) >= pd.to_datetime(first_day)]
 
-        return tally
+        df = grid_pyramid.add_cell_ids(df)
 
-    start_date = pd.to_datetime("today").date()
-        
-    gpby = gpby.data
+        for layer in CUBE_LAYERS:
+            partials[layer].append(cube_slice(df, layer))
 
-    gpby = gpby.apply(lambda x: count_consec_dates(x, start_date))
-    
-    gpby = gpby.to_frame().reset_index().rename(columns={"data":"dias_consecutivos"})
+            # Combina as contagens parciais para manter a memória limitada
+            if len(partials[layer]) >= 10:
+                partials[layer] = combine(partials[layer], layer)
+
+    cubes = { }
+
+    for layer in CUBE_LAYERS:
+
+        cube = combine(partials[layer], layer)[0]
+
+        save_feather(cube, f"{CUBE_DIR}/{layer}.feather")
+
+        cubes[layer] = cube
+
+    return cubes
+
+
+def update_fire_events(new_rows, first_day, rebuild=False):
+    '''
+    Agrupa os focos novos em eventos de fogo, ligando-os aos eventos
+    dos dias anteriores, descarta os focos anteriores à janela de retenção
+    e salva a tabela de eventos. Retorna a tabela de eventos.
 
-    return gpby
+    Parâmetros:
+
+    > new_rows: os focos (sem duplicatas) que ainda não foram agrupados
+
+    > first_day: o primeiro dia que deve ser mantido, no formato 'AAAA-MM-DD'
+
+    > rebuild: se verdadeiro, ignora os eventos salvos e agrupa new_rows do zero
+    '''
+
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+
+    fname = f"{EVENTS_DIR}/focos.feather"
+
+    assignments = None
+
+    if not rebuild and os.path.isfile(fname):
+        assignments = pd.read_feather(fname)
+        assignments = assignments[assignments.data >= first_day].reset_index(drop=True)
+
+    assignments = fire_events.update_events(new_rows, assignments)
+
+    save_feather(assignments, fname)
+
+    events = fire_events.summarize_events(assignments)
+
+    export_dataset(events, "eventos/eventos")
+
+    return events
+
+
+def update_pixel_persistence(new_rows, first_day, rebuild=False):
+    '''
+    Atualiza o índice de persistência com os focos novos e
+    descarta os pixels sem fogo desde antes da janela de retenção.
+
+    Parâmetros:
+
+    > new_rows: os focos (sem duplicatas) que ainda não foram registrados no índice
+
+    > first_day: o primeiro dia que deve ser mantido, no formato 'AAAA-MM-DD'
+
+    > rebuild: se verdadeiro, ignora o índice salvo e o recria a partir de new_rows
+    '''
+
+    os.makedirs(dirname(PERSISTENCE_FILE), exist_ok=True)
+
+    index = None
+
+    if not rebuild and os.path.isfile(PERSISTENCE_FILE):
+        index = pd.read_feather(PERSISTENCE_FILE).set_index("pixel")
+
+    index = persistence.update_persistence(index, new_rows)
+    index = persistence.prune_persistence(index, first_day)
+
+    save_feather(index.reset_index(), PERSISTENCE_FILE)
+
+
+def window_counts(cube, layer, first_day, last_day):
+    '''
+    Soma os focos de cada território entre duas datas
+    (inclusive), usando apenas o cubo de focos. Serve
+    para qualquer janela: 24h, 7d, 30d, 90d ou o ano todo.
+
+    Parâmetros:
+
+    > cube: o cubo de focos do tipo de território
+
+    > layer: o tipo de território. Exemplo: 'cod_ti'
+
+    > first_day, last_day: os limites da janela, no formato 'AAAA-MM-DD'
+    '''
+
+    in_window = (cube.dia >= pd.to_datetime(first_day)) & (cube.dia <= pd.to_datetime(last_day))
+
+    return cube[in_window].groupby(layer).focos.sum().reset_index()
+
+
+def grid_hotspots(grid, cube, last_day):
+    '''
+    Usa a vizinhança do grid para acrescentar, a cada célula, a soma
+    de focos da sua vizinhança nos últimos 7 dias e a região de células
+    quentes à qual ela pertence. Salva também a tabela de regiões, com
+    os lugares que elas atingem e a variação em relação à semana anterior.
+    Retorna o grid com as novas colunas.
+
+    Parâmetros:
+
+    > grid: o geodataframe do grid, já com a coluna focos_7d
+
+    > cube: o cubo de focos das células do grid
+
+    > last_day: o último dia da semana atual, no formato 'AAAA-MM-DD'
+    '''
+
+    print(">> Finding hotspot regions")
+
+    # Coloca o grid na mesma ordem da vizinhança
+    grid = grid.set_index("cod_box").loc[GRID_CODES].reset_index()
+
+    last_day = pd.to_datetime(last_day)
+    previous_week = window_counts(cube, "cod_box", last_day - pd.Timedelta(days=13), last_day - pd.Timedelta(days=7))
+
+    current = grid.focos_7d.fillna(0).to_numpy()
+    previous = grid.cod_box.map(previous_week.set_index("cod_box").focos).fillna(0).to_numpy()
+
+    grid["focos_vizinhanca_7d"] = grid_graph.neighborhood_sums(GRID_INDPTR, GRID_INDICES, current).astype(int)
+
+    regions = grid_graph.hotspot_regions(GRID_INDPTR, GRID_INDICES, current >= grid_graph.HOTSPOT_MIN_FIRES)
+    grid["regiao_7d"] = np.where(regions >= 0, regions, np.nan)
+
+    summary = grid_graph.summarize_regions(grid, regions, current, previous)
+
+    # Lugares atingidos por cada região, a partir dos dados que o grid já tem
+    hot = grid[regions >= 0].assign(regiao=regions[regions >= 0])
+    for column in ("cidade", "estado", "nome_ti", "nome_uc"):
+        names = hot[column].dropna().str.split(",").explode().str.strip()
+        names = names.groupby(hot.regiao.reindex(names.index)).agg(lambda values: ", ".join(sorted(set(values))))
+        summary[column] = summary.regiao.map(names)
+
+    geometries = hot[["regiao", "geometry"]].dissolve(by="regiao").geometry
+    summary = gpd.GeoDataFrame(summary, geometry=summary.regiao.map(geometries).to_numpy(), crs=grid.crs)
+
+    export_dataset(summary, "land_info/regioes_grid")
+
+    return grid
+
+
+def df_to_gdf(df, lat_col="latitude", lon_col="longitude"):
+    '''
+    Transforma um dataframe normal em um geodataframe
+    usando as colunas de latitude e longitude para isso
+    '''
+
+    print(">> Converting to GDF")
+
+    points = df.apply(lambda row: Point (row[lon_col], row[lat_col]), axis=1)
+
+    gdf = gpd.GeoDataFrame(df, geometry=points)
+
+    # Padroniza o CRS para usar Sirgas 2000, como nas constantes
+    gdf.crs = LEGAL_AMAZON.crs
+
+    return gdf
 
 
 def fill_data(datapoints):
@@ -197,9 +546,96 @@ def fill_data(datapoints):
         "estado_left": "estado"
     })
 
+    # Acrescenta os territórios protegidos que estão logo ao lado de cada foco
+    datapoints = fill_buffer_data(datapoints)
+
+    return datapoints
+
+
+def fill_buffer_data(datapoints):
+    '''
+    Identifica os focos que estão no entorno (nas faixas de 5km
+    e 10km ao redor) de terras indígenas e unidades de conservação.
+    Acrescenta, para cada tipo de território, o código do território
+    mais próximo, a faixa de entorno e a distância até ele, em km.
+
+    Os pontos são projetados uma única vez e consultados de uma
+    vez só no índice espacial dos anéis. As distâncias até os
+    territórios encontrados são calculadas de forma vetorizada.
+    '''
+
+    print(">> Attributing fires near protected areas")
+
+    x, y = grid_pyramid.TO_EQUAL_AREA.transform(datapoints.longitude.to_numpy(dtype=float), datapoints.latitude.to_numpy(dtype=float))
+    points = gpd.GeoSeries(gpd.points_from_xy(x, y), crs=grid_pyramid.EQUAL_AREA)
+
+    for code, (rings, territories) in BUFFERS.items():
+
+        suffix = code.replace("cod_", "")
+
+        point_index, ring_index = rings.sindex.query_bulk(points, predicate="within")
+
+        matched_codes = rings[code].to_numpy()[ring_index]
+
+        # Distância de cada foco até o território do anel em que ele está
+        positions = pd.Series(np.arange(territories.shape[0]), index=territories[code]).groupby(level=0).first()
+        matched_territories = territories.geometry.iloc[positions.reindex(matched_codes).to_numpy()].reset_index(drop=True)
+
+        distances = matched_territories.distance(points.iloc[point_index].reset_index(drop=True)).to_numpy() / 1000
+
+        # Um foco pode estar no entorno de vários territórios. Fica o mais próximo.
+        nearest = pd.DataFrame({
+            "ponto": point_index,
+            "codigo": matched_codes,
+            "faixa": rings.faixa_km.to_numpy()[ring_index],
+            "distancia": distances,
+        }).sort_values("distancia").drop_duplicates("ponto").set_index("ponto").reindex(np.arange(datapoints.shape[0]))
+
+        datapoints[BUFFER_LAYERS[code]] = nearest.codigo.to_numpy()
+        datapoints[f"faixa_{suffix}_km"] = nearest.faixa.to_numpy()
+        datapoints[f"distancia_{suffix}_km"] = nearest.distancia.round(2).to_numpy()
+
     return datapoints
 
 
+def format_time_columns(df):
+    '''
+    Converte as colunas de data e hora para texto,
+    formato esperado pelos arquivos feather e GeoJSON.
+    Só altera o dataframe se a conversão for necessária,
+    o que permite que vários escritores leiam o mesmo
+    dataframe ao mesmo tempo.
+    '''
+
+    for column in ("data", "hora"):
+        if column in df.columns and df[column].dtype != object:
+            df[column] = df[column].astype(str)
+
+    return df
+
+
+def output_path(artifact, format_):
+    '''
+    Retorna o caminho em que um conjunto de dados do
+    registro EXPORTS é salvo no formato especificado.
+
+    Parâmetros:
+
+    > artifact: o nome do conjunto de dados. Exemplo: 'tilesets/24h'
+
+    > format_: 'csv', 'feather', 'geojson' ou 'json'
+    '''
+
+    directory, extension = {
+        "csv": ("csvs", "csv"),
+        "feather": ("feathers", "feather"),
+        "geojson": ("jsons", "json"),
+        "json": ("jsons", "json"),
+    }[format_]
+
+    return f"{PROJECT_ROOT}/output/{directory}/{artifact}.{extension}"
+
+
 def save_csv(df, fname):
     '''
     Salva um dataframe como
@@ -208,6 +644,8 @@ def save_csv(df, fname):
 
     print(">> Saving as CSV")
 
+    detach(fname)
+
     df.to_csv(fname, index=False)
 
 
@@ -219,11 +657,9 @@ def save_feather(df, fname):
 
     print(">> Saving as feather")
 
-    if "data" in df.columns:
-        df["data"] = df.data.astype(str)
+    df = format_time_columns(df)
 
-    if "hora" in df.columns:
-        df["hora"] = df.hora.astype(str)
+    detach(fname)
 
     df.to_feather(fname)
 
@@ -237,14 +673,226 @@ def save_geojson(gdf, fname):
 
     print(">> Saving as GeoJSON")
 
-    if "data" in gdf.columns:
-        gdf["data"] = gdf.data.astype(str)
+    gdf = format_time_columns(gdf)
+
+    write_geojson(gdf, fname, precision=GEOJSON_PRECISION)
+
+
+def save_keyed_json(df, fname):
+    '''
+    Salva um dataframe sem geometria como uma tabela JSON
+    compacta, indexada pela primeira coluna, no formato
+    {"chave": coluna, "colunas": [...], "dados": {código: [valores]}}.
+    '''
+
+    print(">> Saving as keyed JSON")
+
+    key = df.columns[0]
+
+    # O to_json converte NaN em null e os tipos do numpy em tipos do JSON
+    table = json.loads(df.set_index(key).to_json(orient="split", date_format="iso"))
+
+    detach(fname)
+
+    with open(fname, "w", encoding="utf-8") as f:
+        json.dump({
+            "chave": key,
+            "colunas": table["columns"],
+            "dados": {str(code): row for code, row in zip(table["index"], table["data"])},
+        }, f, ensure_ascii=False, separators=(",", ":"))
+
+
+def save_static_geometry(gdf, name):
+    '''
+    Salva os polígonos de um tipo de território, com os seus
+    atributos fixos (nomes, códigos), em GeoJSON para o tileset
+    de geometria. Os polígonos só mudam quando os limites dos
+    territórios são atualizados, então o arquivo só é reescrito
+    quando o hash do conteúdo muda. Assim, o process_tilesets
+    não recria nem reenvia o tileset nos outros dias.
+
+    Parâmetros:
+
+    > gdf: o geodataframe com os polígonos, sem dados de fogo
+
+    > name: o nome do arquivo de saída. Exemplo: 'terras_indigenas'
+    '''
+
+    directory = f"{PROJECT_ROOT}/output/jsons/land_info/geometrias"
+    fname = f"{directory}/{name}.json"
+
+    os.makedirs(directory, exist_ok=True)
+
+    digest = hashlib.sha1()
+    digest.update(pd.util.hash_pandas_object(gdf.drop(columns=gdf.geometry.name).astype(str), index=False).to_numpy().tobytes())
+    digest.update(b"".join(gdf.geometry.apply(lambda geometry: geometry.wkb)))
+    version = digest.hexdigest()
+
+    if os.path.isfile(fname) and os.path.isfile(f"{fname}.versao"):
+        with open(f"{fname}.versao") as f:
+            if f.read() == version:
+                return
+
+    print(f">> Saving {name} boundaries, version {version[:10]}")
+
+    write_geojson(format_time_columns(gdf), fname, precision=GEOJSON_PRECISION)
+
+    detach(f"{fname}.versao")
+    with open(f"{fname}.versao", "w") as f:
+        f.write(version)
+
+
+def stats_path(artifact):
+    '''
+    Retorna o caminho do arquivo de estatísticas
+    de um conjunto de dados do registro EXPORTS.
+    '''
+
+    return f"{PROJECT_ROOT}/output/jsons/stats/{artifact}.json"
+
+
+def save_stats(df, fname):
+    '''
+    Salva um pequeno arquivo JSON com estatísticas de resumo
+    de um conjunto de dados: número de linhas, intervalo de datas,
+    focos por tipo de território, quantidade de territórios distintos,
+    somas das colunas de focos e um hash do conteúdo. Assim, quem
+    precisa apenas desses números não tem que ler os dados inteiros.
+    '''
+
+    print(">> Saving stats")
+
+    codes = [column for column in ("cod_ti", "cod_uc", "cod_bioma", "cod_box", "cod_cidade") if column in df.columns]
+    counts = [column for column in df.columns if column.startswith("focos_") or column == "dias_consecutivos"]
+
+    # Hash das colunas de atributos, calculado de forma vetorizada pelo pandas
+    attributes = df.drop(columns=[df.geometry.name]) if isinstance(df, gpd.GeoDataFrame) else df
+    content_hash = hashlib.sha1(pd.util.hash_pandas_object(attributes, index=False).values.tobytes()).hexdigest()
+
+    stats = {
+        "linhas": int(df.shape[0]),
+        "hash": content_hash,
+        "focos_por_camada": {column: int(df[column].notna().sum()) for column in codes},
+        "territorios_distintos": {column: int(df[column].nunique()) for column in codes},
+        "somas": {column: int(df[column].fillna(0).sum()) for column in counts},
+        "maximos": {column: int(df[column].fillna(0).max()) if df.shape[0] else 0 for column in counts},
+    }
+
+    if "data" in df.columns and df.shape[0]:
+        stats["data_inicial"] = str(df.data.min())
+        stats["data_final"] = str(df.data.max())
+
+    os.makedirs(dirname(fname), exist_ok=True)
+
+    detach(fname)
+
+    with open(fname, "w+") as f:
+        json.dump(stats, f, indent=2)
+
+
+# Escritores disponíveis para cada formato do registro EXPORTS
+WRITERS = {
+    "csv": save_csv,
+    "feather": save_feather,
+    "geojson": save_geojson,
+    "json": save_keyed_json,
+}
+
+
+def export_dataset(df, artifact):
+    '''
+    Salva um conjunto de dados em todos os formatos
+    que o registro EXPORTS pede para ele. Os escritores
+    de cada formato rodam ao mesmo tempo, em threads.
+
+    Arquivos de formatos que ninguém pediu são removidos,
+    para que versões antigas não sejam lidas por engano.
+    Eles podem ser gerados com export_on_demand.
+
+    Junto com os dados, salva também um arquivo com
+    estatísticas de resumo (veja save_stats).
 
+    Parâmetros:
 
-    if "hora" in gdf.columns:
-        gdf["hora"] = gdf.hora.astype(str)
+    > df: o dataframe ou geodataframe que será salvo
 
-    gdf.to_file(fname, driver="GeoJSON")
+    > artifact: o nome do conjunto de dados no registro EXPORTS
+    '''
+
+    formats = EXPORTS[artifact]
+
+    for format_ in formats:
+        os.makedirs(dirname(output_path(artifact, format_)), exist_ok=True)
+
+    # Converte as colunas uma única vez, antes de dividir o trabalho entre as threads
+    df = format_time_columns(df)
+
+    with ThreadPoolExecutor(max_workers=len(formats) + 1) as executor:
+
+        futures = [executor.submit(WRITERS[format_], df, output_path(artifact, format_)) for format_ in formats]
+        futures.append(executor.submit(save_stats, df, stats_path(artifact)))
+
+        # Propaga eventuais exceções das threads
+        for future in futures:
+            future.result()
+
+    # Formatos diferentes podem ter o mesmo caminho, como 'geojson' e 'json'
+    kept = {output_path(artifact, format_) for format_ in formats}
+
+    for format_ in WRITERS:
+        fname = output_path(artifact, format_)
+        if fname not in kept and os.path.isfile(fname):
+            os.remove(fname)
+
+
+def export_on_demand(artifact, format_):
+    '''
+    Gera, a partir do arquivo feather canônico, um formato
+    que não é produzido na atualização diária. Retorna o
+    caminho do arquivo criado.
+
+    Parâmetros:
+
+    > artifact: o nome do conjunto de dados no registro EXPORTS
+
+    > format_: 'csv', 'feather', 'geojson' ou 'json'
+    '''
+
+    source = output_path(artifact, "feather")
+
+    # Tabelas sem geometria, como os eventos e os atributos dos
+    # territórios, não têm os metadados do geopandas
+    if b"geo" in (ds.dataset(source, format="ipc").schema.metadata or { }):
+        df = gpd.read_feather(source)
+    elif format_ == "geojson":
+        raise ValueError(f"{artifact} has no geometry and cannot be exported as GeoJSON")
+    else:
+        df = pd.read_feather(source)
+
+    fname = output_path(artifact, format_)
+    WRITERS[format_](df, fname)
+
+    return fname
+
+
+def remove_retired_outputs():
+    '''
+    Apaga da geração atual do output os arquivos e diretórios
+    de RETIRED_OUTPUTS. Como as gerações são ligadas por hardlinks,
+    as gerações anteriores continuam com as suas cópias.
+    '''
+
+    for item in RETIRED_OUTPUTS:
+
+        path = f"{PROJECT_ROOT}/output/{item}"
+
+        if os.path.isdir(path):
+            print(f">> Removing retired output {item}")
+            shutil.rmtree(path)
+
+        elif os.path.isfile(path):
+            print(f">> Removing retired output {item}")
+            os.remove(path)
 
 
 def sanitize_duplicates(df, logfile):
@@ -267,6 +915,7 @@ def sanitize_duplicates(df, logfile):
     elif logfile == "bd_completo":
 
         # Adiciona novas entradas ao log de duplicados
+        detach(f"../output/csvs/logs/bd_completo.csv", keep_contents=True)
         dup_entries.to_csv(f"../output/csvs/logs/bd_completo.csv", mode='a', header=False)
 
     # Mantém as primeiras ocorrências
@@ -289,6 +938,7 @@ def sanitize_api_duplicates(df, logfile):
     dup_entries = df[df.duplicated(subset=["data", "hora", "latitude", "longitude"], keep='last')]
 
     if logfile == "bd_completo":
+        detach(f"../output/csvs/logs/api_bd_completo.csv", keep_contents=True)
         dup_entries.to_csv(f"../output/csvs/logs/api_bd_completo.csv", mode='a', header=False)
 
 
@@ -346,16 +996,12 @@ def uuid_fires(df):
 ### Main tasks ###
 ##################
 
-def build_original_database():
+def read_fire_archive():
     '''
-    Lê os arquivos baixados manualmente do site da NASA
-    e salva o dataframe resultante. Retorna dois dataframes:
-    um já sem duplicatas, para plotar os tilesets do total de fogo
-    em toda a Amazônia, e outro com as duplicatas, que serão usadas para 
-    computar o total de focos de fogo em cada território. 
-    Essas duplicatas existem porque alguns territórios tem áreas que se sobrepõem,
-    então é possível que um foco esteja em dois territórios do mesmo tipo ao mesmo
-    tempo.
+    Lê os arquivos baixados manualmente do site da NASA (o arquivo
+    histórico de padrão científico e os dados de near real time),
+    recorta os focos sobre a Amazônia e os cruza com os territórios.
+    Retorna um dataframe com as duplicatas de territórios sobrepostos.
     '''
 
     # Lê arquivos com campos em um tipo específico
@@ -391,30 +1037,77 @@ def build_original_database():
                 "cod_bioma", "nome_bioma",
                 "bright_ti4", "bright_ti5", "frp",
                 "nome_uc", "cod_uc", "geometry",
-                "cod_box"
+                "cod_box",
+                "cod_ti_entorno", "faixa_ti_km", "distancia_ti_km",
+                "cod_uc_entorno", "faixa_uc_km", "distancia_uc_km"
             ]]
 
+    return df
+
+
+def build_original_database():
+    '''
+    Lê os arquivos baixados manualmente do site da NASA
+    e salva o dataframe resultante. Retorna dois dataframes:
+    um já sem duplicatas, para plotar os tilesets do total de fogo
+    em toda a Amazônia, e outro com as duplicatas, que serão usadas para 
+    computar o total de focos de fogo em cada território. 
+    Essas duplicatas existem porque alguns territórios tem áreas que se sobrepõem,
+    então é possível que um foco esteja em dois territórios do mesmo tipo ao mesmo
+    tempo.
+    '''
+
+    df = read_fire_archive()
+
     # Mantém um banco de dados com as duplicatas para calcular os tilesets de terra posteriormente
     df_dups = df.copy()
 
     df = sanitize_duplicates(df, "bd_completo")
 
-    # Salva como CSV
-    save_csv(df, f"{PROJECT_ROOT}/output/csvs/tilesets/bd_completo.csv")
+    # Salva nos formatos registrados em EXPORTS
+    export_dataset(df, "tilesets/bd_completo")
+    export_dataset(df_dups, "tilesets/bd_completo_com_duplicatas")
 
-    # Salva como Feather
-    save_feather(df,  f"{PROJECT_ROOT}/output/feathers/tilesets/bd_completo.feather")
-    save_feather(df_dups, f"{PROJECT_ROOT}/output/feathers/tilesets/bd_completo_com_duplicatas.feather")
+    # Cria os rasters diários de densidade usados nos zooms baixos
+    density_rasters.rebuild_daily_rasters(df)
 
+    # Agrupa os focos em eventos de fogo
+    update_fire_events(df, df.data.min(), rebuild=True)
 
-    # Salva como GeoJSON
-    save_geojson(df,  f"{PROJECT_ROOT}/output/jsons/tilesets/bd_completo.json")
-    #save_geojson(df_dups, f"{PROJECT_ROOT}/output/jsons/tilesets/bd_completo_com_duplicatas.json")
+    # Cria o índice de persistência do fogo por pixel
+    update_pixel_persistence(df, df.data.min(), rebuild=True)
+
+    # Calcula as linhas de base históricas a partir de todos os anos do arquivo
+    build_historical_baselines(df_dups)
+
+    # Cria o cubo de focos por território e dia
+    update_fire_cube(df_dups, df_dups.data.min(), rebuild=True)
 
 
     return df, df_dups
 
 
+def build_historical_baselines(df=None):
+    '''
+    Calcula as linhas de base históricas de cada tipo de território
+    (veja baselines.py). Também pode ser executada sozinha, em
+    instalações que já têm o banco de dados:
+
+    python process_data.py baselines
+
+    Parâmetros:
+
+    > df: os focos de todos os anos do arquivo, com duplicatas.
+    Se for None, o arquivo histórico é lido com read_fire_archive.
+    '''
+
+    if df is None:
+        df = read_fire_archive()
+
+    for layer in LAYERS:
+        baselines.build_baselines(df, layer)
+
+
 def fetch_recent_data():
     '''
     Acessa, salva e retorna dataframes com os
@@ -461,7 +1154,9 @@ def fetch_recent_data():
                     "cod_bioma", "nome_bioma",
                     "bright_ti4", "bright_ti5", "frp",
                     "nome_uc", "cod_uc", "geometry",
-                    "cod_box"
+                    "cod_box",
+                    "cod_ti_entorno", "faixa_ti_km", "distancia_ti_km",
+                    "cod_uc_entorno", "faixa_uc_km", "distancia_uc_km"
                 ]]
 
         # Lida com duplicatas
@@ -475,15 +1170,9 @@ def fetch_recent_data():
         dfs[time] = df
         dfs[f"{time}_dups"] = df_dups
 
-        # Salva como CSV
-        save_csv(df, f"{PROJECT_ROOT}/output/csvs/tilesets/{time}.csv")
-
-        # Salva como Feather
-        save_feather(df, f"{PROJECT_ROOT}/output/feathers/tilesets/{time}.feather")
-        save_feather(df_dups, f"{PROJECT_ROOT}/output/feathers/tilesets/{time}_com_duplicatas.feather")
-
-        # Salva como GeoJSON
-        save_geojson(df, f"{PROJECT_ROOT}/output/jsons/tilesets/{time}.json")
+        # Salva nos formatos registrados em EXPORTS
+        export_dataset(df, f"tilesets/{time}")
+        export_dataset(df_dups, f"tilesets/{time}_com_duplicatas")
 
     # Retorna os dataframes para usar no resto dos processos
     return dfs["24h"], dfs["24h_dups"], dfs["7d"], dfs["7d_dups"]
@@ -525,18 +1214,40 @@ def update_original_database(new_data, new_data_dups):
             
             datapoints = sanitize_api_duplicates(datapoints, "bd_completo")
 
-            save_csv(datapoints, f"{PROJECT_ROOT}/output/csvs/tilesets/bd_completo.csv")
-            save_feather(datapoints,  f"{PROJECT_ROOT}/output/feathers/tilesets/bd_completo.feather")
-            save_geojson(datapoints,  f"{PROJECT_ROOT}/output/jsons/tilesets/bd_completo.json")
+            export_dataset(datapoints, "tilesets/bd_completo")
+
+            # Acrescenta apenas os focos novos aos rasters diários de densidade
+            # e descarta os dias que saíram da janela de retenção
+            if os.path.isdir(f"{density_rasters.RASTER_DIR}/dias"):
+                density_rasters.add_daily_rasters(datapoints[~datapoints.uuid.isin(gdf.uuid)])
+                density_rasters.compact_daily_rasters(f"{year}-01-01")
+            else:
+                density_rasters.rebuild_daily_rasters(datapoints)
+
+            # Liga os focos novos aos eventos de fogo dos dias anteriores
+            if os.path.isfile(f"{EVENTS_DIR}/focos.feather"):
+                update_fire_events(datapoints[~datapoints.uuid.isin(gdf.uuid)], f"{year}-01-01")
+            else:
+                update_fire_events(datapoints, f"{year}-01-01", rebuild=True)
+
+            # Registra os focos novos no índice de persistência por pixel
+            if os.path.isfile(PERSISTENCE_FILE):
+                update_pixel_persistence(datapoints[~datapoints.uuid.isin(gdf.uuid)], f"{year}-01-01")
+            else:
+                update_pixel_persistence(datapoints, f"{year}-01-01", rebuild=True)
 
             # Salva os dados sem duplicatas em uma variável
             gdf = datapoints.copy()
 
         elif label == "duplicated":
 
-            #save_csv(datapoints, f"{PROJECT_ROOT}/output/csvs/tilesets/bd_completo_com_duplicatas.csv")
-            save_feather(datapoints, f"{PROJECT_ROOT}/output/csvs/tilesets/bd_completo_com_duplicatas.feather")
-            #save_geojson(datapoints, f"{PROJECT_ROOT}/output/csvs/tilesets/bd_completo_com_duplicatas.geojson")
+            export_dataset(datapoints, "tilesets/bd_completo_com_duplicatas")
+
+            # Conta no cubo de focos apenas as linhas novas
+            if all(os.path.isfile(f"{CUBE_DIR}/{layer}.feather") for layer in CUBE_LAYERS):
+                update_fire_cube(datapoints[~datapoints.uuid.isin(gdf_dups.uuid)], f"{year}-01-01")
+            else:
+                update_fire_cube(datapoints, f"{year}-01-01", rebuild=True)
 
             gdf_dups = datapoints.copy()
 
@@ -544,22 +1255,39 @@ def update_original_database(new_data, new_data_dups):
 
 
 # Atualiza os bancos de dados estáticos de terras indígenas e unidades de conservação
-def update_land_datasets(df_24h, df_7d, full_db):
+def update_land_datasets(df_24h, df_7d):
     
     # Por quais colunas vamos agregar?
-    # Cada resultado vai ser salvo em um arquivo diferente
-    columns = ["cod_ti", "cod_uc", "cod_bioma", "cod_box", "cod_cidade"]
+    # Cada resultado vai ser salvo em um arquivo diferente. As colunas
+    # de entorno entram nas tabelas dos seus próprios territórios.
+    columns = [column for column in CUBE_LAYERS if column not in BUFFER_LAYERS.values()]
+
+    # Identifica as células das grades hierárquicas, sem spatial join
+    df_24h = grid_pyramid.add_cell_ids(df_24h.copy())
+    df_7d = grid_pyramid.add_cell_ids(df_7d.copy())
 
-    # Essas são as agregações temporais que faremos
-    # e seus respectivos dataframes
-    labels = ["db_completo", "7d", "24h"]
-    dfs = [full_db, df_7d, df_24h]
+    # O cubo de focos tem os pares (território, dia) com fogo do ano inteiro
+    cubes = {column: read_fire_cube(column) for column in CUBE_LAYERS}
+
+    # Dias consecutivos de fogo, até hoje, para todos os tipos de território de uma vez
+    streaks = consecutive_days(cubes)
+
+    # Essas são as agregações temporais que faremos a partir dos dados
+    # da NASA. O total do banco completo sai do cubo de focos.
+    labels = ["7d", "24h"]
+    dfs = [df_7d, df_24h]
 
     for column in columns:
 
         # Os dataframes de cada recorte temporal são salvos aqui e depois
         # passam por um merge para criar uma única tabela
         gpbys = [ ]
+
+        # O total do ano é a soma de todos os dias do cubo
+        cube = cubes[column]
+        gpby = cube.groupby(column).focos.sum().reset_index().rename(columns={"focos": "focos_db_completo"})
+
+        gpbys.append(gpby)
         
         for label, df in zip(labels, dfs):
 
@@ -568,56 +1296,89 @@ def update_land_datasets(df_24h, df_7d, full_db):
             gpbys.append(gpby)
             
         # Adiciona também um dado de focos de fogo consecutivo            
-        gpby = full_db.groupby(column)
+        gpbys.append(streaks[column])
 
-        gpby = get_consecutive_days(gpby)
+        # Focos no entorno de TIs e UCs, com os mesmos recortes temporais
+        if column in BUFFER_LAYERS:
 
-        gpbys.append(gpby)
+            buffer_column = BUFFER_LAYERS[column]
+
+            gpby = cubes[buffer_column].groupby(buffer_column).focos.sum().rename("focos_entorno_db_completo")
+            gpbys.append(gpby.rename_axis(column).reset_index())
+
+            for label, df in zip(labels, dfs):
+                gpby = df.groupby(buffer_column).size().rename(f"focos_entorno_{label}")
+                gpbys.append(gpby.rename_axis(column).reset_index())
+
+        # Reúne os dados do array usando reduce. O merge é 'outer' para não perder
+        # os territórios que só têm focos no entorno, e não dentro deles.
+        gpby = reduce(lambda a,b: pd.merge(a,b,on=column, how='outer'), gpbys)
 
-        # Reúne os dados do array usando reduce
-        gpby = reduce(lambda a,b: pd.merge(a,b,on=column, how='left'), gpbys)
+        # Nas contagens de dentro dos territórios, NaN continua querendo dizer que não houve
+        # fogo no recorte (veja process_tweet_images). No entorno, a ausência vira zero.
+        counts = [item for item in gpby.columns if item.startswith("focos_entorno_")]
+        gpby[counts] = gpby[counts].fillna(0).astype(np.int64)
+
+        # Compara os focos com o histórico do mesmo dia do ano
+        if baselines.has_baselines(column):
+            for label, df in zip(labels, dfs):
+                scores = baselines.score(column, gpby.set_index(column)[f"focos_{label}"].fillna(0), df.data.max(), label)
+                gpby[f"zscore_{label}"] = scores.zscore.to_numpy()
+                gpby[f"percentil_{label}"] = scores.percentil.to_numpy()
     
-        # Reúne os dados com o banco de dados original e salva em vários formatos
+        # Reúne os dados com o banco de dados original e salva em vários formatos.
+        # Para o mapa, os polígonos e os dados diários são salvos separadamente.
         if column == "cod_ti":
+
+            save_static_geometry(INDIGENOUS_LAND, "terras_indigenas")
+            export_dataset(gpby, "land_info/atributos/terras_indigenas")
             
             gpby = INDIGENOUS_LAND.merge(gpby, on=column, how="left")
             
-            save_feather(gpby, f"{PROJECT_ROOT}/output/feathers/land_info/terras_indigenas.feather")
-            save_csv(gpby, f"{PROJECT_ROOT}/output/csvs/land_info/terras_indigenas.csv")
-            save_geojson(gpby, f"{PROJECT_ROOT}/output/jsons/land_info/terras_indigenas.json")
+            export_dataset(gpby, "land_info/terras_indigenas")
         
         elif column == "cod_uc":
+
+            save_static_geometry(CONSERVATION_UNITS, "unidades_de_conservacao")
+            export_dataset(gpby, "land_info/atributos/unidades_de_conservacao")
             
             gpby = CONSERVATION_UNITS.merge(gpby, on=column, how="left")
             
-            save_feather(gpby, f"{PROJECT_ROOT}/output/feathers/land_info/unidades_de_conservacao.feather")
-            save_csv(gpby, f"{PROJECT_ROOT}/output/csvs/land_info/unidades_de_conservacao.csv")
-            save_geojson(gpby, f"{PROJECT_ROOT}/output/jsons/land_info/unidades_de_conservacao.json")
+            export_dataset(gpby, "land_info/unidades_de_conservacao")
             
         elif column == "cod_bioma":
+
+            save_static_geometry(BIOMES, "biomas")
+            export_dataset(gpby, "land_info/atributos/biomas")
             
             gpby = BIOMES.merge(gpby, on=column, how="left")
 
-            save_feather(gpby, f"{PROJECT_ROOT}/output/feathers/land_info/biomas.feather")
-            save_csv(gpby, f"{PROJECT_ROOT}/output/csvs/land_info/biomas.csv")
-            save_geojson(gpby, f"{PROJECT_ROOT}/output/jsons/land_info/biomas.json")
+            export_dataset(gpby, "land_info/biomas")
 
         elif column == "cod_box":
             
             gpby = GRID.merge(gpby, on=column, how="left")
 
-            save_feather(gpby, f"{PROJECT_ROOT}/output/feathers/land_info/grid_20km.feather")
-            save_csv(gpby, f"{PROJECT_ROOT}/output/csvs/land_info/grid_20km.csv")
-            save_geojson(gpby, f"{PROJECT_ROOT}/output/jsons/land_info/grid_20km.json")
+            # Soma de focos na vizinhança e regiões de células quentes vizinhas
+            gpby = grid_hotspots(gpby, cube, df_7d.data.max())
+
+            export_dataset(gpby, "land_info/grid_20km")
 
         elif column == "cod_cidade":
 
+            save_static_geometry(CITIES, "cidades")
+            export_dataset(gpby, "land_info/atributos/cidades")
 
             gpby = CITIES.merge(gpby, on=column, how="left")
 
-            save_feather(gpby, f"{PROJECT_ROOT}/output/feathers/land_info/cidades.feather")
-            save_csv(gpby, f"{PROJECT_ROOT}/output/csvs/land_info/cidades.csv")
-            save_geojson(gpby, f"{PROJECT_ROOT}/output/jsons/land_info/cidades.json")
+            export_dataset(gpby, "land_info/cidades")
+
+        elif column in grid_pyramid.LEVELS:
+
+            # Apenas as células com algum foco no ano são desenhadas
+            gpby = gpd.GeoDataFrame(gpby, geometry=grid_pyramid.cell_polygons(gpby[column], column), crs=LEGAL_AMAZON.crs)
+
+            export_dataset(gpby, f"land_info/{column.replace('cod_', '')}")
 
 
 #################
@@ -627,6 +1388,23 @@ def update_land_datasets(df_24h, df_7d, full_db):
 # Gerar um arquivo JSON com informações para montar os alertas do dia
 def main(argv):
 
+    # Gera sob demanda um formato que não é salvo na atualização diária.
+    # Exemplo: python process_data.py export tilesets/bd_completo csv
+    if len(argv) > 1 and argv[1] == "export":
+        if len(argv) != 4 or argv[2] not in EXPORTS or argv[3] not in WRITERS:
+            print("Usage: python process_data.py export <conjunto de dados> [csv|feather|geojson|json]")
+            sys.exit(1)
+
+        print(f"> Exporting {argv[2]} as {argv[3]}")
+        export_on_demand(argv[2], argv[3])
+        return
+
+    # Cria as linhas de base históricas em instalações que já têm o banco de dados
+    if len(argv) > 1 and argv[1] == "baselines":
+        print("> Building historical baselines")
+        build_historical_baselines()
+        return
+
     # Essa flag é usada para determinar se o banco de dados está sendo
     # atualizado pela primeira vez ou não.
     if len(argv) > 1:
@@ -634,22 +1412,26 @@ def main(argv):
             print("IMPORTANT: This is a setup run. Data WILL NOT be updated.")
             setup = True
         else:
-            print("Invalid command line argument. Can only be 'setup'")
+            print("Invalid command line argument. Can only be 'setup', 'export' or 'baselines'")
             sys.exit(1)
     else:
         print("IMPORTANT: this is an update run. Data WILL be updated.")
         setup = False
 
     
-    # Cria um backup para manter os dados sempre ativos
-    print("> Backuping data")
-    copy_tree(f"{PROJECT_ROOT}/output/", f"{PROJECT_ROOT}/output_bkp")
+    # Cria uma nova geração do output, com hardlinks para os arquivos da anterior.
+    # A geração anterior funciona como backup e não é alterada por essa execução.
+    print("> Starting new output generation")
+    previous_generation = begin_generation()
    
     # Atualiza o banco de dados, sabendo que uma enormidade de coisas podem dar errado (conexão, por exemplo)
     try:
+
+        # Arquivos que nenhuma etapa lê mais não seguem para a nova geração
+        remove_retired_outputs()
         
         # Caso o banco de dados completo não exista, cria.
-        db_path = f"{PROJECT_ROOT}/output/csvs/tilesets/bd_completo.csv"
+        db_path = output_path("tilesets/bd_completo", "feather")
 
         db_exists = os.path.isfile(db_path)
         if not db_exists:
@@ -667,16 +1449,19 @@ def main(argv):
 
         # TO DO: filtra os dados de full_db para manter apenas entradas do ano corrente
 
+        # Exporta os rasters de densidade das últimas 24h, 7 dias e do ano
+        density_rasters.export_windows(pd.to_datetime(full_db.data).max().strftime("%Y-%m-%d"))
+
         # Cria arquivos com os dados estáticos sobre terras indígenas e unidades de conservação
         print("> Creating land databases")
-        update_land_datasets(df_24h_dups, df_7d_dups, full_db_dups)
+        update_land_datasets(df_24h_dups, df_7d_dups)
         
     except Exception as e:
         
         print(f"Exception {e} detected. Restoring files to previous state")
         
-        # Se quebrar, podemos colocar o backup de volta no diretório de dados
-        copy_tree(f"{PROJECT_ROOT}/output_bkp", f"{PROJECT_ROOT}/output/")
+        # Se quebrar, basta descartar a geração nova e voltar para a anterior
+        rollback_generation(previous_generation)
 
 
 if __name__ == "__main__":
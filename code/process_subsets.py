@@ -1,12 +1,17 @@
 '''
 Salva recortes específicos dos bancos de dados completos 
-em formato GeoJSON. Eles serão usados para enviar ao Mapbox
+como tilesets .mbtiles. Eles serão usados para enviar ao Mapbox
 recortes de dados menores, em que todos os pontos precisam
 estar visíveis ao mesmo tempo para evitar dissonância na mensagem.
+
+Os recortes são pequenos, então os vector tiles são gerados
+aqui mesmo (veja vector_tiles.py), sem passar pelo tippecanoe.
 '''
 
 import geopandas as gpd
 import os
+from process_tilesets import tileset_properties
+from vector_tiles import write_mbtiles
 
 ###########################
 ### Rename os functions ###
@@ -28,6 +33,31 @@ PROJECT_ROOT = dirname(abspath(dirname(__file__)))
 ### Helpers ###
 ###############
 
+def save_tileset(gdf, tileset):
+	'''
+	Gera os vector tiles de um recorte e os salva no .mbtiles
+	que process_tilesets envia ao Mapbox. A camada tem o nome
+	do tileset, como nos tilesets criados pelo tippecanoe, e
+	apenas as propriedades declaradas em process_tilesets.SOURCES
+	vão para os tiles.
+
+	Parâmetros:
+
+	gdf -> O geodataframe com os pontos do recorte.
+
+	tileset -> O nome do tileset. Exemplo: 'amzsufocada-24h-tis'
+	'''
+
+	directory = f"{PROJECT_ROOT}/output/mbtiles/tilesets"
+	os.makedirs(directory, exist_ok=True)
+
+	properties = tileset_properties(tileset)
+
+	gdf = gdf[properties + [gdf.geometry.name]]
+
+	write_mbtiles(gdf, f"{directory}/{tileset}.mbtiles", tileset, properties)
+
+
 def find_place_with_most_fire(df, code, position=1):
     '''
     Encontra qual é o território com mais fogo
@@ -113,16 +143,16 @@ def main():
 	grid_most_fire_3 = points_7d[points_7d.cod_box == grid_most_fire_3_id]
 
 	# Salva os recortes de 24h
-	inside_tis.to_file(f"{PROJECT_ROOT}/output/jsons/tilesets/24h_tis.json", driver="GeoJSON")
-	inside_ucs.to_file(f"{PROJECT_ROOT}/output/jsons/tilesets/24h_ucs.json", driver="GeoJSON")
-	uc_most_fire.to_file(f"{PROJECT_ROOT}/output/jsons/tilesets/24h_uc_most_fire.json", driver="GeoJSON")
-	ti_most_fire.to_file(f"{PROJECT_ROOT}/output/jsons/tilesets/24h_ti_most_fire.json", driver="GeoJSON")
+	save_tileset(inside_tis, "amzsufocada-24h-tis")
+	save_tileset(inside_ucs, "amzsufocada-24h-ucs")
+	save_tileset(uc_most_fire, "amzsufocada-24h-ucs-most-fire")
+	save_tileset(ti_most_fire, "amzsufocada-24h-ti-most-fire")
 
 
 	# Salva os recortes de 7d
-	grid_most_fire_1.to_file(f"{PROJECT_ROOT}/output/jsons/tilesets/7d_grid_1.json", driver="GeoJSON")
-	grid_most_fire_2.to_file(f"{PROJECT_ROOT}/output/jsons/tilesets/7d_grid_2.json", driver="GeoJSON")
-	grid_most_fire_3.to_file(f"{PROJECT_ROOT}/output/jsons/tilesets/7d_grid_3.json", driver="GeoJSON")
+	save_tileset(grid_most_fire_1, "amzsufocada-7d-grid-1")
+	save_tileset(grid_most_fire_2, "amzsufocada-7d-grid-2")
+	save_tileset(grid_most_fire_3, "amzsufocada-7d-grid-3")
 
 
 
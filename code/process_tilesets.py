@@ -7,17 +7,39 @@ A maior parte da funcionalidade desse script
 de linha de comando 'Tilesets CLI' e do Tippecanoe, 
 desenvolvidos pela equipe do próprio Mapbox. 
 
+Para publicar os tilesets de focos pelo Mapbox Tiling
+Service, acrescentando à fonte apenas os focos novos:
+
+python process_tilesets.py mts
+
+Para criar os tilesets localmente e convertê-los em arquivos
+PMTiles, servidos como arquivos estáticos, sem enviá-los ao Mapbox:
+
+python process_tilesets.py pmtiles
+
 Veja mais:
 
 https://github.com/mapbox/tilesets-cli/
 https://github.com/RodrigoMenegat/amazonia-sufocada
 '''
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import datetime
+from functools import partial
+from generations import detach
+from geojson_stream import stream_feather_points, write_points
+import glob
+import hashlib
 import mapbox_credentials
+import mts
 import json
 import os
+import pandas as pd
+import pmtiles_export
 import shutil
 import subprocess
+import sys
+import tempfile
 import time
 
 
@@ -38,30 +60,473 @@ TOKEN = mapbox_credentials.token
 
 USERNAME = "infoamazonia"
 
+# Quantos tippecanoes rodam ao mesmo tempo. Cada tippecanoe já usa várias
+# threads (e as camadas lidas com -P, ainda mais), então o grupo fica com
+# metade dos núcleos, até no máximo 4 processos, para não disputar a CPU.
+TIPPECANOE_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
+# Quantos uploads para o Mapbox rodam ao mesmo tempo, limitados pela rede
+UPLOAD_WORKERS = 4
+
+# Propriedades de cada tileset de focos usadas pelo estilo do mapa.
+# As demais colunas do banco de dados não vão para os tiles.
+POINT_PROPERTIES = ["data", "hora", "date_diff", "frp", "cidade", "estado", "nome_ti", "nome_uc", "nome_bioma"]
+SEASON_PROPERTIES = ["data", "date_diff", "frp"]
+TI_PROPERTIES = ["data", "hora", "frp", "cidade", "estado", "nome_ti", "nome_etnia"]
+UC_PROPERTIES = ["data", "hora", "frp", "cidade", "estado", "nome_uc"]
+GRID_PROPERTIES = ["data", "hora", "frp", "cidade", "estado", "cod_box"]
+
+# Tuplas no formato (tileset, caminho da entrada, propriedades). Com propriedades
+# None, todas as colunas da entrada vão para os tiles. Os tilesets de territórios
+# têm só os polígonos e os atributos fixos, que mudam apenas com novas versões dos
+# limites; os dados diários de fogo ficam nas tabelas de output/jsons/land_info/atributos,
+# que o mapa junta aos polígonos pelo código do território. A exceção é o grid de
+# 20km, que está em IMAGE_TILESETS: a API de imagens estáticas não faz essa junção,
+# então ele leva as contagens de focos junto com os polígonos.
 SOURCES = [
-        ("amzsufocada-24h", f"{PROJECT_ROOT}/output/jsons/tilesets/24h.json"),
-        ("amzsufocada-24h-tis", f"{PROJECT_ROOT}/output/jsons/tilesets/24h_tis.json"),
-        ("amzsufocada-24h-ucs", f"{PROJECT_ROOT}/output/jsons/tilesets/24h_ucs.json"),
-        ("amzsufocada-24h-ti-most-fire", f"{PROJECT_ROOT}/output/jsons/tilesets/24h_ti_most_fire.json" ),
-        ("amzsufocada-24h-ucs-most-fire", f"{PROJECT_ROOT}/output/jsons/tilesets/24h_uc_most_fire.json"),
-        ("amzsufocada-7d", f"{PROJECT_ROOT}/output/jsons/tilesets/7d.json"),
-        ("amzsufocada-bd-completo", f"{PROJECT_ROOT}/output/jsons/tilesets/bd_completo.json"),
-        ("amzsufocada-terras-indigenas", f"{PROJECT_ROOT}/output/jsons/land_info/terras_indigenas.json"),
-        ("amzsufocada-unidades-conserv", f"{PROJECT_ROOT}/output/jsons/land_info/unidades_de_conservacao.json"),
-        ("amzsufocada-biomas", f"{PROJECT_ROOT}/output/jsons/land_info/biomas.json"),
-        ("amzsufocada-cidades", f"{PROJECT_ROOT}/output/jsons/land_info/cidades.json"),
-        ("amzusufocada-cidades", f"{PROJECT_ROOT}/output/jsons/land_info/cidades.json"),
-        ("amzsufocada-grid-20km", f"{PROJECT_ROOT}/output/jsons/land_info/grid_20km.json"),
-        ("amzsufocada-7d-grid-1", f"{PROJECT_ROOT}/output/jsons/tilesets/7d_grid_1.json"),
-        ("amzsufocada-7d-grid-2", f"{PROJECT_ROOT}/output/jsons/tilesets/7d_grid_2.json"),
-        ("amzsufocada-7d-grid-3", f"{PROJECT_ROOT}/output/jsons/tilesets/7d_grid_3.json")
+        ("amzsufocada-24h", f"{PROJECT_ROOT}/output/feathers/tilesets/24h.feather", POINT_PROPERTIES),
+        ("amzsufocada-24h-tis", f"{PROJECT_ROOT}/output/mbtiles/tilesets/amzsufocada-24h-tis.mbtiles", TI_PROPERTIES),
+        ("amzsufocada-24h-ucs", f"{PROJECT_ROOT}/output/mbtiles/tilesets/amzsufocada-24h-ucs.mbtiles", UC_PROPERTIES),
+        ("amzsufocada-24h-ti-most-fire", f"{PROJECT_ROOT}/output/mbtiles/tilesets/amzsufocada-24h-ti-most-fire.mbtiles", TI_PROPERTIES),
+        ("amzsufocada-24h-ucs-most-fire", f"{PROJECT_ROOT}/output/mbtiles/tilesets/amzsufocada-24h-ucs-most-fire.mbtiles", UC_PROPERTIES),
+        ("amzsufocada-7d", f"{PROJECT_ROOT}/output/feathers/tilesets/7d.feather", POINT_PROPERTIES),
+        ("amzsufocada-bd-completo", f"{PROJECT_ROOT}/output/feathers/tilesets/bd_completo.feather", SEASON_PROPERTIES),
+        ("amzsufocada-terras-indigenas", f"{PROJECT_ROOT}/output/jsons/land_info/geometrias/terras_indigenas.json", None),
+        ("amzsufocada-unidades-conserv", f"{PROJECT_ROOT}/output/jsons/land_info/geometrias/unidades_de_conservacao.json", None),
+        ("amzsufocada-biomas", f"{PROJECT_ROOT}/output/jsons/land_info/geometrias/biomas.json", None),
+        ("amzsufocada-cidades", f"{PROJECT_ROOT}/output/jsons/land_info/geometrias/cidades.json", None),
+        ("amzusufocada-cidades", f"{PROJECT_ROOT}/output/jsons/land_info/geometrias/cidades.json", None),
+        ("amzsufocada-grid-20km", f"{PROJECT_ROOT}/output/jsons/land_info/grid_20km.json", None),
+        ("amzsufocada-7d-grid-1", f"{PROJECT_ROOT}/output/mbtiles/tilesets/amzsufocada-7d-grid-1.mbtiles", GRID_PROPERTIES),
+        ("amzsufocada-7d-grid-2", f"{PROJECT_ROOT}/output/mbtiles/tilesets/amzsufocada-7d-grid-2.mbtiles", GRID_PROPERTIES),
+        ("amzsufocada-7d-grid-3", f"{PROJECT_ROOT}/output/mbtiles/tilesets/amzsufocada-7d-grid-3.mbtiles", GRID_PROPERTIES)
+]
+
+# Tilesets que aparecem nos estilos usados por process_tweet_images.py. Os mapas
+# de TIs e UCs usam os recortes de focos de process_subsets, e o mapa do grid usa
+# o grid de 20km com as contagens de focos. wait_tilesets.py espera por eles.
+IMAGE_TILESETS = [
+        "amzsufocada-24h",
+        "amzsufocada-24h-tis",
+        "amzsufocada-24h-ucs",
+        "amzsufocada-24h-ti-most-fire",
+        "amzsufocada-24h-ucs-most-fire",
+        "amzsufocada-7d",
+        "amzsufocada-grid-20km",
+        "amzsufocada-7d-grid-1",
+        "amzsufocada-7d-grid-2",
+        "amzsufocada-7d-grid-3",
 ]
 
+# Tilesets pequenos, criados com -r1 (veja tippecanoe). Os recortes de
+# process_subsets, também pequenos, já chegam prontos como .mbtiles.
+SMALL_TILESETS = ["amzsufocada-grid-20km"]
+
+# Tilesets de polígonos, que precisam de buffer para não mostrar linhas nas bordas dos tiles
+POLYGON_TILESETS = ["amzsufocada-terras-indigenas", "amzsufocada-unidades-conserv", "amzsufocada-biomas", "amzsufocada-cidades", "amzusufocada-cidades"]
+
+TILE_JOIN_PATH = abspath("/home/tippecanoe/tile-join")
+
+# Tilesets atualizados por diferença: apenas os focos novos passam pelo
+# tippecanoe, em um .mbtiles por dia, e são juntados ao tileset da temporada
+# com o tile-join (veja tile_delta)
+DELTA_TILESETS = ["amzsufocada-bd-completo"]
+
+# Estado dos tilesets atualizados por diferença e .mbtiles diários temporários
+DELTA_DIR = f"{PROJECT_ROOT}/output/mbtiles/delta"
+
+# A cada quantos dias o tileset da temporada é recriado do zero. O tile-join
+# não descarta feições, então os tiles densos crescem a cada junção até a
+# próxima reconstrução, que refaz o descarte de feições por densidade.
+FULL_REBUILD_DAYS = 7
+
+# Receitas dos tilesets publicados pelo Mapbox Tiling Service (veja mts.py)
+RECIPES_DIR = f"{PROJECT_ROOT}/output/jsons/recipes"
+
+# Hashes do conteúdo de entrada e dos argumentos de cada tileset enviado
+MANIFEST = f"{PROJECT_ROOT}/output/mbtiles/manifest.json"
+
+# Ids dos uploads e dos jobs do MTS enviados na última execução (veja wait_tilesets.py)
+SUBMISSIONS = f"{PROJECT_ROOT}/output/mbtiles/envios.json"
+
+# Onde ficam os arquivos PMTiles, que vão junto com o output estático
+PMTILES_DIR = f"{PROJECT_ROOT}/output/pmtiles"
+
 
 ###############
 ### Helpers ###
 ###############
 
+def is_streamed(source):
+        '''
+        Verifica se um tileset é lido de um arquivo feather e
+        enviado ao tippecanoe pela entrada padrão.
+        '''
+
+        return source[1].endswith(".feather")
+
+
+def is_prebuilt(source):
+        '''
+        Verifica se um tileset já foi gerado como .mbtiles por
+        outra etapa (veja process_subsets e vector_tiles.py).
+        '''
+
+        return source[1].endswith(".mbtiles")
+
+
+def tippecanoe_flags(source):
+        '''
+        Retorna as opções do tippecanoe para um tileset.
+        Elas fazem parte do hash do manifesto, então mudar
+        as opções faz o tileset ser recriado.
+        '''
+
+        if is_prebuilt(source):
+                return ""
+
+        # Arquivos GeoJSON trazem todas as colunas; -y mantém só as propriedades do tileset
+        include = "".join(f" -y {column}" for column in source[2]) if source[2] and not is_streamed(source) else ""
+
+        if source[0] in SMALL_TILESETS:
+                return f"-z10 -b0 -r1 --drop-densest-as-needed{include}"
+
+        elif source[0] in POLYGON_TILESETS:
+                return f"-z10 --drop-densest-as-needed{include}"
+
+        # As feições enviadas pela entrada padrão têm uma por linha e podem ser lidas em paralelo
+        parallel = "-P " if is_streamed(source) else ""
+
+        return f"-z10 {parallel}-b0 --drop-densest-as-needed{include}"
+
+
+def tileset_properties(tileset):
+        '''
+        Retorna a lista de propriedades de um tileset de SOURCES.
+        '''
+
+        return next(source[2] for source in SOURCES if source[0] == tileset)
+
+
+def read_manifest():
+        '''
+        Lê o manifesto da última execução. Ele tem três campos:
+        'arquivos', com o hash de cada arquivo de entrada e os
+        dados do os.stat de quando ele foi calculado, 'tilesets',
+        com a impressão digital de cada tileset enviado, e 'mts',
+        com a impressão digital de cada tileset publicado pelo MTS.
+        O campo 'pmtiles' guarda as impressões digitais dos tilesets
+        convertidos em PMTiles.
+        '''
+
+        if not os.path.isfile(MANIFEST):
+                return {"arquivos": { }, "tilesets": { }, "mts": { }, "pmtiles": { }}
+
+        with open(MANIFEST) as f:
+                manifest = json.load(f)
+
+        manifest.setdefault("mts", { })
+        manifest.setdefault("pmtiles", { })
+
+        return manifest
+
+
+def save_manifest(manifest):
+        '''
+        Salva o manifesto em um arquivo novo, sem alterar
+        o arquivo compartilhado com gerações anteriores do output.
+        '''
+
+        tmp_fname = f"{MANIFEST}.tmp-{os.getpid()}"
+
+        with open(tmp_fname, "w") as f:
+                json.dump(manifest, f, indent=2)
+
+        os.replace(tmp_fname, MANIFEST)
+
+
+def save_submissions(timings):
+        '''
+        Salva os ids dos uploads e dos jobs de publicação do MTS
+        enviados nesta execução, para que wait_tilesets.py possa
+        esperar o Mapbox terminar de processá-los. Tilesets pulados
+        ou convertidos em PMTiles não têm o que esperar e ficam de fora.
+
+        Parâmetros:
+
+        > timings: o dicionário retornado por build_and_upload e publish_to_mts
+        '''
+
+        submissions = { }
+        sent_at = datetime.datetime.now().isoformat(timespec="seconds")
+
+        for tileset, timing in timings.items():
+                if timing.get("upload_id"):
+                        submissions[tileset] = {"api": "uploads", "id": timing["upload_id"], "enviado": sent_at}
+                elif timing.get("job"):
+                        submissions[tileset] = {"api": "mts", "id": timing["job"], "enviado": sent_at}
+
+        tmp_fname = f"{SUBMISSIONS}.tmp-{os.getpid()}"
+
+        with open(tmp_fname, "w") as f:
+                json.dump(submissions, f, indent=2)
+
+        os.replace(tmp_fname, SUBMISSIONS)
+
+
+def file_hash(path, cache):
+        '''
+        Calcula o hash SHA-1 do conteúdo de um arquivo. Arquivos
+        com o mesmo inode, tamanho e data de modificação registrados
+        no cache não são relidos: como as gerações do output são
+        hardlinks, arquivos que não mudaram mantêm o mesmo inode.
+        '''
+
+        stat = os.stat(path)
+        key = [stat.st_ino, stat.st_size, stat.st_mtime_ns]
+
+        if cache.get(path, { }).get("stat") == key:
+                return cache[path]["sha1"]
+
+        digest = hashlib.sha1()
+
+        with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+
+        cache[path] = {"stat": key, "sha1": digest.hexdigest()}
+
+        return cache[path]["sha1"]
+
+
+def fingerprint(source, cache):
+        '''
+        Retorna a impressão digital de um tileset: um hash das opções
+        do tippecanoe (que incluem as propriedades dos arquivos GeoJSON),
+        das propriedades enviadas e do conteúdo de todos os arquivos de entrada.
+
+        Parâmetros:
+
+        > source: uma tupla no formato de SOURCES
+
+        > cache: o campo 'arquivos' do manifesto
+        '''
+
+        digest = hashlib.sha1(tippecanoe_flags(source).encode())
+
+        if is_streamed(source):
+                digest.update(json.dumps(source[2]).encode())
+
+        for path in sorted(glob.glob(source[1])):
+                digest.update(os.path.basename(path).encode())
+                digest.update(file_hash(path, cache).encode())
+
+        return digest.hexdigest()
+
+
+def rename_layer(original, source):
+        '''
+        Copia o .mbtiles de outro tileset criado a partir da mesma
+        entrada, trocando apenas o nome da camada. O tile-join não
+        refaz os tiles, então é muito mais rápido que o tippecanoe.
+
+        Parâmetros:
+
+        > original: a tupla do tileset que já foi criado
+
+        > source: a tupla do tileset que compartilha a entrada
+        '''
+
+        fname = f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles"
+
+        detach(fname)
+        command = f"{TILE_JOIN_PATH} -f -pk -R {original[0]}:{source[0]} -o {fname} {PROJECT_ROOT}/output/mbtiles/tilesets/{original[0]}.mbtiles"
+
+        print(command)
+        result = subprocess.run(command, shell=True, capture_output=True, check=True)
+        print(result.stdout)
+        print(result.stderr)
+
+
+def stream_features(command, source, df=None):
+        '''
+        Roda o tippecanoe sem arquivo de entrada, o que faz com que
+        ele leia as feições da entrada padrão, e envia a ela os focos
+        do arquivo feather, lote por lote. Assim, nenhum GeoJSON
+        intermediário é escrito em disco, e a leitura do feather
+        acontece ao mesmo tempo em que o tippecanoe processa as feições.
+
+        Parâmetros:
+
+        > command: a linha de comando do tippecanoe
+
+        > source: uma tupla no formato de SOURCES, com o caminho do feather
+
+        > df: se informado, os focos desse dataframe, já lidos do feather,
+        são enviados no lugar do arquivo inteiro
+        '''
+
+        # A saída do tippecanoe não é capturada: um pipe cheio de mensagens
+        # de progresso travaria o processo enquanto ainda escrevemos na entrada
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, encoding="utf-8")
+
+        try:
+                with process.stdin:
+                        if df is None:
+                                stream_feather_points(source[1], process.stdin, source[2])
+                        else:
+                                write_points(df, process.stdin, source[2])
+
+        # Se o tippecanoe falhar no meio do caminho, o erro é dado pelo código de saída
+        except BrokenPipeError:
+                pass
+
+        returncode = process.wait()
+
+        if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, command)
+
+
+def read_delta_state(source):
+        '''
+        Lê o estado de um tileset atualizado por diferença: os
+        identificadores dos focos que já estão no .mbtiles, a data
+        da última reconstrução completa e o hash das opções usadas
+        nela. Retorna None se o estado ou o .mbtiles não existirem.
+        '''
+
+        directory = f"{DELTA_DIR}/{source[0]}"
+
+        if not all(os.path.isfile(fname) for fname in (f"{directory}/estado.json", f"{directory}/focos.feather", f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles")):
+                return None
+
+        with open(f"{directory}/estado.json") as f:
+                state = json.load(f)
+
+        state["focos"] = pd.read_feather(f"{directory}/focos.feather").uuid
+
+        return state
+
+
+def save_delta_state(source, uuids, rebuilt, options):
+        '''
+        Salva o estado de um tileset atualizado por diferença em
+        arquivos novos, sem alterar os arquivos compartilhados
+        com gerações anteriores do output.
+
+        Parâmetros:
+
+        > source: uma tupla no formato de SOURCES
+
+        > uuids: os identificadores dos focos que estão no .mbtiles
+
+        > rebuilt: a data da última reconstrução completa, no formato 'AAAA-MM-DD'
+
+        > options: o hash das opções do tippecanoe e das propriedades enviadas
+        '''
+
+        directory = f"{DELTA_DIR}/{source[0]}"
+        os.makedirs(directory, exist_ok=True)
+
+        tmp_fname = f"{directory}/focos.feather.tmp-{os.getpid()}"
+        pd.DataFrame({"uuid": pd.Series(uuids, dtype=object).to_numpy()}).to_feather(tmp_fname)
+        os.replace(tmp_fname, f"{directory}/focos.feather")
+
+        tmp_fname = f"{directory}/estado.json.tmp-{os.getpid()}"
+        with open(tmp_fname, "w") as f:
+                json.dump({"reconstrucao": rebuilt, "opcoes": options}, f, indent=2)
+        os.replace(tmp_fname, f"{directory}/estado.json")
+
+
+def tile_delta(source):
+        '''
+        Atualiza o tileset da temporada a partir apenas dos focos
+        que ainda não estão nele. Os focos novos de cada dia viram
+        um .mbtiles pequeno, e todos eles são juntados ao .mbtiles
+        da temporada com o tile-join, de forma que o custo diário
+        depende dos focos novos, e não do tamanho do banco de dados.
+
+        O tileset é recriado do zero pelo tippecanoe quando não há
+        estado salvo, quando a última reconstrução tem FULL_REBUILD_DAYS
+        dias ou mais, quando as opções mudaram ou quando algum foco
+        saiu do banco de dados (como na virada do ano).
+
+        Parâmetros:
+
+        > source: uma tupla no formato de SOURCES, com o caminho do feather
+        '''
+
+        fname = f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles"
+        directory = f"{DELTA_DIR}/{source[0]}"
+
+        flags = tippecanoe_flags(source)
+        options = hashlib.sha1(f"{flags} {json.dumps(source[2])}".encode()).hexdigest()
+
+        database = pd.read_feather(source[1], columns=["uuid", "data"])
+
+        state = read_delta_state(source)
+        today = datetime.date.today()
+
+        if (state is None
+                or state["opcoes"] != options
+                or (today - datetime.date.fromisoformat(state["reconstrucao"])).days >= FULL_REBUILD_DAYS
+                or not state["focos"].isin(database.uuid).all()):
+
+                print(f"> {source[0]}: full rebuild")
+
+                detach(fname)
+                command = f"{TIPPECANOE_PATH} --force -o {fname} -l {source[0]} {flags}"
+
+                print(command)
+                stream_features(command, source)
+
+                save_delta_state(source, database.uuid, today.isoformat(), options)
+                return
+
+        new_uuids = database.uuid[~database.uuid.isin(state["focos"])]
+
+        print(f"> {source[0]}: tiling {new_uuids.shape[0]} new points")
+
+        if new_uuids.shape[0] == 0:
+                return
+
+        # Os focos novos são lidos uma única vez e separados por dia em memória,
+        # em vez de uma leitura do feather da temporada para cada dia
+        columns = list(dict.fromkeys(list(source[2]) + ["longitude", "latitude", "uuid", "data"]))
+        new = pd.read_feather(source[1], columns=columns)
+        new = new[new.uuid.isin(new_uuids)]
+
+        os.makedirs(f"{directory}/dias", exist_ok=True)
+
+        day_fnames = [ ]
+
+        for day, rows in new.groupby("data"):
+
+                day_fname = f"{directory}/dias/{day}.mbtiles"
+                command = f"{TIPPECANOE_PATH} --force -o {day_fname} -l {source[0]} {flags}"
+
+                print(command)
+                stream_features(command, source, df=rows)
+
+                day_fnames.append(day_fname)
+
+        # O tile-join escreve em um arquivo novo, que substitui o da geração anterior
+        # (-pk: os tiles podem passar do limite de tamanho até a próxima reconstrução)
+        tmp_fname = f"{directory}/{source[0]}.tmp-{os.getpid()}.mbtiles"
+        command = f"{TILE_JOIN_PATH} -f -pk -o {tmp_fname} {fname} {' '.join(day_fnames)}"
+
+        print(command)
+        result = subprocess.run(command, shell=True, capture_output=True, check=True)
+        print(result.stdout)
+        print(result.stderr)
+
+        os.replace(tmp_fname, fname)
+
+        for day_fname in day_fnames:
+                os.remove(day_fname)
+
+        save_delta_state(source, pd.concat([state["focos"], new.uuid]), state["reconstrucao"], options)
+
 
 def tippecanoe(source):
         '''
@@ -72,22 +537,24 @@ def tippecanoe(source):
         Parâmetros:     
 
 
-        > source: uma tupla no formato (nome-camada, caminho). Exemplo: ("amzsufocada-24h", "../output/jsons/tilesets/24h.json")
+        > source: uma tupla no formato de SOURCES. Exemplo: ("amzsufocada-biomas", "../output/jsons/land_info/geometrias/biomas.json", None)
         '''
 
         # O grid de 20km não sera passado ao tippecanoe. Usaremos o JSON puro.
         # if source[0] == "amzsufocada-grid-20km":
         #     return
 
+        flags = tippecanoe_flags(source)
+
+        # O .mbtiles já está no lugar
+        if is_prebuilt(source):
+                return
+
         # Se o output já existir, passa --force. Se não, não
-        if source[0] in ["amzsufocada-24h-tis", "amzsufocada-24h-ucs", 
-                         "amzsufocada-24h-ti-most-fire", "amzsufocada-24h-ucs-most-fire",
-                         "amzsufocada-grid-20km",
-                         "amzsufocada-7d-grid-1", "amzsufocada-7d-grid-2", "amzsufocada-7d-grid-3",
-                        ]:
+        elif source[0] in SMALL_TILESETS:
                 # Due to a weird bug, combining the --force and -r1 flags creates mbtiles files with zombie points. We will manually rename/remove the files
                 # to avoid this.
-                command = f"{TIPPECANOE_PATH} -z10 -o {PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}_new.mbtiles -l {source[0]} {source[1]} -b0 -r1  --drop-densest-as-needed"
+                command = f"{TIPPECANOE_PATH} -o {PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}_new.mbtiles -l {source[0]} {source[1]} {flags}"
 
                 print(command)
                 result = subprocess.run(command, shell=True, capture_output=True, check=True)
@@ -101,9 +568,9 @@ def tippecanoe(source):
                 # Rename the new one
                 os.rename(f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}_new.mbtiles", f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles")
 
-        elif source[0] in ["amzsufocada-terras-indigenas", "amzsufocada-unidades-conserv", "amzsufocada-biomas", "amzsufocada-cidades", "amzusufocada-cidades"]:
-                # Tippecanoe needs a buffer to avoid lines in the tile boundaries of polygons
-                command = f"{TIPPECANOE_PATH} -z10 --force -o {PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles -l {source[0]} {source[1]}  --drop-densest-as-needed"
+        elif source[0] in POLYGON_TILESETS:
+                detach(f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles")
+                command = f"{TIPPECANOE_PATH} --force -o {PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles -l {source[0]} {source[1]} {flags}"
 
                 print(command)
                 result = subprocess.run(command, shell=True, capture_output=True, check=True)
@@ -111,8 +578,19 @@ def tippecanoe(source):
                 print(result.stderr)
 
 
+        elif source[0] in DELTA_TILESETS:
+                tile_delta(source)
+
+        elif is_streamed(source):
+                detach(f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles")
+                command = f"{TIPPECANOE_PATH} --force -o {PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles -l {source[0]} {flags}"
+
+                print(command)
+                stream_features(command, source)
+
         else:
-                command = f"{TIPPECANOE_PATH} -z10 --force -o {PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles -l {source[0]} {source[1]} -b0 --drop-densest-as-needed"
+                detach(f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles")
+                command = f"{TIPPECANOE_PATH} --force -o {PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles -l {source[0]} {source[1]} {flags}"
 
 
                 print(command)
@@ -132,6 +610,8 @@ def upload(source):
         > source: o caminho do arquivo que deve ser enviado
 
         > tileset: o tileset que deve ser criado ou atualizado
+
+        Retorna o id do upload, que o Mapbox ainda vai processar.
         '''
 
         # O grid de 20km é em formato JSON. Os demais, mbtiles
@@ -146,22 +626,345 @@ def upload(source):
         print(result.stdout)
         print(result.stderr)
 
+        # O CLI imprime a resposta da API de uploads, em JSON
+        return json.loads(result.stdout)["id"]
+
+
+def pmtiles_path(source):
+        '''
+        Retorna o caminho do arquivo PMTiles de um tileset.
+        '''
+
+        return f"{PMTILES_DIR}/{source[0]}.pmtiles"
+
+
+def export_pmtiles(source):
+        '''
+        Converte o .mbtiles recém criado de um tileset em
+        um arquivo PMTiles, que pode ser servido por qualquer
+        servidor de arquivos estáticos com suporte a requisições
+        com cabeçalho Range.
+
+        Parâmetros:
+
+        > source: tupla no formato de SOURCES
+        '''
+
+        counts = pmtiles_export.convert(f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles", pmtiles_path(source))
+
+        print(f"> {source[0]}: {counts['tiles']} tiles, {counts['entradas']} directory entries, {counts['conteudos']} distinct tiles")
+
+
+def publish_mts(source):
+        '''
+        Publica um tileset de focos pelo Mapbox Tiling Service. A
+        receita é gerada a partir das propriedades do tileset e salva em
+        RECIPES_DIR. Nos tilesets de DELTA_TILESETS, apenas os focos
+        que ainda não estão na fonte do MTS são enviados, em GeoJSONSeq,
+        e acrescentados a ela; nos demais, quando algum foco saiu do
+        banco de dados e quando a fonte chega a mts.MAX_SOURCE_FILES
+        arquivos, a fonte é substituída. Retorna o id do job de
+        publicação, ou None se não havia nada a enviar.
+
+        Parâmetros:
+
+        > source: uma tupla no formato de SOURCES, com o caminho do feather
+        '''
+
+        tileset = f"{USERNAME}.{source[0]}"
+
+        recipe = mts.make_recipe(USERNAME, source[0], source[2])
+        mts.save_recipe(recipe, f"{RECIPES_DIR}/{source[0]}.json")
+
+        # Focos que já estão na fonte do MTS
+        directory = f"{DELTA_DIR}/{source[0]}"
+        state_fname = f"{directory}/fonte_mts.feather"
+
+        database = pd.read_feather(source[1], columns=["uuid"])
+        state = pd.read_feather(state_fname) if os.path.isfile(state_fname) else None
+        published = state.uuid if state is not None else None
+
+        # Cada envio com append é um arquivo a mais na fonte, que tem um limite de
+        # arquivos. O estado guarda em que arquivo cada foco foi enviado; estados
+        # sem essa coluna contam como fontes cheias.
+        files = int(state.arquivo.max()) + 1 if state is not None and "arquivo" in state.columns and state.shape[0] else mts.MAX_SOURCE_FILES
+
+        incremental = source[0] in DELTA_TILESETS and published is not None and published.isin(database.uuid).all()
+
+        if incremental:
+                new = database.uuid[~database.uuid.isin(published)]
+                if new.shape[0] == 0:
+                        print(f"> {source[0]}: no new points for the MTS source")
+                        return None
+
+        append = incremental and files < mts.MAX_SOURCE_FILES
+
+        if append:
+                print(f"> {source[0]}: appending {new.shape[0]} new points to the MTS source")
+        elif incremental:
+                print(f"> {source[0]}: the MTS source has {files} files, replacing it")
+        else:
+                print(f"> {source[0]}: replacing the MTS source")
+
+        os.makedirs(directory, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".geojsons", dir=directory) as f:
+                stream_feather_points(source[1], f, source[2], uuids=set(new) if append else None)
+                f.flush()
+                mts.upload_source(USERNAME, source[0], f.name, TOKEN, append=append)
+
+        if append:
+                state = pd.concat([state, pd.DataFrame({"uuid": new.to_numpy(), "arquivo": files})], ignore_index=True)
+        else:
+                state = pd.DataFrame({"uuid": database.uuid.to_numpy(), "arquivo": 0})
+
+        tmp_fname = f"{state_fname}.tmp-{os.getpid()}"
+        state.to_feather(tmp_fname)
+        os.replace(tmp_fname, state_fname)
+
+        # Cada tileset é publicado assim que a sua fonte fica pronta
+        mts.update_tileset(tileset, recipe, TOKEN)
+        job_id = mts.publish(tileset, TOKEN)
+
+        print(f"> {source[0]}: publish job {job_id}")
+
+        return job_id
+
+
+def timed(function, source):
+        '''
+        Executa function(source) e retorna uma tupla com
+        quanto tempo, em segundos, ela levou e o seu resultado.
+        '''
+
+        start = time.perf_counter()
+        result = function(source)
+
+        return time.perf_counter() - start, result
+
+
+def build_and_upload(sources, tippecanoe_workers=TIPPECANOE_WORKERS, upload_workers=UPLOAD_WORKERS, publish=upload, manifest_key="tilesets", output=None):
+        '''
+        Cria e envia os tilesets em paralelo. Os tippecanoes rodam
+        em um grupo de workers do tamanho do número de núcleos e,
+        assim que cada .mbtiles fica pronto, ele entra na fila de
+        uploads, que tem o seu próprio limite de concorrência. Assim,
+        o processamento e o envio acontecem ao mesmo tempo, e o tempo
+        total fica próximo ao do tileset mais lento.
+
+        Tilesets cuja entrada e opções não mudaram desde o último envio
+        (veja o manifesto) não são recriados nem enviados. Tilesets que
+        compartilham o mesmo arquivo de entrada passam pelo tippecanoe
+        uma única vez.
+
+        Retorna um dicionário no formato {tileset: {"tippecanoe": segundos, "upload": segundos, "upload_id": id}}.
+
+        Parâmetros:
+
+        > sources: lista de tuplas no formato de SOURCES
+
+        > tippecanoe_workers: quantos tippecanoes podem rodar ao mesmo tempo
+
+        > upload_workers: quantos uploads podem rodar ao mesmo tempo
+
+        > publish: a função que recebe cada .mbtiles pronto. Por padrão,
+        upload, que o envia ao Mapbox; export_pmtiles o converte em PMTiles.
+
+        > manifest_key: o campo do manifesto em que os tilesets publicados
+        são registrados
+
+        > output: função que recebe um tileset e retorna o caminho do arquivo
+        criado por publish, como pmtiles_path. Um tileset só é pulado se esse
+        arquivo existir. Por padrão, apenas o .mbtiles precisa existir.
+        '''
+
+        manifest = read_manifest()
+
+        fingerprints = {source[0]: fingerprint(source, manifest["arquivos"]) for source in sources}
+
+        # Esquece os arquivos que não existem mais
+        manifest["arquivos"] = {path: entry for path, entry in manifest["arquivos"].items() if os.path.isfile(path)}
+
+        def unchanged(source):
+
+                paths = [f"{PROJECT_ROOT}/output/mbtiles/tilesets/{source[0]}.mbtiles"]
+
+                if output is not None:
+                        paths.append(output(source))
+
+                return manifest[manifest_key].get(source[0]) == fingerprints[source[0]] and all(os.path.isfile(path) for path in paths)
+
+        # O primeiro tileset de cada arquivo de entrada é criado pelo tippecanoe; os demais, copiados dele
+        originals, copies = { }, { }
+        for source in sources:
+                if source[1] in originals:
+                        copies.setdefault(originals[source[1]][0], [ ]).append(source)
+                else:
+                        originals[source[1]] = source
+
+        timings = {source[0]: { } for source in sources}
+
+        with ThreadPoolExecutor(max_workers=tippecanoe_workers) as tiling, ThreadPoolExecutor(max_workers=upload_workers) as uploading:
+
+                tiling_jobs, upload_jobs = { }, { }
+
+                def schedule(function, source):
+                        '''
+                        Agenda a criação de um tileset, ou o pula se nada mudou.
+                        '''
+
+                        if unchanged(source):
+                                print(f"> {source[0]}: unchanged, skipping")
+                                timings[source[0]]["pulado"] = True
+                                return None
+
+                        job = tiling.submit(timed, function, source)
+                        tiling_jobs[job] = source
+
+                        return job
+
+                for source in originals.values():
+                        schedule(tippecanoe, source)
+
+                # Cópias de tilesets que não mudaram podem ser feitas desde já
+                for original in originals.values():
+                        if timings[original[0]].get("pulado"):
+                                for copy in copies.get(original[0], [ ]):
+                                        schedule(partial(rename_layer, original), copy)
+
+                try:
+
+                        pending = set(tiling_jobs)
+
+                        # Cada tileset pronto é enviado enquanto os outros ainda estão sendo criados
+                        while pending:
+
+                                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                                for job in done:
+
+                                        source = tiling_jobs[job]
+                                        timings[source[0]]["tippecanoe"], _ = job.result()
+
+                                        print(f"> {source[0]}: tippecanoe took {timings[source[0]]['tippecanoe']:.1f}s")
+
+                                        upload_jobs[uploading.submit(timed, publish, source)] = source
+
+                                        # Tilesets que compartilham a entrada com este já podem ser copiados
+                                        for copy in copies.get(source[0], [ ]):
+                                                copy_job = schedule(partial(rename_layer, source), copy)
+                                                if copy_job:
+                                                        pending.add(copy_job)
+
+                        for job in as_completed(upload_jobs):
+
+                                source = upload_jobs[job]
+                                timings[source[0]]["upload"], timings[source[0]]["upload_id"] = job.result()
+
+                                print(f"> {source[0]}: upload took {timings[source[0]]['upload']:.1f}s")
+
+                                # Só registra o tileset depois que o envio deu certo. Se o Mapbox
+                                # não conseguir processá-lo, wait_tilesets.py o remove do manifesto
+                                manifest[manifest_key][source[0]] = fingerprints[source[0]]
+
+                finally:
+                        save_manifest(manifest)
+
+        return timings
+
+
+def publish_to_mts(sources, workers=UPLOAD_WORKERS):
+        '''
+        Publica os tilesets de focos pelo MTS, em paralelo. Tilesets
+        cujo feather e propriedades não mudaram são pulados. Retorna
+        um dicionário no formato {tileset: {"upload": segundos, "job": id do job}}.
+
+        Parâmetros:
+
+        > sources: lista de tuplas no formato de SOURCES, com caminhos de feathers
+
+        > workers: quantas fontes podem ser enviadas ao mesmo tempo
+        '''
+
+        manifest = read_manifest()
+
+        fingerprints = {source[0]: fingerprint(source, manifest["arquivos"]) for source in sources}
+
+        timings = {source[0]: { } for source in sources}
+
+        with ThreadPoolExecutor(max_workers=workers) as publishing:
+
+                jobs = { }
+
+                for source in sources:
+
+                        if manifest["mts"].get(source[0]) == fingerprints[source[0]]:
+                                print(f"> {source[0]}: unchanged, skipping")
+                                timings[source[0]]["pulado"] = True
+                                continue
+
+                        jobs[publishing.submit(timed, publish_mts, source)] = source
+
+                try:
+
+                        for job in as_completed(jobs):
+
+                                source = jobs[job]
+                                timings[source[0]]["upload"], timings[source[0]]["job"] = job.result()
+
+                                manifest["mts"][source[0]] = fingerprints[source[0]]
+
+                finally:
+                        save_manifest(manifest)
+
+        return timings
 
 
 ################
 ### Execução ###
 ################
 
-def main():
+def main(argv):
 
         directory = f"{PROJECT_ROOT}/output/mbtiles/tilesets"
         if not os.path.exists(directory):
                 os.makedirs(directory)
 
-        for source in SOURCES:
-                tippecanoe(source)
-                upload(source)
+        start = time.perf_counter()
+
+
+        # No modo 'mts', os tilesets de focos são publicados pelo Mapbox Tiling Service
+        # e os demais continuam sendo criados localmente e enviados como .mbtiles
+        if len(argv) > 1 and argv[1] == "mts":
+
+                os.makedirs(RECIPES_DIR, exist_ok=True)
+
+                timings = publish_to_mts([source for source in SOURCES if is_streamed(source)])
+                timings.update(build_and_upload([source for source in SOURCES if not is_streamed(source)]))
+
+        # No modo 'pmtiles', nada é enviado ao Mapbox
+        elif len(argv) > 1 and argv[1] == "pmtiles":
+
+                os.makedirs(PMTILES_DIR, exist_ok=True)
+
+                timings = build_and_upload(SOURCES, publish=export_pmtiles, manifest_key="pmtiles", output=pmtiles_path)
+
+        else:
+                timings = build_and_upload(SOURCES)
+
+        print("> Timings (seconds)")
+        for tileset, timing in timings.items():
+                if timing.get("pulado"):
+                        print(f"{tileset:>32}  unchanged")
+                elif "job" in timing:
+                        print(f"{tileset:>32}  mts upload {timing['upload']:7.1f}  job {timing['job']}")
+                else:
+                        print(f"{tileset:>32}  tippecanoe {timing.get('tippecanoe', 0):7.1f}  upload {timing.get('upload', 0):7.1f}")
+
+        save_submissions(timings)
+
+        print(f"> All tilesets done in {time.perf_counter() - start:.1f}s")
 
 
 if __name__ == "__main__":
-        main()
+        main(sys.argv)
@@ -5,6 +5,7 @@ e salva arquivos JSON com os fios que serão publicados por tweet.py
 '''
 
 from datetime import datetime, timedelta
+from generations import detach
 import json
 import os
 
@@ -472,11 +473,13 @@ def main():
     data_24h = read_variables("24h")
 
     # Terras indígenas, 24h
+    detach(f"{PROJECT_ROOT}/output/jsons/tweets/tis_24h.json")
     with open(f"{PROJECT_ROOT}/output/jsons/tweets/tis_24h.json", "w+") as f:
         content = build_thread_most_fire_indigenous_land(data_24h)
         json.dump(content, f, indent=2)
 
     # Unidades de conservação, 24h
+    detach(f"{PROJECT_ROOT}/output/jsons/tweets/ucs_24h.json")
     with open(f"{PROJECT_ROOT}/output/jsons/tweets/ucs_24h.json", "w+") as f:
         content = build_thread_most_fire_conservation_units(data_24h)
         json.dump(content, f, indent=2)
@@ -484,6 +487,7 @@ def main():
 
     # Lê os dados das variáveis de 7 dias
     data_7d = read_variables("7d")
+    detach(f"{PROJECT_ROOT}/output/jsons/tweets/grid_7d.json")
     with open(f"{PROJECT_ROOT}/output/jsons/tweets/grid_7d.json", "w+") as f:
         content = build_thread_7d_grid(data_7d)
         json.dump(content, f, indent=2)
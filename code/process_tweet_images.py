@@ -1,4 +1,5 @@
 from datetime import datetime
+from generations import detach
 import pandas as pd
 import geopandas as gpd
 import json
@@ -114,6 +115,7 @@ def save_request_info(url, style_id):
         "datetime": datetime.now().strftime("%m/%d/%Y,%H:%M:%S")
     }
 
+    detach(f"{directory}/last-request-{style_id}.json")
     with open(f"{directory}/last-request-{style_id}.json", "w+") as f:
         json.dump(data, f)
 
@@ -181,6 +183,7 @@ def make_maps(time, land_type):
     fires.plot(color=firecolor, markersize=1, alpha=.5, ax=ax)
     ax.axis('off')
 
+    detach(f"../output/imgs/tweets/{land_type}_{time}_todos_os_focos.png")
     fig.savefig(f"../output/imgs/tweets/{land_type}_{time}_todos_os_focos.png", 
                 facecolor=fig.get_facecolor(), 
                 transparent=True, 
@@ -205,6 +208,7 @@ def make_maps(time, land_type):
     fires.plot(color=firecolor, markersize=1, alpha=.5, ax=ax)
     ax.axis('off')
 
+    detach(f"{PROJECT_ROOT}/output/imgs/tweets/{land_type}_{time}_local_mais_focos.png")
     fig.savefig(f"{PROJECT_ROOT}/output/imgs/tweets/{land_type}_{time}_local_mais_focos.png", 
             facecolor=fig.get_facecolor(), 
             transparent=True, 
@@ -256,6 +260,7 @@ def get_static_images_24h(path, time, land_type):
     if r.status_code == 200:
         print(url)
         fpath = path + f"/{land_type}_{time}_todos_os_focos.jpg"
+        detach(fpath)
         with open(fpath, 'wb+') as f:
             r.raw.decode_content = True
             shutil.copyfileobj(r.raw, f)
@@ -333,6 +338,7 @@ def get_static_images_24h(path, time, land_type):
     r = requests.get(url, stream=True,  headers={'Cache-Control': "no-cache"})
     if r.status_code == 200: # Se a resposta for bem sucedida
         fpath = path + f"/{land_type}_{time}_local_mais_focos.jpg"
+        detach(fpath)
         with open(fpath, 'wb+') as f:
             r.raw.decode_content = True
             shutil.copyfileobj(r.raw, f)
@@ -374,6 +380,7 @@ def get_static_images_7d(path):
     if r.status_code == 200:
         print(url)
         fpath = path + f"/grid_7d_todas_as_areas.jpg"
+        detach(fpath)
         with open(fpath, 'wb+') as f:
             r.raw.decode_content = True
             shutil.copyfileobj(r.raw, f)
@@ -426,6 +433,7 @@ def get_static_images_7d(path):
         r = requests.get(url, stream=True,  headers={'Cache-Control': "no-cache"})
         if r.status_code == 200: # Se a resposta for bem sucedida
             fpath = path + f"/grid_7d_mais_fogo_{i}.jpg"
+            detach(fpath)
             with open(fpath, 'wb+') as f:
                 r.raw.decode_content = True
                 shutil.copyfileobj(r.raw, f)
@@ -4,6 +4,7 @@ os tweets que serão publicados no robô monitor do InfoAmazônia.
 Elas são salvas em formato JSON para que sejam lidas posteriormente
 pelo script que faz a publicação no Twitter.
 '''
+from generations import detach
 import pandas as pd
 import geopandas as gpd
 import os
@@ -29,13 +30,12 @@ PROJECT_ROOT = dirname(abspath(dirname(__file__)))
 ######################
 
 DF_24H = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/tilesets/24h.feather")
-DF_7D = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/tilesets/7d.feather")
-DF_FULL = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/tilesets/bd_completo.feather")
 
 CONSERVATION_UNITS_FIRE_DATA = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/land_info/unidades_de_conservacao.feather")
 INDIGENOUS_LAND_FIRE_DATA = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/land_info/terras_indigenas.feather")
 BIOMES_FIRE_DATA = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/land_info/biomas.feather")
 GRID_FIRE_DATA = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/land_info/grid_20km.feather")
+GRID_REGIONS_FIRE_DATA = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/land_info/regioes_grid.feather")
 
 CITIES = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/cidades_amazonia_legal.feather")
 CONSERVATION_UNITS =  gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/unidades_de_conservacao.feather")
@@ -44,10 +44,29 @@ LEGAL_AMAZON = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/limites
 BIOMES = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/biomas_amazonia_legal.feather")
 GRID = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/sources/grid_20km.feather")
 
+PIXEL_PERSISTENCE = pd.read_feather(f"{PROJECT_ROOT}/output/feathers/persistencia/pixels.feather")
+
 ###############
 ### Helpers ###
 ###############
 
+def read_stats(artifact):
+    '''
+    Lê o arquivo de estatísticas salvo por process_data.py
+    junto com cada conjunto de dados. Serve para obter totais
+    sem precisar carregar os dados inteiros.
+
+    Parâmetros:
+
+    artifact -> O nome do conjunto de dados. Exemplo: 'tilesets/bd_completo'
+    '''
+
+    with open(f"{PROJECT_ROOT}/output/jsons/stats/{artifact}.json") as f:
+        stats = json.load(f)
+
+    return stats
+
+
 def look_up(df, lookup_column, lookup_value, result_column):
     '''
     Retorna um nome de campo com base em um código identificador.
@@ -215,6 +234,49 @@ def burning_for_the_longest(df, code, position=1):
     }
 
 
+def spot_burning_for_the_longest(code, position=1):
+    '''
+    Encontra o ponto específico (pixel de 375m do VIIRS) dentro do
+    tipo de território que está queimando há mais dias seguidos, a
+    partir do índice de persistência salvo por process_data.py.
+    Diferente de burning_for_the_longest, conta apenas os dias com
+    fogo no mesmo lugar.
+
+    Parâmetros:
+
+    code -> O código do tipo de terra. Pode ser 'cod_uc' ou 'cod_ti'.
+
+    position -> Com esse parâmetro, é possível selecionar outros pontos que não o primeiro colocado.
+    '''
+
+    if code == 'cod_ti':
+        source = INDIGENOUS_LAND_FIRE_DATA
+        result_column = "nome_ti"
+
+    elif code == 'cod_uc':
+        source = CONSERVATION_UNITS_FIRE_DATA
+        result_column = "nome_uc_curto"
+
+    # Apenas pontos com fogo no último dia dos dados
+    last_day = PIXEL_PERSISTENCE.ultimo_dia.max()
+    spots = PIXEL_PERSISTENCE[(PIXEL_PERSISTENCE.ultimo_dia == last_day) & (~PIXEL_PERSISTENCE[code].isna())]
+
+    if spots.shape[0] < position:
+        return None
+
+    result = spots.sort_values(by="dias_consecutivos", ascending=False).reset_index().loc[position-1]
+    id_ = str(result[code])
+
+    return {
+        "id": id_,
+        "nome": look_up(source, code, id_, result_column),
+        "dias_consecutivos": int(result["dias_consecutivos"]),
+        "desde": str(pd.to_datetime(result["inicio_sequencia"], unit="D").date()),
+        "latitude": round(float(result["latitude"]), 4),
+        "longitude": round(float(result["longitude"]), 4),
+    }
+
+
 def total_fires(df, code):
     '''
     Encontra o total de focos de calor
@@ -247,11 +309,14 @@ def find_values_24h():
     # 1. Thread de terras indígenas nas últimas 24h
     terras_indigenas = {}
 
+    # Totais que podem ser lidos do arquivo de estatísticas
+    stats_24h = read_stats("tilesets/24h")
+
     # Total de focos de fogo nas últimas 24h
-    terras_indigenas["total_focos_24h"] = total_fires(DF_24H, "cod_ti")
+    terras_indigenas["total_focos_24h"] = stats_24h["focos_por_camada"]["cod_ti"]
     
     # Total de terras indígenas com fogo nas últimas 24h
-    terras_indigenas["areas_com_fogo_24h"] = find_places_with_fire(DF_24H, "cod_ti")
+    terras_indigenas["areas_com_fogo_24h"] = stats_24h["territorios_distintos"]["cod_ti"]
 
     # Terras indígena com mais focos de fogo nas últimas 24h e detalhes sobre elas
     terras_indigenas["areas_mais_fogo_24h"] = { }
@@ -262,6 +327,11 @@ def find_values_24h():
     terras_indigenas["areas_fogo_mais_dias"] = { }
     for i in range(1,4):
         terras_indigenas["areas_fogo_mais_dias"][f"{i}"] = burning_for_the_longest(INDIGENOUS_LAND_FIRE_DATA, 'cod_ti', i)
+
+    # Pontos específicos dentro de terras indígenas que queimam há mais dias seguidos
+    terras_indigenas["pontos_fogo_mais_dias"] = { }
+    for i in range(1,4):
+        terras_indigenas["pontos_fogo_mais_dias"][f"{i}"] = spot_burning_for_the_longest('cod_ti', i)
         
 
     # 2. Thread de unidades de conservação nas últimas 24h
@@ -269,10 +339,10 @@ def find_values_24h():
     unidades_de_conservacao = {}
 
     # Total de focos de fogo nas últimas 24h
-    unidades_de_conservacao["total_focos_24h"] = total_fires(DF_24H, "cod_uc")
+    unidades_de_conservacao["total_focos_24h"] = stats_24h["focos_por_camada"]["cod_uc"]
 
     # Total de unidades de conservação com fogo nas últimas 24h
-    unidades_de_conservacao["areas_com_fogo_24h"] = find_places_with_fire(DF_24H, "cod_uc")
+    unidades_de_conservacao["areas_com_fogo_24h"] = stats_24h["territorios_distintos"]["cod_uc"]
 
     # Unidade de conservação com mais focos de fogo nas últimas 24h e detalhes sobre ela
     unidades_de_conservacao["areas_mais_fogo_24h"] = { }
@@ -283,11 +353,16 @@ def find_values_24h():
     unidades_de_conservacao["areas_fogo_mais_dias"] = { }
     for i in range(1,4):
         unidades_de_conservacao["areas_fogo_mais_dias"][f"{i}"] = burning_for_the_longest(CONSERVATION_UNITS_FIRE_DATA, 'cod_uc', i)
+
+    # Pontos específicos dentro de unidades de conservação que queimam há mais dias seguidos
+    unidades_de_conservacao["pontos_fogo_mais_dias"] = { }
+    for i in range(1,4):
+        unidades_de_conservacao["pontos_fogo_mais_dias"][f"{i}"] = spot_burning_for_the_longest('cod_uc', i)
     
 
 
     return {
-        "total_focos_amazonia_legal_2021": DF_FULL.shape[0],
+        "total_focos_amazonia_legal_2021": read_stats("tilesets/bd_completo")["linhas"],
     	"terras_indigenas": terras_indigenas,
     	"unidades_de_conservacao": unidades_de_conservacao
     }
@@ -394,6 +469,44 @@ def find_values_7d():
 
 
 
+    def find_region_with_most_fire(total_fires, position=1):
+        '''
+        Encontra a região de células quentes vizinhas do grid
+        com mais fogo nos últimos 7 dias e informações sobre ela,
+        inclusive a variação em relação à semana anterior.
+
+        Parâmetros:
+
+        total_fires -> O número total de focos na semana, usado para calcular o percentual.
+
+        position -> Com esse parâmetro, é possível selecionar outras regiões que não a primeira colocada.
+        '''
+
+        if GRID_REGIONS_FIRE_DATA.shape[0] < position:
+            return None
+
+        region = GRID_REGIONS_FIRE_DATA.sort_values(by="focos_7d", ascending=False).reset_index().loc[position-1]
+
+        # Listas de lugares, limitadas para que o tuíte seja sucinto
+        def first_names(value, n=3):
+            return value.split(", ")[:n] if isinstance(value, str) and value else [ ]
+
+        return {
+            "id": int(region["regiao"]),
+            "n_celulas": int(region["celulas"]),
+            "n_focos": int(region["focos_7d"]),
+            "porcentagem": round(region["focos_7d"] / total_fires * 100),
+            "variacao_semana_anterior": int(region["variacao"]),
+            "cidades": first_names(region["cidade"]),
+            "estados": first_names(region["estado"], n=None),
+            "nomes_ti": first_names(region["nome_ti"]),
+            "nomes_uc": first_names(region["nome_uc"]),
+        }
+
+
+    # Totais que podem ser lidos do arquivo de estatísticas
+    stats_7d = read_stats("tilesets/7d")
+
     # Áreas do grid com mais fogo
     grid = {}
 
@@ -403,13 +516,18 @@ def find_values_7d():
     # Grids com mais focos de foco nos últimos 7d e detalhes sobre eles
     grid["areas_mais_fogo_7d"] = { }
     for i in range(1, 4):
-        grid["areas_mais_fogo_7d"][f"{i}"] = find_grid_with_most_fire("7d", DF_7D.shape[0], i)
+        grid["areas_mais_fogo_7d"][f"{i}"] = find_grid_with_most_fire("7d", stats_7d["linhas"], i)
+
+    # Regiões de células quentes vizinhas com mais focos nos últimos 7d
+    grid["regioes_mais_fogo_7d"] = { }
+    for i in range(1, 4):
+        grid["regioes_mais_fogo_7d"][f"{i}"] = find_region_with_most_fire(stats_7d["linhas"], i)
 
     return {
-        "total_focos_amazonia_legal_2021": DF_FULL.shape[0],
-        "total_focos_7d": DF_7D.shape[0],
-        "total_focos_7d_uc": DF_7D[~DF_7D.cod_uc.isna()].shape[0],
-        "total_focos_7d_ti": DF_7D[~DF_7D.cod_ti.isna()].shape[0],
+        "total_focos_amazonia_legal_2021": read_stats("tilesets/bd_completo")["linhas"],
+        "total_focos_7d": stats_7d["linhas"],
+        "total_focos_7d_uc": stats_7d["focos_por_camada"]["cod_uc"],
+        "total_focos_7d_ti": stats_7d["focos_por_camada"]["cod_ti"],
         "grid": grid,
     }
 
@@ -420,10 +538,12 @@ def find_values_7d():
 def main():
 
     data = find_values_24h()
+    detach(f"{PROJECT_ROOT}/output/jsons/alerts/24h.json")
     with open(f"{PROJECT_ROOT}/output/jsons/alerts/24h.json", "w+") as f:
         json.dump(data, f, indent=4)
 
     data = find_values_7d()
+    detach(f"{PROJECT_ROOT}/output/jsons/alerts/7d.json")
     with open(f"{PROJECT_ROOT}/output/jsons/alerts/7d.json", "w+") as f:
         json.dump(data, f, indent=4)
 
@@ -0,0 +1,192 @@
+'''
+Calcula há quantos dias consecutivos cada território
+está queimando, de forma vetorizada.
+
+A entrada são os pares distintos (território, dia) com fogo,
+como os do cubo de focos salvo por process_data.py. Os pares
+são ordenados uma única vez e as sequências de dias seguidos
+são encontradas com numpy (diff e cumsum), para todos os tipos
+de território de uma só vez e para qualquer data de referência.
+
+Para comparar com a implementação anterior, que andava para
+trás um dia de cada vez em cada território:
+
+python streaks.py benchmark
+'''
+
+import datetime
+import numpy as np
+import pandas as pd
+import sys
+import time
+
+
+##########################
+### Funções principais ###
+##########################
+
+def consecutive_days(cubes, reference_date=None):
+    '''
+    Retorna, para cada tipo de território, um dataframe com
+    a quantidade de dias consecutivos com fogo de cada território,
+    contados de trás para frente a partir da data de referência.
+    Territórios sem fogo na data de referência têm 0 dias.
+
+    Parâmetros:
+
+    > cubes: dicionário no formato {tipo de território: dataframe}, em que
+    cada dataframe tem a coluna do código do território e a coluna 'dia'.
+    Exemplo: {"cod_ti": cubo_de_terras_indigenas}
+
+    > reference_date: a data a partir da qual os dias são contados.
+    Se for None, usa a data de hoje.
+    '''
+
+    if reference_date is None:
+        reference_date = pd.to_datetime("today")
+
+    reference_day = pd.to_datetime(reference_date).normalize()
+
+    layers = list(cubes)
+
+    # Junta todos os tipos de território em um único par de arrays inteiros:
+    # a chave do território (tipo + código) e o dia
+    keys, days, codes_by_layer, offsets = [ ], [ ], { }, { }
+    offset = 0
+
+    for layer in layers:
+
+        cube = cubes[layer]
+
+        codes, uniques = pd.factorize(cube[layer])
+
+        # Códigos nulos (-1) são descartados antes de somar o deslocamento,
+        # senão apontariam para o último território do tipo anterior
+        valid = codes >= 0
+
+        keys.append(codes[valid].astype(np.int64) + offset)
+        days.append(pd.to_datetime(cube["dia"]).dt.normalize().to_numpy()[valid].astype("datetime64[D]").astype(np.int64))
+
+        codes_by_layer[layer] = uniques
+        offsets[layer] = offset
+
+        offset += len(uniques)
+
+    keys = np.concatenate(keys) if keys else np.array([], dtype=np.int64)
+    days = np.concatenate(days) if days else np.array([], dtype=np.int64)
+
+    reference = np.datetime64(reference_day.date(), "D").astype(np.int64)
+
+    # Apenas os dias até a data de referência importam
+    mask = days <= reference
+    keys, days = keys[mask], days[mask]
+
+    # Ordena por território e dia e remove pares repetidos
+    order = np.lexsort((days, keys))
+    keys, days = keys[order], days[order]
+
+    distinct = np.ones(keys.shape[0], dtype=bool)
+    distinct[1:] = (keys[1:] != keys[:-1]) | (days[1:] != days[:-1])
+    keys, days = keys[distinct], days[distinct]
+
+    # Uma nova sequência começa quando o território muda ou há um buraco entre os dias
+    starts = np.ones(keys.shape[0], dtype=bool)
+    starts[1:] = (keys[1:] != keys[:-1]) | (np.diff(days) != 1)
+
+    run_ids = np.cumsum(starts) - 1
+    run_lengths = np.bincount(run_ids)
+
+    # A última linha de cada território pertence à sua sequência mais recente
+    last = np.ones(keys.shape[0], dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+
+    streaks = np.zeros(offset, dtype=np.int64)
+
+    burning_today = last & (days == reference)
+    streaks[keys[burning_today]] = run_lengths[run_ids[burning_today]]
+
+    results = { }
+
+    for layer in layers:
+
+        n_codes = len(codes_by_layer[layer])
+
+        results[layer] = pd.DataFrame({
+            layer: codes_by_layer[layer],
+            "dias_consecutivos": streaks[offsets[layer]:offsets[layer] + n_codes],
+        })
+
+    return results
+
+
+def benchmark(n_territories=5000, n_days=365, fire_probability=.3):
+    '''
+    Compara o cálculo vetorizado com a abordagem anterior
+    (um gerador por território, voltando um dia de cada vez)
+    em uma temporada sintética.
+
+    Parâmetros:
+
+    > n_territories: quantidade de territórios
+
+    > n_days: quantidade de dias da temporada
+
+    > fire_probability: probabilidade de um território ter fogo em um dia
+    '''
+
+    rng = np.random.default_rng(0)
+
+    first_day = pd.to_datetime("2021-01-01")
+    reference_date = first_day + pd.Timedelta(days=n_days - 1)
+
+    burning = rng.random((n_territories, n_days)) < fire_probability
+    territories, day_offsets = np.nonzero(burning)
+
+    cube = pd.DataFrame({
+        "cod_box": territories.astype(str),
+        "dia": first_day + pd.to_timedelta(day_offsets, unit="D"),
+    })
+
+    print(f"{cube.shape[0]} pares (território, dia)")
+
+    # Abordagem anterior
+    start = time.perf_counter()
+
+    def count_consec_dates(dates, start_date):
+        dates_set = set(pd.to_datetime(dates.values).date)
+        tally = 0
+        while start_date in dates_set:
+            tally += 1
+            start_date -= datetime.timedelta(days=1)
+        return tally
+
+    old = cube.groupby("cod_box").dia.apply(lambda x: count_consec_dates(x, reference_date.date()))
+
+    old_seconds = time.perf_counter() - start
+
+    # Abordagem vetorizada
+    start = time.perf_counter()
+    new = consecutive_days({"cod_box": cube}, reference_date)["cod_box"]
+    new_seconds = time.perf_counter() - start
+
+    assert (new.set_index("cod_box").dias_consecutivos.sort_index() == old.sort_index()).all()
+
+    print(f"anterior:   {old_seconds:7.3f}s")
+    print(f"vetorizado: {new_seconds:7.3f}s")
+
+
+################
+### Execução ###
+################
+
+def main(argv):
+
+    if len(argv) < 2 or argv[1] != "benchmark":
+        print("Usage: python streaks.py benchmark")
+        sys.exit(1)
+
+    benchmark()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,256 @@
+'''
+Servidores HTTP locais usados pelos testes.
+
+MapboxStandIn imita os endpoints do Mapbox usados pelo projeto:
+as fontes, receitas, publicações e jobs do Mapbox Tiling Service
+(veja mts.py) e o estado dos uploads (veja wait_tilesets.py).
+serve_directory serve arquivos estáticos com suporte a requisições
+com cabeçalho Range, como um servidor do output estático.
+
+Os testes importam este módulo antes dos scripts do projeto: ele
+coloca o diretório code no caminho de importação e prepara as
+variáveis que os scripts esperam encontrar no servidor.
+'''
+
+from functools import partial
+from http.server import BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import re
+import sys
+import threading
+import types
+
+
+###############
+### Globals ###
+###############
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if CODE_DIR not in sys.path:
+    sys.path.insert(0, CODE_DIR)
+
+# process_tilesets lê o caminho dos utilitários do ambiente do conda
+os.environ.setdefault("CONDA_PREFIX", sys.prefix)
+
+# O token de acesso fica em um arquivo fora do repositório
+try:
+    import mapbox_credentials
+except ImportError:
+    sys.modules["mapbox_credentials"] = types.SimpleNamespace(token="test-token")
+
+import mts
+
+
+###############
+### Helpers ###
+###############
+
+def start_server(handler):
+    '''
+    Inicia um servidor HTTP em uma porta livre, em uma thread
+    separada. Retorna o servidor e o seu endereço.
+    '''
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    '''
+    Serve arquivos de um diretório e responde a requisições com
+    cabeçalho Range ('bytes=início-fim') com o trecho pedido.
+    '''
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+
+        if not match:
+            return super().do_GET()
+
+        path = self.translate_path(self.path)
+
+        if not os.path.isfile(path):
+            return self.send_error(404)
+
+        start, end = int(match[1]), int(match[2])
+        size = os.path.getsize(path)
+
+        if start >= size:
+            return self.send_error(416)
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(min(end, size - 1) - start + 1)
+
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{start + len(data) - 1}/{size}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve_directory(directory):
+    '''
+    Serve os arquivos de um diretório com suporte a requisições
+    com cabeçalho Range. Retorna o servidor e o seu endereço.
+    '''
+
+    return start_server(partial(RangeRequestHandler, directory=directory))
+
+
+##########################
+### Funções principais ###
+##########################
+
+class MapboxStandIn:
+    '''
+    Imitação local dos endpoints do Mapbox. O estado fica em atributos
+    que os testes podem ler e alterar:
+
+    > sources: {'usuario/fonte': [linhas GeoJSON]}, o conteúdo de cada fonte do MTS
+
+    > source_files: {'usuario/fonte': quantidade de arquivos}. Como no MTS, um
+    append a uma fonte que já tem mts.MAX_SOURCE_FILES arquivos recebe 422
+
+    > tilesets: {tileset: receita}, os tilesets criados
+
+    > jobs: {id do job: [estágios]}, os estágios devolvidos a cada consulta de um job
+
+    > job_stages: os estágios dos jobs criados daqui em diante
+
+    > uploads: {id do upload: [(código HTTP, resposta)]}, as respostas devolvidas
+    a cada consulta de um upload
+
+    > requests: lista com o (método, caminho) de cada requisição recebida
+
+    Nas listas de respostas, cada consulta consome o primeiro item,
+    e o último se repete nas consultas seguintes.
+    '''
+
+    def __init__(self):
+
+        self.sources = { }
+        self.source_files = { }
+        self.tilesets = { }
+        self.jobs = { }
+        self.job_stages = ["success"]
+        self.uploads = { }
+        self.requests = [ ]
+
+        self.server, self.url = start_server(self.handler())
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def requests_to(self, method, path):
+        '''
+        Retorna quantas requisições com esse método e caminho foram recebidas.
+        '''
+
+        return self.requests.count((method, path))
+
+    @staticmethod
+    def next_item(queue):
+        return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    def handler(self):
+
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body=None):
+                data = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def route(self, method):
+
+                path = self.path.split("?")[0]
+                standin.requests.append((method, path))
+
+                match = re.fullmatch(r"/tilesets/v1/sources/([^/]+/[^/]+)", path)
+                if match and method in ("PUT", "POST"):
+
+                    # O arquivo chega em multipart/form-data, com uma feição por linha
+                    features = [line.strip() for line in self.body().split(b"\n") if line.startswith(b'{"type": "Feature"')]
+
+                    if method == "PUT":
+                        standin.sources[match[1]] = [ ]
+                        standin.source_files[match[1]] = 0
+
+                    elif standin.source_files.get(match[1], 0) >= mts.MAX_SOURCE_FILES:
+                        return self.reply(422, {"message": f"Tileset sources cannot have more than {mts.MAX_SOURCE_FILES} files"})
+
+                    standin.sources.setdefault(match[1], [ ]).extend(features)
+                    standin.source_files[match[1]] = standin.source_files.get(match[1], 0) + 1
+
+                    return self.reply(200, {"id": f"mapbox://tileset-source/{match[1]}", "files": standin.source_files[match[1]], "source_size": len(standin.sources[match[1]])})
+
+                match = re.fullmatch(r"/tilesets/v1/([^/]+)/recipe", path)
+                if match and method == "PATCH":
+                    recipe = json.loads(self.body())
+                    if match[1] not in standin.tilesets:
+                        return self.reply(404, {"message": "Tileset does not exist"})
+                    standin.tilesets[match[1]] = recipe
+                    return self.reply(204)
+
+                match = re.fullmatch(r"/tilesets/v1/([^/]+)/publish", path)
+                if match and method == "POST":
+                    if match[1] not in standin.tilesets:
+                        return self.reply(404, {"message": "Tileset does not exist"})
+                    job_id = f"job-{len(standin.jobs) + 1}"
+                    standin.jobs[job_id] = list(standin.job_stages)
+                    return self.reply(200, {"message": "Processing", "jobId": job_id})
+
+                match = re.fullmatch(r"/tilesets/v1/([^/]+)/jobs/([^/]+)", path)
+                if match and method == "GET":
+                    if match[2] not in standin.jobs:
+                        return self.reply(404, {"message": "Job does not exist"})
+                    return self.reply(200, {"id": match[2], "stage": standin.next_item(standin.jobs[match[2]])})
+
+                match = re.fullmatch(r"/tilesets/v1/([^/]+)", path)
+                if match and method == "POST":
+                    standin.tilesets[match[1]] = json.loads(self.body())["recipe"]
+                    return self.reply(200, {"message": f"Successfully created empty tileset {match[1]}"})
+
+                match = re.fullmatch(r"/uploads/v1/[^/]+/([^/]+)", path)
+                if match and method == "GET":
+                    if match[1] not in standin.uploads:
+                        return self.reply(404, {"message": "Not Found"})
+                    status, body = standin.next_item(standin.uploads[match[1]])
+                    return self.reply(status, body)
+
+                self.reply(404, {"message": "Not Found"})
+
+            def do_GET(self):
+                self.route("GET")
+
+            def do_POST(self):
+                self.route("POST")
+
+            def do_PUT(self):
+                self.route("PUT")
+
+            def do_PATCH(self):
+                self.route("PATCH")
+
+        return Handler
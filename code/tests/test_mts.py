@@ -0,0 +1,179 @@
+'''
+Testa a publicação pelo Mapbox Tiling Service (process_tilesets.publish_mts
+e mts.py) contra o servidor local de standin.py.
+
+python -m unittest discover -s code/tests
+'''
+
+import standin
+
+import json
+import mts
+import os
+import pandas as pd
+import process_tilesets
+import requests
+import tempfile
+import unittest
+
+
+def write_points(fname, n):
+    '''
+    Salva um feather com n focos, com as colunas lidas por publish_mts.
+    '''
+
+    pd.DataFrame({
+        "uuid": [f"foco-{i}" for i in range(n)],
+        "data": ["2021-08-01"] * n,
+        "frp": [float(i) for i in range(n)],
+        "longitude": [-60 + i / 100 for i in range(n)],
+        "latitude": [-5.0] * n,
+    }).to_feather(fname)
+
+
+class PublishMTSTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.server = standin.MapboxStandIn()
+        self.addCleanup(self.server.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        # Todos os arquivos do teste ficam no diretório temporário
+        for name, value in {
+            "RECIPES_DIR": f"{self.directory}/recipes",
+            "DELTA_DIR": f"{self.directory}/delta",
+        }.items():
+            original = getattr(process_tilesets, name)
+            setattr(process_tilesets, name, value)
+            self.addCleanup(setattr, process_tilesets, name, original)
+
+        original_url = mts.API_URL
+        mts.API_URL = self.server.url
+        self.addCleanup(setattr, mts, "API_URL", original_url)
+
+        os.makedirs(process_tilesets.RECIPES_DIR)
+
+        self.feather = f"{self.directory}/bd_completo.feather"
+        self.source = ("amzsufocada-bd-completo", self.feather, ["data", "frp"])
+        self.source_path = f"/tilesets/v1/sources/infoamazonia/{self.source[0]}"
+
+    def features(self, name="amzsufocada-bd-completo"):
+        return [json.loads(line) for line in self.server.sources[f"infoamazonia/{name}"]]
+
+    def test_first_publish_replaces_source_and_creates_tileset(self):
+
+        write_points(self.feather, 3)
+
+        job_id = process_tilesets.publish_mts(self.source)
+
+        self.assertEqual(self.server.requests_to("PUT", self.source_path), 1)
+        self.assertEqual([feature["properties"]["frp"] for feature in self.features()], [0.0, 1.0, 2.0])
+        self.assertEqual(self.features()[0]["geometry"], {"type": "Point", "coordinates": [-60.0, -5.0]})
+
+        # O tileset não existia: o PATCH da receita recebe 404 e o tileset é criado
+        recipe = self.server.tilesets["infoamazonia.amzsufocada-bd-completo"]
+        layer = recipe["layers"]["amzsufocada-bd-completo"]
+        self.assertEqual(layer["source"], "mapbox://tileset-source/infoamazonia/amzsufocada-bd-completo")
+        self.assertEqual(layer["features"]["attributes"]["allowed_output"], ["data", "frp"])
+
+        with open(f"{process_tilesets.RECIPES_DIR}/amzsufocada-bd-completo.json") as f:
+            self.assertEqual(json.load(f), recipe)
+
+        self.assertIn(job_id, self.server.jobs)
+
+    def test_new_points_are_appended(self):
+
+        write_points(self.feather, 3)
+        process_tilesets.publish_mts(self.source)
+
+        write_points(self.feather, 5)
+        process_tilesets.publish_mts(self.source)
+
+        self.assertEqual(self.server.requests_to("PUT", self.source_path), 1)
+        self.assertEqual(self.server.requests_to("POST", self.source_path), 1)
+        self.assertEqual([feature["properties"]["frp"] for feature in self.features()], [0.0, 1.0, 2.0, 3.0, 4.0])
+
+        # O tileset já existe: a receita é atualizada sem criar o tileset de novo
+        self.assertEqual(self.server.requests_to("PATCH", "/tilesets/v1/infoamazonia.amzsufocada-bd-completo/recipe"), 2)
+        self.assertEqual(self.server.requests_to("POST", "/tilesets/v1/infoamazonia.amzsufocada-bd-completo"), 1)
+        self.assertEqual(self.server.requests_to("POST", "/tilesets/v1/infoamazonia.amzsufocada-bd-completo/publish"), 2)
+
+    def test_nothing_new_is_not_published(self):
+
+        write_points(self.feather, 3)
+        process_tilesets.publish_mts(self.source)
+
+        self.assertIsNone(process_tilesets.publish_mts(self.source))
+        self.assertEqual(self.server.requests_to("POST", "/tilesets/v1/infoamazonia.amzsufocada-bd-completo/publish"), 1)
+
+    def test_removed_points_replace_source(self):
+
+        write_points(self.feather, 5)
+        process_tilesets.publish_mts(self.source)
+
+        # Como na virada do ano: focos antigos saem do banco de dados
+        pd.read_feather(self.feather).iloc[3:].reset_index(drop=True).to_feather(self.feather)
+        process_tilesets.publish_mts(self.source)
+
+        self.assertEqual(self.server.requests_to("PUT", self.source_path), 2)
+        self.assertEqual([feature["properties"]["frp"] for feature in self.features()], [3.0, 4.0])
+
+    def test_full_source_is_replaced(self):
+
+        write_points(self.feather, 1)
+        process_tilesets.publish_mts(self.source)
+
+        # Um foco novo por dia: a fonte chega ao limite de arquivos
+        for n in range(2, mts.MAX_SOURCE_FILES + 3):
+            write_points(self.feather, n)
+            self.assertIsNotNone(process_tilesets.publish_mts(self.source))
+
+        self.assertEqual(self.server.requests_to("PUT", self.source_path), 2)
+        self.assertEqual(self.server.requests_to("POST", self.source_path), mts.MAX_SOURCE_FILES)
+        self.assertLessEqual(self.server.source_files["infoamazonia/amzsufocada-bd-completo"], mts.MAX_SOURCE_FILES)
+        self.assertEqual([feature["properties"]["frp"] for feature in self.features()], [float(i) for i in range(mts.MAX_SOURCE_FILES + 2)])
+
+    def test_standin_rejects_appends_to_full_source(self):
+
+        write_points(self.feather, 1)
+        process_tilesets.publish_mts(self.source)
+
+        for _ in range(mts.MAX_SOURCE_FILES - 1):
+            mts.upload_source("infoamazonia", "amzsufocada-bd-completo", self.feather, "test-token", append=True)
+
+        with self.assertRaises(requests.HTTPError):
+            mts.upload_source("infoamazonia", "amzsufocada-bd-completo", self.feather, "test-token", append=True)
+
+    def test_tilesets_outside_delta_always_replace(self):
+
+        source = ("amzsufocada-24h", self.feather, ["frp"])
+        path = "/tilesets/v1/sources/infoamazonia/amzsufocada-24h"
+
+        write_points(self.feather, 2)
+        process_tilesets.publish_mts(source)
+
+        write_points(self.feather, 3)
+        process_tilesets.publish_mts(source)
+
+        self.assertEqual(self.server.requests_to("PUT", path), 2)
+        self.assertEqual(self.server.requests_to("POST", path), 0)
+        self.assertEqual(len(self.features("amzsufocada-24h")), 3)
+
+    def test_job_status_follows_job_stages(self):
+
+        self.server.job_stages = ["queued", "processing", "success"]
+
+        write_points(self.feather, 1)
+        job_id = process_tilesets.publish_mts(self.source)
+
+        stages = [mts.job_status("infoamazonia.amzsufocada-bd-completo", job_id, "test-token") for _ in range(4)]
+
+        self.assertEqual(stages, ["queued", "processing", "success", "success"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+'''
+Testa a conversão de .mbtiles em PMTiles (pmtiles_export.py) lendo
+os tiles de um servidor local com suporte a requisições Range, e o
+modo 'pmtiles' de process_tilesets.py.
+
+python -m unittest discover -s code/tests
+'''
+
+import standin
+
+import gzip
+import os
+import pmtiles_export
+import process_tilesets
+import requests
+import sqlite3
+import tempfile
+import unittest
+
+
+def write_mbtiles(fname, max_zoom):
+    '''
+    Salva um .mbtiles com todos os tiles até max_zoom. Um terço dos
+    tiles tem o mesmo conteúdo, como os tiles vazios do oceano.
+    Retorna um dicionário {(z, x, y): dados}.
+    '''
+
+    tiles = { }
+
+    for z in range(max_zoom + 1):
+        for x in range(1 << z):
+            for y in range(1 << z):
+                text = "oceano" if x % 3 == 0 else f"tile {z}/{x}/{y}"
+                tiles[(z, x, y)] = gzip.compress(text.encode(), mtime=0)
+
+    connection = sqlite3.connect(fname)
+
+    with connection:
+        connection.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+        connection.execute("CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)")
+        connection.executemany("INSERT INTO metadata VALUES (?, ?)", [
+            ("name", "teste"), ("format", "pbf"), ("minzoom", "0"), ("maxzoom", str(max_zoom)),
+            ("bounds", "-74,-18,-44,5"), ("center", "-60,-5,3"),
+        ])
+        # O .mbtiles usa o esquema TMS, com a linha contada de baixo para cima
+        connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", [
+            (z, x, (1 << z) - 1 - y, data) for (z, x, y), data in tiles.items()
+        ])
+
+    connection.close()
+
+    return tiles
+
+
+class ConvertTest(unittest.TestCase):
+
+    def setUp(self):
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        self.server, self.url = standin.serve_directory(self.directory)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        self.tiles = write_mbtiles(f"{self.directory}/teste.mbtiles", max_zoom=4)
+
+    def fetch(self, fname):
+        '''
+        Retorna uma função que lê um trecho do arquivo pelo servidor local.
+        '''
+
+        def fetch(offset, length):
+            response = requests.get(f"{self.url}/{fname}", headers={"Range": f"bytes={offset}-{offset + length - 1}"})
+            self.assertEqual(response.status_code, 206)
+            return response.content
+
+        return fetch
+
+    def check_tiles(self, fname):
+
+        fetch = self.fetch(fname)
+
+        for (z, x, y), data in self.tiles.items():
+            self.assertEqual(pmtiles_export.get_tile(fetch, z, x, y), data, (z, x, y))
+
+        self.assertIsNone(pmtiles_export.get_tile(fetch, 5, 0, 0))
+
+    def test_tiles_match_source(self):
+
+        counts = pmtiles_export.convert(f"{self.directory}/teste.mbtiles", f"{self.directory}/teste.pmtiles")
+
+        self.assertEqual(counts["tiles"], len(self.tiles))
+
+        # Os tiles do oceano são gravados uma única vez
+        self.assertEqual(counts["conteudos"], len(set(self.tiles.values())))
+        self.assertLess(counts["entradas"], counts["tiles"])
+
+        self.check_tiles("teste.pmtiles")
+
+    def test_tiles_match_source_with_leaf_directories(self):
+
+        original = pmtiles_export.ROOT_SIZE
+        pmtiles_export.ROOT_SIZE = pmtiles_export.HEADER_SIZE + 64
+        self.addCleanup(setattr, pmtiles_export, "ROOT_SIZE", original)
+
+        pmtiles_export.convert(f"{self.directory}/teste.mbtiles", f"{self.directory}/folhas.pmtiles")
+
+        with open(f"{self.directory}/folhas.pmtiles", "rb") as f:
+            header = f.read(pmtiles_export.HEADER_SIZE)
+
+        # O tamanho dos diretórios-folha, no cabeçalho, não é zero
+        self.assertGreater(int.from_bytes(header[48:56], "little"), 0)
+
+        self.check_tiles("folhas.pmtiles")
+
+    def test_hilbert_tile_ids(self):
+
+        tiles = [(0, 0, 0), (1, 0, 0), (1, 0, 1), (1, 1, 1), (1, 1, 0), (2, 0, 0)]
+
+        self.assertEqual([pmtiles_export.tile_id(*tile) for tile in tiles], [0, 1, 2, 3, 4, 5])
+
+
+class PMTilesModeTest(unittest.TestCase):
+
+    def setUp(self):
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        root = directory.name
+
+        for name, value in {
+            "PROJECT_ROOT": root,
+            "MANIFEST": f"{root}/output/mbtiles/manifest.json",
+            "PMTILES_DIR": f"{root}/output/pmtiles",
+        }.items():
+            original = getattr(process_tilesets, name)
+            setattr(process_tilesets, name, value)
+            self.addCleanup(setattr, process_tilesets, name, original)
+
+        os.makedirs(f"{root}/output/mbtiles/tilesets")
+        os.makedirs(process_tilesets.PMTILES_DIR)
+
+        # Um tileset gerado como .mbtiles por outra etapa do pipeline
+        mbtiles = f"{root}/output/mbtiles/tilesets/amzsufocada-teste.mbtiles"
+        write_mbtiles(mbtiles, max_zoom=2)
+
+        self.source = ("amzsufocada-teste", mbtiles, None)
+        self.pmtiles = process_tilesets.pmtiles_path(self.source)
+
+    def export(self):
+        return process_tilesets.build_and_upload([self.source], publish=process_tilesets.export_pmtiles, manifest_key="pmtiles", output=process_tilesets.pmtiles_path)
+
+    def test_missing_archive_is_regenerated(self):
+
+        self.export()
+        self.assertTrue(os.path.isfile(self.pmtiles))
+
+        self.assertTrue(self.export()["amzsufocada-teste"].get("pulado"))
+
+        os.remove(self.pmtiles)
+
+        self.assertFalse(self.export()["amzsufocada-teste"].get("pulado"))
+        self.assertTrue(os.path.isfile(self.pmtiles))
+
+
+if __name__ == "__main__":
+    unittest.main()
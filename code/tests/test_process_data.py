@@ -0,0 +1,124 @@
+'''
+Testa a exportação sob demanda de process_data.py (export_on_demand).
+
+process_data.py lê, ao ser importado, os limites dos territórios salvos
+por prepare.py em output/feathers/sources, então estes testes só rodam
+depois do setup.sh.
+
+python -m unittest discover -s code/tests
+'''
+
+import standin
+
+import geopandas as gpd
+import json
+import os
+import pandas as pd
+from shapely.geometry import Point
+import tempfile
+import unittest
+
+SOURCES_DIR = f"{os.path.dirname(standin.CODE_DIR)}/output/feathers/sources"
+
+if os.path.isfile(f"{SOURCES_DIR}/biomas_amazonia_legal.feather"):
+    import process_data
+
+
+@unittest.skipUnless(os.path.isfile(f"{SOURCES_DIR}/biomas_amazonia_legal.feather"), "run setup.sh to create output/feathers/sources")
+class ExportOnDemandTest(unittest.TestCase):
+
+    def setUp(self):
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        original = process_data.PROJECT_ROOT
+        process_data.PROJECT_ROOT = directory.name
+        self.addCleanup(setattr, process_data, "PROJECT_ROOT", original)
+
+    def save(self, df, artifact):
+        fname = process_data.output_path(artifact, "feather")
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        df.to_feather(fname)
+
+    def target(self, artifact, format_):
+        fname = process_data.output_path(artifact, format_)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        return fname
+
+    def test_events_without_geometry_export_as_csv(self):
+
+        events = pd.DataFrame({"evento": [1, 2], "focos": [10, 3], "inicio": ["2021-08-01", "2021-08-03"]})
+        self.save(events, "eventos/eventos")
+        self.target("eventos/eventos", "csv")
+
+        fname = process_data.export_on_demand("eventos/eventos", "csv")
+
+        self.assertEqual(pd.read_csv(fname)[["evento", "focos", "inicio"]].to_dict("list"), events.to_dict("list"))
+
+    def test_attributes_without_geometry_export_as_keyed_json(self):
+
+        attributes = pd.DataFrame({"cod_ti": [7, 9], "focos_24h": [2.0, None]})
+        self.save(attributes, "land_info/atributos/terras_indigenas")
+        self.target("land_info/atributos/terras_indigenas", "json")
+
+        fname = process_data.export_on_demand("land_info/atributos/terras_indigenas", "json")
+
+        with open(fname) as f:
+            self.assertEqual(json.load(f), {"chave": "cod_ti", "colunas": ["focos_24h"], "dados": {"7": [2.0], "9": [None]}})
+
+    def test_geometry_less_artifact_cannot_be_geojson(self):
+
+        self.save(pd.DataFrame({"evento": [1]}), "eventos/eventos")
+
+        with self.assertRaises(ValueError):
+            process_data.export_on_demand("eventos/eventos", "geojson")
+
+    def test_geodataframe_exports_as_geojson(self):
+
+        gdf = gpd.GeoDataFrame({"cod_box": [1]}, geometry=[Point(-60, -5)], crs="EPSG:4326")
+        self.save(gdf, "land_info/regioes_grid")
+        self.target("land_info/regioes_grid", "geojson")
+
+        fname = process_data.export_on_demand("land_info/regioes_grid", "geojson")
+
+        with open(fname) as f:
+            feature = json.load(f)["features"][0]
+
+        self.assertEqual(feature["geometry"]["coordinates"], [-60.0, -5.0])
+
+
+@unittest.skipUnless(os.path.isfile(f"{SOURCES_DIR}/biomas_amazonia_legal.feather"), "run setup.sh to create output/feathers/sources")
+class RetiredOutputsTest(unittest.TestCase):
+
+    def test_retired_outputs_are_removed(self):
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        original = process_data.PROJECT_ROOT
+        process_data.PROJECT_ROOT = directory.name
+        self.addCleanup(setattr, process_data, "PROJECT_ROOT", original)
+
+        paths = [f"{directory.name}/output/{item}" for item in process_data.RETIRED_OUTPUTS]
+        for path in paths:
+
+            # Itens sem extensão são diretórios, como o dos segmentos diários
+            if os.path.splitext(path)[1]:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                open(path, "w").close()
+            else:
+                os.makedirs(path, exist_ok=True)
+                open(f"{path}/2021-08-01.geojsons", "w").close()
+
+        kept = f"{directory.name}/output/jsons/land_info/geometrias/biomas.json"
+        open(kept, "w").close()
+
+        process_data.remove_retired_outputs()
+
+        self.assertEqual([path for path in paths if os.path.exists(path)], [ ])
+        self.assertTrue(os.path.isfile(kept))
+
+
+if __name__ == "__main__":
+    unittest.main()
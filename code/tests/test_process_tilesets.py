@@ -0,0 +1,37 @@
+'''
+Testa a configuração dos tilesets de process_tilesets.py.
+
+python -m unittest discover -s code/tests
+'''
+
+import standin
+
+import process_tilesets
+import unittest
+
+
+class SourcesTest(unittest.TestCase):
+
+    def test_image_tilesets_are_in_sources(self):
+
+        names = [source[0] for source in process_tilesets.SOURCES]
+
+        self.assertEqual([tileset for tileset in process_tilesets.IMAGE_TILESETS if tileset not in names], [ ])
+
+    def test_image_tilesets_carry_fire_counts(self):
+
+        # A API de imagens estáticas não junta as tabelas de atributos aos
+        # polígonos, então os tilesets das imagens não podem vir de geometrias
+        for source in process_tilesets.SOURCES:
+            if source[0] in process_tilesets.IMAGE_TILESETS:
+                self.assertNotIn("/land_info/geometrias/", source[1], source[0])
+
+    def test_other_territories_use_static_geometry(self):
+
+        for tileset in process_tilesets.POLYGON_TILESETS:
+            self.assertNotIn(tileset, process_tilesets.IMAGE_TILESETS)
+            self.assertIn("/land_info/geometrias/", dict((source[0], source[1]) for source in process_tilesets.SOURCES)[tileset])
+
+
+if __name__ == "__main__":
+    unittest.main()
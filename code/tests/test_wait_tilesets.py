@@ -0,0 +1,162 @@
+'''
+Testa a espera pelos tilesets enviados ao Mapbox (wait_tilesets.py)
+contra o servidor local de standin.py.
+
+python -m unittest discover -s code/tests
+'''
+
+import standin
+
+import json
+import mts
+import os
+import process_tilesets
+import tempfile
+import unittest
+import wait_tilesets
+
+
+class WaitTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.server = standin.MapboxStandIn()
+        self.addCleanup(self.server.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+        for name, value in {
+            "MANIFEST": f"{self.directory}/manifest.json",
+            "DELTA_DIR": f"{self.directory}/delta",
+        }.items():
+            original = getattr(process_tilesets, name)
+            setattr(process_tilesets, name, value)
+            self.addCleanup(setattr, process_tilesets, name, original)
+
+        original_url = mts.API_URL
+        mts.API_URL = self.server.url
+        self.addCleanup(setattr, mts, "API_URL", original_url)
+
+        # O manifesto como process_tilesets.py o deixa depois dos envios
+        process_tilesets.save_manifest({
+            "arquivos": { },
+            "tilesets": {"amzsufocada-24h": "a", "amzsufocada-7d": "b"},
+            "mts": {"amzsufocada-bd-completo": "c"},
+            "pmtiles": { },
+        })
+
+        self.state_fname = f"{process_tilesets.DELTA_DIR}/amzsufocada-bd-completo/fonte_mts.feather"
+        os.makedirs(os.path.dirname(self.state_fname))
+        open(self.state_fname, "w").close()
+
+        self.server.jobs["job-1"] = ["processing", "success"]
+
+        self.submissions = {
+            "amzsufocada-24h": {"api": "uploads", "id": "upload-1"},
+            "amzsufocada-7d": {"api": "uploads", "id": "upload-2"},
+            "amzsufocada-bd-completo": {"api": "mts", "id": "job-1"},
+        }
+
+    def wait(self, **kwargs):
+        return wait_tilesets.wait(self.submissions, "test-token", first_delay=0.01, max_delay=0.02, **kwargs)
+
+    def manifest(self):
+        with open(process_tilesets.MANIFEST) as f:
+            return json.load(f)
+
+    def test_waits_until_everything_is_ready(self):
+
+        self.server.uploads["upload-1"] = [(200, {"complete": False}), (200, {"complete": False}), (200, {"complete": True})]
+        self.server.uploads["upload-2"] = [(200, {"complete": True})]
+
+        self.wait(timeout=5)
+
+        self.assertEqual(self.server.requests_to("GET", "/uploads/v1/infoamazonia/upload-1"), 3)
+        self.assertEqual(self.server.requests_to("GET", "/uploads/v1/infoamazonia/upload-2"), 1)
+        self.assertEqual(self.server.requests_to("GET", "/tilesets/v1/infoamazonia.amzsufocada-bd-completo/jobs/job-1"), 2)
+
+        # Nada falhou: o manifesto fica como estava
+        self.assertEqual(self.manifest()["tilesets"], {"amzsufocada-24h": "a", "amzsufocada-7d": "b"})
+        self.assertTrue(os.path.isfile(self.state_fname))
+
+    def test_server_errors_are_retried(self):
+
+        self.server.uploads["upload-1"] = [(503, {"message": "Service Unavailable"}), (200, {"complete": True})]
+        self.server.uploads["upload-2"] = [(200, {"complete": True})]
+
+        self.wait(timeout=5)
+
+        self.assertEqual(self.server.requests_to("GET", "/uploads/v1/infoamazonia/upload-1"), 2)
+
+    def test_failed_submissions_are_removed_from_manifest(self):
+
+        self.server.uploads["upload-1"] = [(200, {"complete": False, "error": "Tileset exceeds processing limit"})]
+        self.server.uploads["upload-2"] = [(200, {"complete": False}), (200, {"complete": True})]
+        self.server.jobs["job-1"] = ["processing", "failed"]
+
+        with self.assertRaises(RuntimeError):
+            self.wait(timeout=5)
+
+        # Os demais envios são esperados antes do erro
+        self.assertEqual(self.server.requests_to("GET", "/uploads/v1/infoamazonia/upload-2"), 2)
+
+        manifest = self.manifest()
+        self.assertEqual(manifest["tilesets"], {"amzsufocada-7d": "b"})
+        self.assertEqual(manifest["mts"], { })
+        self.assertFalse(os.path.isfile(self.state_fname))
+
+    def test_unknown_submissions_are_removed_from_manifest(self):
+
+        self.server.uploads["upload-2"] = [(200, {"complete": True})]
+
+        with self.assertRaises(RuntimeError):
+            self.wait(timeout=5)
+
+        self.assertNotIn("amzsufocada-24h", self.manifest()["tilesets"])
+
+    def test_timeout_removes_pending_submissions(self):
+
+        self.server.uploads["upload-1"] = [(200, {"complete": False})]
+        self.server.uploads["upload-2"] = [(200, {"complete": True})]
+
+        with self.assertRaises(TimeoutError):
+            self.wait(timeout=0.1)
+
+        self.assertEqual(self.manifest()["tilesets"], {"amzsufocada-7d": "b"})
+        self.assertEqual(self.manifest()["mts"], {"amzsufocada-bd-completo": "c"})
+
+    def test_check_failures_does_not_wait(self):
+
+        self.server.uploads["upload-1"] = [(200, {"complete": False})]
+        self.server.uploads["upload-2"] = [(200, {"complete": False, "error": "Invalid file"})]
+
+        failed = wait_tilesets.check_failures(self.submissions, "test-token")
+
+        self.assertEqual(failed, ["amzsufocada-7d"])
+        self.assertEqual(self.manifest()["tilesets"], {"amzsufocada-24h": "a"})
+        self.assertEqual(self.server.requests_to("GET", "/uploads/v1/infoamazonia/upload-1"), 1)
+
+    def test_main_continues_after_failures(self):
+
+        self.server.uploads["upload-1"] = [(200, {"complete": False, "error": "Invalid file"})]
+        self.server.uploads["upload-2"] = [(200, {"complete": True})]
+        self.server.jobs["job-1"] = ["success"]
+
+        fname = f"{self.directory}/envios.json"
+        with open(fname, "w") as f:
+            json.dump(self.submissions, f)
+
+        original = wait_tilesets.SUBMISSIONS
+        wait_tilesets.SUBMISSIONS = fname
+        self.addCleanup(setattr, wait_tilesets, "SUBMISSIONS", original)
+
+        # O update_data.sh segue para as imagens e os tweets do dia
+        wait_tilesets.main()
+
+        self.assertEqual(self.manifest()["tilesets"], {"amzsufocada-7d": "b"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,7 +13,7 @@ def main():
 
 	process_data.main([])
 	process_subsets.main()
-	process_tilesets.main()
+	process_tilesets.main([])
 
 
 if __name__ == "__main__":
@@ -1,9 +1,19 @@
 '''
 Atualiza apenas o banco de dados de
 terras, sem alterar os dados de focos
-de fogo salvos anteriormente
+de fogo salvos anteriormente.
+
+Com o argumento 'rebuild', recria antes o cubo de focos
+lendo o banco de dados completo em lotes, com memória
+limitada. Opcionalmente, recebe o primeiro dia que deve
+ser mantido, o que permite processar históricos de vários anos:
+
+python update_land_datasets.py rebuild 2019-01-01
 '''
 
+import os
+import sys
+
 ###########################
 ### Rename os functions ###
 ### for readability     ###
@@ -21,16 +31,21 @@ PROJECT_ROOT = dirname(abspath(dirname(__file__)))
 from process_data import *
 import geopandas as gpd
 
-def main():
+def main(argv):
+
+	if len(argv) > 1 and argv[1] == "rebuild":
+		first_day = argv[2] if len(argv) > 2 else None
+
+		print("> Rebuilding fire cube")
+		stream_fire_cube(f"{PROJECT_ROOT}/output/feathers/tilesets/bd_completo_com_duplicatas.feather", first_day)
 	
 	df_24h = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/tilesets/24h.feather")
 	df_7d = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/tilesets/7d.feather")
-	full_db = gpd.read_feather(f"{PROJECT_ROOT}/output/feathers/tilesets/bd_completo.feather")
 
 	# Cria arquivos com os dados estáticos sobre terras indígenas e unidades de conservação
 	print("> Creating land databases")
-	update_land_datasets(df_24h, df_7d, full_db)
+	update_land_datasets(df_24h, df_7d)
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	main(sys.argv)
\ No newline at end of file
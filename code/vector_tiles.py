@@ -0,0 +1,374 @@
+'''
+Codificador de vector tiles (Mapbox Vector Tile) para camadas
+pequenas de pontos.
+
+Os recortes de process_subsets têm no máximo alguns milhares
+de pontos. Para eles, abrir um processo do tippecanoe custa mais
+do que gerar os tiles: aqui, os pontos são projetados em Web
+Mercator, distribuídos nos tiles de cada zoom, quantizados na
+grade do tile (extent) e codificados em protobuf, e os tiles
+são gravados diretamente em um arquivo .mbtiles (SQLite).
+
+Todos os pontos aparecem em todos os zooms, como com a opção
+-r1 do tippecanoe.
+
+Veja mais:
+
+https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+https://github.com/mapbox/mbtiles-spec/blob/master/1.3/spec.md
+'''
+
+import gzip
+import json
+import numpy as np
+import os
+import pandas as pd
+import sqlite3
+import struct
+
+
+###############
+### Globals ###
+###############
+
+# Tamanho da grade de coordenadas de cada tile
+EXTENT = 4096
+
+# Latitude máxima da projeção Web Mercator
+MAX_LATITUDE = 85.0511287798
+
+# Comando MoveTo com um único ponto (id 1, contagem 1)
+MOVE_TO_ONE = (1 & 0x7) | (1 << 3)
+
+# Tipo de geometria POINT do protobuf
+POINT = 1
+
+# Varints de um único byte, já codificados
+SMALL_VARINTS = [bytes((value,)) for value in range(0x80)]
+
+
+###############
+### Helpers ###
+###############
+
+def varint(value):
+    '''
+    Codifica um inteiro não negativo como varint do protobuf.
+    '''
+
+    # Caso mais comum: índices de chaves e valores e coordenadas pequenas
+    if value < 0x80:
+        return SMALL_VARINTS[value]
+
+    encoded = bytearray()
+
+    while value > 0x7F:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+
+    encoded.append(value)
+
+    return bytes(encoded)
+
+
+def zigzag(value):
+    '''
+    Converte um inteiro com sinal para a codificação
+    zigzag usada nas coordenadas e nos valores sint.
+    '''
+
+    return (value << 1) ^ (value >> 63)
+
+
+def field(number, wire_type):
+    '''
+    Retorna a chave de um campo do protobuf.
+    '''
+
+    return varint((number << 3) | wire_type)
+
+
+def length_delimited(number, payload):
+    '''
+    Codifica um campo de tamanho variável (texto,
+    mensagem ou lista compactada).
+    '''
+
+    return field(number, 2) + varint(len(payload)) + payload
+
+
+def packed(number, values):
+    '''
+    Codifica uma lista compactada de varints.
+    '''
+
+    return length_delimited(number, b"".join(varint(value) for value in values))
+
+
+def encode_value(value):
+    '''
+    Codifica um valor de propriedade como mensagem Value.
+    '''
+
+    # bool precisa vir antes de int, já que é uma subclasse dele
+    if isinstance(value, bool):
+        return field(7, 0) + varint(int(value))
+
+    if isinstance(value, int):
+        if value < 0:
+            return field(6, 0) + varint(zigzag(value))
+        return field(5, 0) + varint(value)
+
+    if isinstance(value, float):
+        return field(3, 1) + struct.pack("<d", value)
+
+    return length_delimited(1, str(value).encode("utf-8"))
+
+
+def is_null(value):
+    '''
+    Verifica se um valor deve ficar fora das propriedades da feição.
+    '''
+
+    return value is None or (not isinstance(value, str) and pd.isna(value))
+
+
+def field_type(series):
+    '''
+    Retorna o tipo de uma coluna no formato dos
+    metadados do .mbtiles: 'Number', 'Boolean' ou 'String'.
+    '''
+
+    if series.dtype.kind == "b":
+        return "Boolean"
+
+    if series.dtype.kind in "iuf":
+        return "Number"
+
+    return "String"
+
+
+def project(longitudes, latitudes):
+    '''
+    Projeta coordenadas geográficas em Web Mercator, normalizadas
+    entre 0 e 1, com o eixo y crescendo para o sul, como nos tiles.
+    '''
+
+    latitudes = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+
+    x = (np.asarray(longitudes, dtype=float) + 180) / 360
+    y = (1 - np.log(np.tan(latitudes) + 1 / np.cos(latitudes)) / np.pi) / 2
+
+    return x, y
+
+
+def encode_layer(name, rows, records, extent=EXTENT):
+    '''
+    Codifica uma camada de um tile. Chaves e valores repetidos
+    são guardados uma única vez, em tabelas referenciadas
+    pelas tags de cada feição.
+
+    Parâmetros:
+
+    > name: o nome da camada
+
+    > rows: lista de tuplas (x, y, linha) com as coordenadas no tile e
+    a posição do ponto em 'records'
+
+    > records: lista com os pares (nome, (tipo, valor)) das propriedades não nulas de cada ponto
+
+    > extent: o tamanho da grade de coordenadas do tile
+    '''
+
+    values, features = { }, [ ]
+    used_keys = { }
+
+    for x, y, row in rows:
+
+        tags = [ ]
+
+        for key, value in records[row]:
+            tags.append(used_keys.setdefault(key, len(used_keys)))
+            tags.append(values.setdefault(value, len(values)))
+
+        geometry = [MOVE_TO_ONE, zigzag(int(x)), zigzag(int(y))]
+
+        feature = field(3, 0) + varint(POINT) + packed(4, geometry)
+        if tags:
+            feature = packed(2, tags) + feature
+
+        features.append(length_delimited(2, feature))
+
+    layer = field(15, 0) + varint(2) + length_delimited(1, name.encode("utf-8"))
+    layer += b"".join(features)
+    layer += b"".join(length_delimited(3, key.encode("utf-8")) for key in used_keys)
+    layer += b"".join(length_delimited(4, encode_value(value)) for _, value in values)
+    layer += field(5, 0) + varint(extent)
+
+    return length_delimited(3, layer)
+
+
+##########################
+### Funções principais ###
+##########################
+
+def build_tiles(gdf, layer, properties=None, minzoom=0, maxzoom=10, extent=EXTENT, buffer=0):
+    '''
+    Gera os tiles de uma camada de pontos. Retorna um dicionário
+    no formato {(z, x, y): bytes do tile}, com y no esquema XYZ.
+
+    Parâmetros:
+
+    > gdf: geodataframe de pontos, em coordenadas geográficas
+
+    > layer: o nome da camada
+
+    > properties: lista com as colunas que vão para os tiles.
+    Se for None, todas as colunas, exceto a geometria, são usadas.
+
+    > minzoom, maxzoom: os níveis de zoom gerados
+
+    > extent: o tamanho da grade de coordenadas de cada tile
+
+    > buffer: a margem, em unidades da grade, em que pontos dos
+    tiles vizinhos também são incluídos
+    '''
+
+    if properties is None:
+        properties = [column for column in gdf.columns if column != gdf.geometry.name]
+
+    # Valores nativos do Python, já que os numéricos do numpy não passam pelo isinstance de encode_value.
+    # As propriedades nulas de cada ponto são descartadas uma única vez, e não em cada zoom.
+    records = [
+        [(key, (type(value), value)) for key, value in zip(properties, values) if not is_null(value)]
+        for values in gdf[properties].astype(object).values.tolist()
+    ]
+
+    tiles = { }
+
+    if gdf.shape[0] == 0:
+        return tiles
+
+    wx, wy = project(gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy())
+
+    for zoom in range(minzoom, maxzoom + 1):
+
+        scale = (1 << zoom) * extent
+        px, py = wx * scale, wy * scale
+
+        tx = np.floor(px / extent).astype(np.int64)
+        ty = np.floor(py / extent).astype(np.int64)
+
+        offsets = [(0, 0)]
+        if buffer > 0:
+            offsets = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+        placed = [ ]
+
+        for dx, dy in offsets:
+
+            x = np.round(px - (tx + dx) * extent).astype(np.int64)
+            y = np.round(py - (ty + dy) * extent).astype(np.int64)
+
+            inside = (x >= -buffer) & (x <= extent + buffer) & (y >= -buffer) & (y <= extent + buffer)
+            inside &= (tx + dx >= 0) & (tx + dx < 1 << zoom) & (ty + dy >= 0) & (ty + dy < 1 << zoom)
+
+            rows = np.flatnonzero(inside)
+
+            placed.append(pd.DataFrame({
+                "tx": tx[rows] + dx, "ty": ty[rows] + dy,
+                "x": x[rows], "y": y[rows], "row": rows,
+            }))
+
+        placed = pd.concat(placed, ignore_index=True).sort_values(["tx", "ty"], kind="stable")
+
+        # Fatias de pontos de cada tile, sem o custo de um groupby por tile
+        keys = placed[["tx", "ty"]].to_numpy()
+        starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)])
+        ends = np.r_[starts[1:], keys.shape[0]]
+
+        points = list(zip(placed.x.tolist(), placed.y.tolist(), placed.row.tolist()))
+
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            tiles[(zoom, int(keys[start, 0]), int(keys[start, 1]))] = encode_layer(layer, points[start:end], records, extent)
+
+    return tiles
+
+
+def write_mbtiles(gdf, fname, layer, properties=None, minzoom=0, maxzoom=10, buffer=0):
+    '''
+    Gera os tiles de uma camada de pontos e os grava em um arquivo
+    .mbtiles. O arquivo é escrito em um caminho temporário e renomeado
+    ao final, sem alterar o arquivo compartilhado com gerações
+    anteriores do output.
+
+    Parâmetros:
+
+    > gdf: geodataframe de pontos, em coordenadas geográficas
+
+    > fname: o caminho do arquivo .mbtiles
+
+    > layer: o nome da camada
+
+    > properties: lista com as colunas que vão para os tiles.
+    Se for None, todas as colunas, exceto a geometria, são usadas.
+
+    > minzoom, maxzoom: os níveis de zoom gerados
+
+    > buffer: a margem dos tiles, em unidades da grade
+    '''
+
+    if properties is None:
+        properties = [column for column in gdf.columns if column != gdf.geometry.name]
+
+    tiles = build_tiles(gdf, layer, properties, minzoom, maxzoom, buffer=buffer)
+
+    if gdf.shape[0]:
+        west, south, east, north = gdf.total_bounds
+    else:
+        west, south, east, north = -180, -MAX_LATITUDE, 180, MAX_LATITUDE
+
+    vector_layers = [{
+        "id": layer,
+        "description": "",
+        "minzoom": minzoom,
+        "maxzoom": maxzoom,
+        "fields": {column: field_type(gdf[column]) for column in properties},
+    }]
+
+    metadata = {
+        "name": layer,
+        "format": "pbf",
+        "type": "overlay",
+        "version": "2",
+        "minzoom": str(minzoom),
+        "maxzoom": str(maxzoom),
+        "bounds": f"{west},{south},{east},{north}",
+        "center": f"{(west + east) / 2},{(south + north) / 2},{minzoom}",
+        "json": json.dumps({"vector_layers": vector_layers}),
+    }
+
+    tmp_fname = f"{fname}.tmp-{os.getpid()}"
+
+    if os.path.exists(tmp_fname):
+        os.remove(tmp_fname)
+
+    connection = sqlite3.connect(tmp_fname)
+
+    with connection:
+
+        connection.execute("CREATE TABLE metadata (name text, value text)")
+        connection.execute("CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)")
+        connection.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+
+        connection.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+
+        # O .mbtiles usa o esquema TMS, em que as linhas são contadas a partir do sul
+        connection.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", (
+            (z, x, (1 << z) - 1 - y, gzip.compress(data, mtime=0))
+            for (z, x, y), data in sorted(tiles.items())
+        ))
+
+    connection.close()
+
+    os.replace(tmp_fname, fname)
@@ -0,0 +1,293 @@
+'''
+Espera o Mapbox terminar de processar os tilesets enviados
+por process_tilesets.py antes de gerar as imagens estáticas.
+
+O envio de um tileset só termina quando o Mapbox acaba de
+processá-lo, o que pode levar de poucos minutos a mais de
+meia hora. Em vez de esperar um tempo fixo, este script
+consulta o estado de cada upload (API de uploads) e de cada
+job de publicação (MTS) registrado em envios.json, com
+intervalos que crescem a cada consulta, até que todos os
+tilesets usados nas imagens estáticas estejam prontos, ou
+até o tempo máximo de espera. O script sempre termina com
+sucesso, para que as etapas seguintes do update_data.sh rodem
+mesmo quando o Mapbox atrasa ou falha.
+
+process_tilesets.py registra cada tileset no manifesto assim
+que o envio termina. Se o Mapbox não conseguir processar um
+envio, ou se ele não ficar pronto a tempo, o tileset é removido
+do manifesto e volta a ser enviado na próxima execução, mesmo
+que a sua entrada não tenha mudado.
+
+O endereço da API é o mesmo de mts.py, e pode ser trocado
+pela variável de ambiente MAPBOX_API_URL.
+
+Veja mais:
+
+https://docs.mapbox.com/api/maps/uploads/#retrieve-upload-status
+https://docs.mapbox.com/api/maps/mapbox-tiling-service/#retrieve-information-about-a-single-tileset-job
+'''
+
+import json
+import mapbox_credentials
+import mts
+import os
+import process_tilesets
+import requests
+import time
+
+
+###########################
+### Rename os functions ###
+### for readability     ###
+###########################
+
+abspath = os.path.abspath
+dirname = os.path.dirname
+
+
+###############
+### Globals ###
+###############
+
+PROJECT_ROOT = dirname(abspath(dirname(__file__)))
+
+TOKEN = mapbox_credentials.token
+
+USERNAME = "infoamazonia"
+
+SUBMISSIONS = process_tilesets.SUBMISSIONS
+
+# Tilesets que aparecem nos estilos usados por process_tweet_images.py
+IMAGE_TILESETS = process_tilesets.IMAGE_TILESETS
+
+# Intervalo entre as consultas, em segundos: começa em FIRST_DELAY
+# e dobra a cada rodada, até MAX_DELAY
+FIRST_DELAY = 15
+MAX_DELAY = 120
+
+# Tempo máximo de espera, em segundos
+TIMEOUT = 60 * 60
+
+
+###############
+### Helpers ###
+###############
+
+def upload_done(upload_id, token):
+    '''
+    Consulta a API de uploads. Retorna True se o upload já
+    foi processado e False se ainda está em andamento. Levanta
+    RuntimeError se o Mapbox não conseguiu processá-lo.
+    '''
+
+    response = requests.get(f"{mts.API_URL}/uploads/v1/{USERNAME}/{upload_id}", params={"access_token": token}, timeout=60)
+    response.raise_for_status()
+
+    status = response.json()
+
+    if status.get("error"):
+        raise RuntimeError(f"Upload {upload_id} failed: {status['error']}")
+
+    return bool(status.get("complete"))
+
+
+def job_done(tileset, job_id, token):
+    '''
+    Consulta o job de publicação de um tileset no MTS. Retorna
+    True se ele terminou e False se ainda está em andamento.
+    Levanta RuntimeError se a publicação falhou.
+    '''
+
+    stage = mts.job_status(f"{USERNAME}.{tileset}", job_id, token)
+
+    if stage == "failed":
+        raise RuntimeError(f"MTS job {job_id} of {tileset} failed")
+
+    return stage == "success"
+
+
+def is_done(tileset, submission, token):
+    '''
+    Verifica se um envio registrado em SUBMISSIONS terminou.
+    Erros de rede e respostas 5xx contam como 'ainda não',
+    e o envio é consultado de novo na próxima rodada. Levanta
+    RuntimeError se o envio falhou ou se a API não o conhece.
+    '''
+
+    try:
+        if submission["api"] == "mts":
+            return job_done(tileset, submission["id"], token)
+        return upload_done(submission["id"], token)
+
+    # As mensagens não incluem a URL, que tem o token de acesso
+    except requests.HTTPError as error:
+        status = error.response.status_code if error.response is not None else None
+        if status is not None and status < 500:
+            raise RuntimeError(f"Submission {submission['id']} of {tileset} returned HTTP {status}")
+        print(f"> {tileset}: HTTP {status or '?'}, retrying")
+
+    except requests.RequestException as error:
+        print(f"> {tileset}: {type(error).__name__}, retrying")
+
+    return False
+
+
+def forget(tilesets, submissions):
+    '''
+    Remove tilesets do manifesto de process_tilesets.py, para
+    que eles sejam enviados de novo na próxima execução. Nos
+    tilesets do MTS, apaga também o registro dos focos que já
+    estão na fonte, e a fonte inteira é substituída.
+
+    Parâmetros:
+
+    > tilesets: lista com os nomes dos tilesets
+
+    > submissions: dicionário no formato de SUBMISSIONS
+    '''
+
+    if not tilesets:
+        return
+
+    manifest = process_tilesets.read_manifest()
+
+    for tileset in tilesets:
+        key = "mts" if submissions[tileset]["api"] == "mts" else "tilesets"
+        manifest[key].pop(tileset, None)
+
+        state_fname = f"{process_tilesets.DELTA_DIR}/{tileset}/fonte_mts.feather"
+        if key == "mts" and os.path.isfile(state_fname):
+            os.remove(state_fname)
+
+        print(f"> {tileset}: removed from the manifest, it will be sent again in the next run")
+
+    process_tilesets.save_manifest(manifest)
+
+
+##########################
+### Funções principais ###
+##########################
+
+def wait(submissions, token, timeout=TIMEOUT, first_delay=FIRST_DELAY, max_delay=MAX_DELAY):
+    '''
+    Consulta os envios até que todos estejam prontos. A espera
+    entre as rodadas de consultas dobra a cada rodada, até
+    max_delay. Retorna quantos segundos a espera levou. Envios
+    que falharam ou que não ficaram prontos a tempo são removidos
+    do manifesto; nesses casos, levanta RuntimeError ou TimeoutError
+    depois que os demais envios terminarem.
+
+    Parâmetros:
+
+    > submissions: dicionário no formato {tileset: {"api": 'uploads' ou 'mts', "id": id}}
+
+    > token: o token de acesso do Mapbox
+
+    > timeout: o tempo máximo de espera, em segundos
+
+    > first_delay, max_delay: a menor e a maior espera entre as rodadas, em segundos
+    '''
+
+    start = time.monotonic()
+    pending = dict(submissions)
+    failed = [ ]
+    delay = first_delay
+
+    while True:
+
+        for tileset, submission in list(pending.items()):
+
+            try:
+                done = is_done(tileset, submission, token)
+
+            except RuntimeError as error:
+                print(f"> {tileset}: {error}")
+                failed.append(tileset)
+                del pending[tileset]
+                continue
+
+            if done:
+                print(f"> {tileset}: ready after {time.monotonic() - start:.0f}s")
+                del pending[tileset]
+
+        if not pending:
+            forget(failed, submissions)
+            if failed:
+                raise RuntimeError(f"Tilesets failed: {', '.join(failed)}")
+            return time.monotonic() - start
+
+        remaining = timeout - (time.monotonic() - start)
+
+        if remaining <= 0:
+            forget(failed + list(pending), submissions)
+            raise TimeoutError(f"Tilesets not ready after {timeout}s: {', '.join(pending)}")
+
+        print(f"> Waiting for {len(pending)} tilesets, checking again in {min(delay, remaining):.0f}s")
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def check_failures(submissions, token):
+    '''
+    Consulta cada envio uma única vez, sem esperar os que
+    ainda estão em andamento, e remove do manifesto os que
+    falharam. Retorna a lista dos tilesets que falharam.
+
+    Parâmetros:
+
+    > submissions: dicionário no formato de SUBMISSIONS
+
+    > token: o token de acesso do Mapbox
+    '''
+
+    failed = [ ]
+
+    for tileset, submission in submissions.items():
+        try:
+            is_done(tileset, submission, token)
+        except RuntimeError as error:
+            print(f"> {tileset}: {error}")
+            failed.append(tileset)
+
+    forget(failed, submissions)
+
+    return failed
+
+
+################
+### Execução ###
+################
+
+def main():
+
+    if not os.path.isfile(SUBMISSIONS):
+        print(">> No tileset submissions recorded, nothing to wait for")
+        return
+
+    with open(SUBMISSIONS) as f:
+        submissions = json.load(f)
+
+    images = {tileset: submission for tileset, submission in submissions.items() if tileset in IMAGE_TILESETS}
+    others = {tileset: submission for tileset, submission in submissions.items() if tileset not in IMAGE_TILESETS}
+
+    print(f">> Waiting for {len(images)} tilesets used in the static images")
+
+    # Um envio lento ou que falhou não cancela os alertas do dia: os tilesets que
+    # falharam já saíram do manifesto e as imagens usam os últimos tiles publicados
+    try:
+        elapsed = wait(images, TOKEN)
+        print(f">> All tilesets ready in {elapsed:.0f}s")
+
+    except (RuntimeError, TimeoutError) as error:
+        print(f">> {error}. The static images will use the last published tiles")
+
+    # Os demais tilesets não bloqueiam as imagens, mas os que já falharam são reenviados na próxima execução
+    print(f">> Checking the other {len(others)} tilesets")
+
+    check_failures(others, TOKEN)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,5 +9,5 @@ python process_tweet_variables.py &&
 python process_tweet_images.py &&
 python process_tweet_content.py &&
 cd ..
-cp -r -f -T /home/amazonia-sufocada/output /home/amazonia-sufocada-static-output
+python code/generations.py publish /home/amazonia-sufocada-static-output
 